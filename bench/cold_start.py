@@ -0,0 +1,60 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Time from a fresh interpreter importing the app to its first response:
+#
+#     python -m bench.cold_start
+#
+# Every run is a new process, like a cold serverless invocation. Reports the
+# import time, the first request (which opens the first database connection)
+# and, for comparison, what reflecting the schema at import used to add.
+
+CHILD = """
+import json, time
+start = time.perf_counter()
+from src.api.server import app
+from fastapi.testclient import TestClient
+imported = time.perf_counter()
+response = TestClient(app).get("/movies/44")
+assert response.status_code == 200, response.text
+responded = time.perf_counter()
+
+import sqlalchemy
+from src import database as db
+reflect_start = time.perf_counter()
+sqlalchemy.MetaData().reflect(db.engine, only=list(db.metadata_obj.tables))
+reflected = time.perf_counter()
+
+print(json.dumps({
+    "import": imported - start,
+    "first response": responded - imported,
+    "import to first response": responded - start,
+    "reflection": reflected - reflect_start,
+}))
+"""
+
+
+def run_once():
+    out = subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", CHILD],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    print(f"{args.runs} cold starts")
+    print(f"{'phase':>26} {'median ms':>10} {'max ms':>8}")
+    for phase in runs[0]:
+        times = [run[phase] * 1000 for run in runs]
+        print(f"{phase:>26} {statistics.median(times):10.1f} {max(times):8.1f}")
@@ -0,0 +1,69 @@
+import argparse
+import time
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+from src.api import fastjson
+from src.api.server import app
+
+# Rendering each read endpoint's JSON, FastAPI's way against src/api/fastjson.py:
+#
+#     python -m bench.json_render
+#
+# FastAPI's way is jsonable_encoder followed by JSONResponse, which is what the
+# routes went through before. Payloads are fetched from the running database
+# (or the memory read engine with READ_ENGINE=memory), and each one is checked
+# to render to the same bytes both ways.
+
+endpoints = [
+    "/characters/?limit=250",
+    "/characters/?limit=250&sort=number_of_lines",
+    "/characters/2",
+    "/characters:batch?ids=" + ",".join(str(id) for id in range(250)),
+    "/characters/2/lines",
+    "/movies/?limit=250&sort=rating",
+    "/movies/44",
+    "/movies:batch?ids=" + ",".join(str(id) for id in range(250)),
+    "/lines/92",
+    "/lines:batch?ids=" + ",".join(str(id) for id in range(250)),
+    "/lines/conversations/0",
+    "/lines/search?q=never&limit=250",
+]
+
+
+def timed(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def fastapi_render(content):
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    client = TestClient(app)
+    renderer = "orjson" if fastjson.orjson is not None else "json"
+    print(f"rendering with {renderer}, ms per response")
+    print(f"{'endpoint':>48} {'KiB':>7} {'fastapi':>8} {'fastjson':>9} {'speedup':>8}")
+    for url in endpoints:
+        response = client.get(url)
+        assert response.status_code == 200, (url, response.text)
+        content = response.json()
+        body = fastapi_render(content)
+        assert fastjson.dumps(content) == body, url
+        assert response.content == body, url
+
+        before = timed(lambda: fastapi_render(content), args.repeat)
+        after = timed(lambda: fastjson.dumps(content), args.repeat)
+        name = url if len(url) <= 48 else url[:45] + "..."
+        print(
+            f"{name:>48} {len(body) / 1024:7.1f} {before:8.3f} {after:9.3f}"
+            f" {before / after:7.1f}x"
+        )
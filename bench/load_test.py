@@ -0,0 +1,111 @@
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+import httpx
+
+# Load test comparing DB_MODE=sync (blocking connections in the threadpool)
+# with DB_MODE=async (asyncpg on the event loop):
+#
+#     python -m bench.load_test
+#
+# Starts the API with uvicorn once per mode, then has --concurrency clients
+# request a mix of read endpoints for --duration seconds and reports
+# throughput and latency percentiles for each mode.
+
+PORT = 8765
+
+
+def urls(rng):
+    return rng.choice(
+        [
+            f"/movies/{rng.randint(0, 616)}",
+            f"/characters/{rng.randint(0, 9034)}",
+            f"/lines/{rng.randint(0, 300000)}",
+            f"/lines/conversations/{rng.randint(0, 83097)}",
+            "/movies/?sort=rating&limit=50",
+            f"/characters/?sort=number_of_lines&offset={rng.randint(0, 5000)}",
+        ]
+    )
+
+
+def start_server(mode, env=None):
+    env = dict(os.environ, DB_MODE=mode, **(env or {}))
+    env.pop("READ_ENGINE", None)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.api.server:app", "--port", str(PORT),
+         "--log-level", "warning"],
+        env=env,
+    )
+    for _ in range(100):
+        try:
+            httpx.get(f"http://127.0.0.1:{PORT}/movies/0")
+            return server
+        except httpx.TransportError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("server did not start")
+
+
+async def client(http, rng, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            response = await http.get(urls(rng))
+        except httpx.TransportError as e:
+            errors.append(type(e).__name__)
+            continue
+        if response.status_code >= 500:
+            errors.append(response.status_code)
+        latencies.append(time.perf_counter() - start)
+
+
+async def load(concurrency, duration):
+    latencies = []
+    errors = []
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{PORT}", limits=limits, timeout=60
+    ) as http:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(
+            *(
+                client(http, random.Random(i), deadline, latencies, errors)
+                for i in range(concurrency)
+            )
+        )
+    return latencies, errors
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--modes", nargs="+", default=["sync", "async"])
+    args = parser.parse_args()
+
+    print(f"{args.concurrency} clients for {args.duration:g}s")
+    print(
+        f"{'mode':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        f" {'errors':>7}"
+    )
+    for mode in args.modes:
+        server = start_server(mode)
+        try:
+            latencies, errors = asyncio.run(load(args.concurrency, args.duration))
+        finally:
+            server.terminate()
+            server.wait()
+        latencies.sort()
+        print(
+            f"{mode:>6} {len(latencies) / args.duration:8.1f} "
+            f"{percentile(latencies, 0.50):8.2f} {percentile(latencies, 0.95):8.2f} "
+            f"{percentile(latencies, 0.99):8.2f} {len(errors):7d}"
+        )
@@ -0,0 +1,170 @@
+import argparse
+import csv
+import time
+from src import database as db
+from src import memstore
+from src.datatypes import Character, Movie
+import sqlalchemy
+
+# Substring search over character names and movie titles on the shipped corpus
+# scaled up --scale times (100 by default):
+#
+#     python -m bench.name_search
+#
+# Times the memory read engine's `name` filter with and without its trigram
+# index, and, when the database has pg_trgm, ilike on scaled copies of the
+# characters and movies tables before and after the GIN indexes from
+# migrations/0003_name_trigram_indexes.sql.
+
+names = ["an", "amy", "the", "john", "space", "doctor", "zzz"]
+
+
+class NoIndex:
+    def candidates(self, name):
+        return None
+
+
+def scaled_store(scale):
+    store = memstore.Store()
+    with open("movies.csv", encoding="utf-8") as f:
+        movies = list(csv.DictReader(f))
+    with open("characters.csv", encoding="utf-8") as f:
+        characters = list(csv.DictReader(f))
+
+    for k in range(scale):
+        for row in movies:
+            id = int(row["movie_id"]) + k * 100000
+            title = row["title"] if k == 0 else f"{row['title']} {k}"
+            store.movies[id] = Movie(id, title, row["year"], 0.0, 0, "")
+            store.movie_titles.add(id, title)
+        for row in characters:
+            id = int(row["character_id"]) + k * 100000
+            movie_id = int(row["movie_id"]) + k * 100000
+            store.characters[id] = Character(id, row["name"], movie_id, None, None, 1)
+            store.character_names.add(id, row["name"])
+    store._sort_movies()
+    return store
+
+
+def timed(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def bench_memstore(scale, repeat):
+    store = scaled_store(scale)
+    print(
+        f"memory engine, {len(store.characters)} characters,"
+        f" {len(store.movies)} movies"
+    )
+    print(
+        f"{'name':>8} {'endpoint':>12} {'scan ms':>9} {'index ms':>9}"
+        f" {'speedup':>8}"
+    )
+    for name in names:
+        for endpoint, call in [
+            (
+                "characters",
+                lambda: store.list_characters(name, 50, 0, "number_of_lines"),
+            ),
+            ("movies", lambda: store.list_movies(name, 50, 0, "rating")),
+        ]:
+            indexes = store.character_names, store.movie_titles
+            indexed = timed(call, repeat)
+            store.character_names, store.movie_titles = NoIndex(), NoIndex()
+            scan = timed(call, repeat)
+            store.character_names, store.movie_titles = indexes
+            print(
+                f"{name:>8} {endpoint:>12} {scan:9.3f} {indexed:9.3f}"
+                f" {scan / indexed:7.1f}x"
+            )
+
+
+def explain_ms(conn, table, column, name):
+    plan = conn.execute(
+        sqlalchemy.text(
+            f"EXPLAIN (ANALYZE, FORMAT JSON) SELECT * FROM {table} "
+            f"WHERE {column} ILIKE :pattern ORDER BY {column} LIMIT 50"
+        ),
+        {"pattern": f"%{name}%"},
+    ).scalar()
+    return plan[0]["Execution Time"]
+
+
+def bench_postgres(scale, repeat):
+    with db.engine.begin() as conn:
+        available = conn.execute(
+            sqlalchemy.text(
+                "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+            )
+        ).first()
+        if available is None:
+            print("postgres: pg_trgm is not available, skipping")
+            return
+        conn.execute(sqlalchemy.text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+        # Scratch copies that disappear with the transaction
+        conn.execute(
+            sqlalchemy.text(
+                "CREATE TEMP TABLE bench_characters ON COMMIT DROP AS "
+                "SELECT character_id + k * 100000 AS character_id, name "
+                "FROM characters, generate_series(0, :scale - 1) AS k"
+            ),
+            {"scale": scale},
+        )
+        conn.execute(
+            sqlalchemy.text(
+                "CREATE TEMP TABLE bench_movies ON COMMIT DROP AS "
+                "SELECT movie_id + k * 100000 AS movie_id, title || ' ' || k AS title "
+                "FROM movies, generate_series(0, :scale - 1) AS k"
+            ),
+            {"scale": scale},
+        )
+        conn.execute(sqlalchemy.text("ANALYZE bench_characters, bench_movies"))
+
+        tables = [("bench_characters", "name"), ("bench_movies", "title")]
+        before = {
+            (table, name): min(
+                explain_ms(conn, table, column, name) for _ in range(repeat)
+            )
+            for table, column in tables
+            for name in names
+        }
+        for table, column in tables:
+            conn.execute(
+                sqlalchemy.text(
+                    f"CREATE INDEX ON {table} USING gin ({column} gin_trgm_ops)"
+                )
+            )
+        conn.execute(sqlalchemy.text("ANALYZE bench_characters, bench_movies"))
+
+        print(f"postgres, scale {scale}")
+        print(
+            f"{'name':>8} {'table':>16} {'scan ms':>9} {'index ms':>9}"
+            f" {'speedup':>8}"
+        )
+        for table, column in tables:
+            for name in names:
+                scan = before[(table, name)]
+                indexed = min(
+                    explain_ms(conn, table, column, name) for _ in range(repeat)
+                )
+                print(
+                    f"{name:>8} {table:>16} {scan:9.3f} {indexed:9.3f}"
+                    f" {scan / indexed:7.1f}x"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--skip-postgres", action="store_true")
+    args = parser.parse_args()
+
+    bench_memstore(args.scale, args.repeat)
+    if not args.skip_postgres:
+        bench_postgres(args.scale, args.repeat)
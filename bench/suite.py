@@ -0,0 +1,423 @@
+import argparse
+import asyncio
+import collections
+import contextlib
+import csv
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+import sqlalchemy
+from starlette.routing import Match
+from bench.load_test import PORT, percentile, start_server
+from src import database as db
+from src import loader
+from src.api.server import app
+
+# Benchmarks every route of the API, for comparing one commit with another:
+#
+#     python -m bench.suite --seed 1 10 100 > results.json
+#     python -m bench.suite --seed 1 --compare results.json
+#
+# --seed loads the shipped CSVs into the configured database, replacing its
+# tables, with synthetic lines: between 2 and 5 a conversation at scale 1,
+# about as many as the real corpus, and that many times more at larger
+# scales. The lines are generated from a fixed seed, so every run at a scale
+# has the same data. Without --seed the database is benchmarked as it is, and
+# only the reads are: the writes would add to it on every run, and no two
+# runs would measure the same data.
+#
+# For each scale the API is started with uvicorn, and each route gets
+# --requests requests from --concurrency clients, after a warm up round. The
+# requests are the ones the tests under test/ make, with the parameters of
+# their fixtures, and writes go last so reads see the same data every time.
+# The response cache is off, so the database work is measured on every
+# request, unless --cache is given.
+#
+# Since --seed drops the tables and then the writes add conversations, the
+# suite refuses to run against a database that isn't on this machine unless
+# --yes-drop is given. Point it at a throwaway one, like a local pgserver,
+# with DATABASE_URL.
+#
+# Results are written to standard output as JSON: throughput and latency
+# percentiles by route, with the commit and settings they were measured
+# with. --compare reads an earlier run's results and exits with status 1 when
+# a route's p95 latency got more than --threshold worse.
+
+WORDS = (
+    "I you what the a to it is no yes not that here there now never always why "
+    "how where go come back home money time right wrong sorry please thanks "
+    "know think want need love kill tell look wait stop listen hell god man"
+).split()
+
+SHIPPED = ["movies", "characters", "conversations"]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Latency differences under this many milliseconds are noise, not regressions
+MIN_REGRESSION_MS = 1.0
+
+CONVERSATION = {
+    "character_1_id": 208,
+    "character_2_id": 209,
+    "lines": [
+        {"character_id": 208, "line_text": "test"},
+        {"character_id": 209, "line_text": "shut up"},
+    ],
+}
+
+
+def write_lines(path, scale, seed=0):
+    """
+    Writes synthetic lines for the shipped conversations to `path` and returns
+    how many there are.
+    """
+    rng = random.Random(seed)
+    line_id = 0
+    conversations = os.path.join(ROOT, "conversations.csv")
+    with open(conversations, newline="", encoding="utf-8") as f, open(
+        path, "w", newline="", encoding="utf-8"
+    ) as out:
+        writer = csv.writer(out)
+        writer.writerow(
+            [
+                "line_id",
+                "character_id",
+                "movie_id",
+                "conversation_id",
+                "line_sort",
+                "line_text",
+            ]
+        )
+        for row in csv.DictReader(f):
+            for line_sort in range(1, rng.randint(2, 5) * scale + 1):
+                # The two characters take turns
+                speaker = row["character1_id" if line_sort % 2 else "character2_id"]
+                text = " ".join(rng.choices(WORDS, k=rng.randint(2, 12)))
+                writer.writerow(
+                    [
+                        line_id,
+                        speaker,
+                        row["movie_id"],
+                        row["conversation_id"],
+                        line_sort,
+                        text,
+                    ]
+                )
+                line_id += 1
+    return line_id
+
+
+def seed(scale):
+    directory = tempfile.mkdtemp(prefix="bench-")
+    try:
+        for name in SHIPPED:
+            shutil.copy(os.path.join(ROOT, f"{name}.csv"), directory)
+        write_lines(os.path.join(directory, "lines.csv"), scale)
+        # The results go to standard output, and the loader's progress to stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            loader.load(directory, drop=True)
+    finally:
+        shutil.rmtree(directory)
+
+
+def is_local(url):
+    url = sqlalchemy.engine.make_url(url)
+    # No host is a Unix socket
+    return url.host in (None, "", "localhost", "127.0.0.1", "::1")
+
+
+def row_counts():
+    tables = [db.movies, db.characters, db.conversations, db.lines]
+    with db.engine.connect() as conn:
+        return {
+            table.name: conn.execute(
+                sqlalchemy.select(sqlalchemy.func.count()).select_from(table)
+            ).scalar_one()
+            for table in tables
+        }
+
+
+def fixture_urls(resource):
+    # The fixtures are named after the request they're the response to: an
+    # id, root for the list, or the list's query string
+    urls = []
+    for name in sorted(os.listdir(os.path.join(ROOT, "test", resource))):
+        name = name[: -len(".json")]
+        if name.startswith(f"{resource}-"):
+            name = name[len(resource) + 1 :]
+        if name == "root":
+            urls.append(f"/{resource}/")
+        elif "=" in name:
+            urls.append(f"/{resource}/?{name}")
+        else:
+            urls.append(f"/{resource}/{name}")
+    return urls
+
+
+def fixture_ids(urls):
+    ids = [url.rsplit("/", 1)[1] for url in urls]
+    return ",".join(id for id in ids if id.isdigit())
+
+
+def requests(writes=True):
+    """
+    The (method, url, body) of every request the suite makes, reads first,
+    leaving out the writes unless `writes`.
+    """
+    movies = fixture_urls("movies")
+    characters = fixture_urls("characters")
+    reads = [
+        *movies,
+        f"/movies:batch?ids={fixture_ids(movies)}",
+        *characters,
+        f"/characters:batch?ids={fixture_ids(characters)}",
+        "/characters/6957/lines",
+        "/characters/2/lines?limit=100",
+        "/characters/2/lines?format=ndjson",
+        "/lines/92",
+        "/lines:batch?ids=" + ",".join(str(id) for id in range(0, 25000, 100)),
+        "/lines/conversations/0",
+        "/lines/conversations/0?limit=2",
+        "/lines/search?q=never",
+        "/lines/search?q=money+time&limit=250",
+        "/export/movies",
+        "/export/characters?format=ndjson",
+        "/export/conversations?format=parquet",
+        "/metrics",
+        "/",
+        "/pyversion/",
+        "/pkgsize/",
+    ]
+    posts = [
+        ("POST", "/movies/13/conversations/", CONVERSATION),
+        ("POST", "/movies/13/conversations:batch", [CONVERSATION, CONVERSATION]),
+    ]
+    return [("GET", url, None) for url in reads] + (posts if writes else [])
+
+
+def route_of(method, url):
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": url.partition("?")[0],
+        "root_path": "",
+    }
+    for route in app.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return f"{method} {route.path}"
+    raise SystemExit(f"no route for {method} {url}")
+
+
+def by_route(writes=True):
+    """
+    The requests grouped by the route they go to, in order. Every route the
+    API defines has to have some, or every GET route unless `writes`.
+    """
+    grouped = collections.defaultdict(list)
+    for method, url, body in requests(writes):
+        grouped[route_of(method, url)].append((method, url, body))
+
+    missing = [
+        f"{method} {route.path}"
+        for route in app.routes
+        if route.endpoint.__module__.startswith("src.api")
+        for method in sorted(route.methods - {"HEAD"})
+        if (writes or method == "GET") and f"{method} {route.path}" not in grouped
+    ]
+    if missing:
+        raise SystemExit(f"no requests for {', '.join(missing)}")
+    return grouped
+
+
+def summarize(latencies, statuses, errors, seconds):
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": {str(status): n for status, n in sorted(statuses.items())},
+        "throughput": len(latencies) / seconds,
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else None,
+        "p50_ms": percentile(latencies, 0.50) if latencies else None,
+        "p95_ms": percentile(latencies, 0.95) if latencies else None,
+        "p99_ms": percentile(latencies, 0.99) if latencies else None,
+    }
+
+
+async def bench_route(http, route_requests, count, concurrency):
+    for method, url, body in route_requests:
+        await http.request(method, url, json=body)
+
+    # Cycled through in the same order on every run
+    upcoming = itertools.islice(itertools.cycle(route_requests), count)
+    latencies = []
+    statuses = collections.Counter()
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        for method, url, body in upcoming:
+            start = time.perf_counter()
+            try:
+                response = await http.request(method, url, json=body)
+            except httpx.TransportError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] += 1
+            if response.status_code >= 500:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return summarize(latencies, statuses, errors, time.perf_counter() - start)
+
+
+async def bench_routes(grouped, count, concurrency):
+    results = {}
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{PORT}", limits=limits, timeout=300
+    ) as http:
+        for route, route_requests in grouped.items():
+            result = await bench_route(http, route_requests, count, concurrency)
+            results[route] = result
+            print(
+                f"{route:<45} {result['throughput']:9.1f} req/s"
+                f" p95 {result['p95_ms'] or 0:9.2f} ms",
+                file=sys.stderr,
+            )
+    return results
+
+
+def commit():
+    def git(*args):
+        return subprocess.run(
+            ["git", *args], capture_output=True, text=True
+        ).stdout.strip()
+
+    return git("rev-parse", "HEAD") or None, bool(git("status", "--porcelain"))
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints how each route's latency changed since `baseline` and returns the
+    routes whose p95 got more than `threshold` worse.
+    """
+    if baseline["settings"] != results["settings"]:
+        print(
+            f"warning: baseline settings differ: {baseline['settings']}",
+            file=sys.stderr,
+        )
+    regressions = []
+    earlier_runs = {json.dumps(run["rows"]): run for run in baseline["runs"]}
+    for run in results["runs"]:
+        earlier = earlier_runs.get(json.dumps(run["rows"]))
+        if earlier is None:
+            print(
+                f"no baseline with the same data as scale {run['scale']}",
+                file=sys.stderr,
+            )
+            continue
+        print(f"scale {run['scale']}, against {baseline['commit']}", file=sys.stderr)
+        print(f"{'route':<45} {'p95 ms':>9} {'was':>9} {'change':>8}", file=sys.stderr)
+        for route, result in run["routes"].items():
+            before = earlier["routes"].get(route)
+            if before is None or not before["p95_ms"] or result["p95_ms"] is None:
+                continue
+            change = result["p95_ms"] / before["p95_ms"] - 1
+            regressed = (
+                change > threshold
+                and result["p95_ms"] - before["p95_ms"] > MIN_REGRESSION_MS
+            )
+            if regressed:
+                regressions.append((run["scale"], route))
+            print(
+                f"{route:<45} {result['p95_ms']:9.2f} {before['p95_ms']:9.2f}"
+                f" {change:+7.0%}{' !' if regressed else ''}",
+                file=sys.stderr,
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every route of the API.")
+    parser.add_argument(
+        "--seed",
+        type=int,
+        nargs="+",
+        metavar="SCALE",
+        help="replace the database's data with the shipped CSVs at these scales",
+    )
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync")
+    parser.add_argument(
+        "--cache", action="store_true", help="keep the response cache on"
+    )
+    parser.add_argument("--compare", metavar="BASELINE", help="earlier results")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument(
+        "--yes-drop",
+        action="store_true",
+        help="run against a database that isn't local, replacing its data",
+    )
+    args = parser.parse_args()
+    if not args.yes_drop and not is_local(db.database_connection_url()):
+        parser.error(
+            "the database isn't local, and --seed replaces its tables and the"
+            " writes add conversations to it; pass --yes-drop to go ahead"
+        )
+
+    # Only from a known starting point, see above
+    writes = args.seed is not None
+    if not writes:
+        print("not seeding, so only benchmarking the reads", file=sys.stderr)
+    grouped = by_route(writes)
+    revision, dirty = commit()
+    results = {
+        "commit": revision,
+        "dirty": dirty,
+        "python": platform.python_version(),
+        "settings": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "mode": args.mode,
+            "cache": args.cache,
+            "writes": writes,
+        },
+        "runs": [],
+    }
+    env = {} if args.cache else {"CACHE_MAX_ENTRIES": "0"}
+    for scale in args.seed or [None]:
+        if scale is not None:
+            print(f"seeding at scale {scale}", file=sys.stderr)
+            seed(scale)
+        # Before the writes add to them
+        rows = row_counts()
+        server = start_server(args.mode, env)
+        try:
+            routes = asyncio.run(bench_routes(grouped, args.requests, args.concurrency))
+        finally:
+            server.terminate()
+            server.wait()
+        results["runs"].append({"scale": scale, "rows": rows, "routes": routes})
+
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} routes regressed", file=sys.stderr)
+            sys.exit(1)
@@ -0,0 +1,27 @@
+-- Number of lines spoken by each character, so that /characters/ and
+-- /movies/{movie_id} read counts instead of aggregating the lines table on
+-- every request. add_conversation keeps it current.
+--
+-- Characters only ever speak in their own movie, so movie_id is copied from
+-- characters and the per-movie ranking is an index range scan.
+--
+-- Apply with: python -m src.migrate
+
+CREATE TABLE IF NOT EXISTS character_line_counts (
+    character_id integer PRIMARY KEY REFERENCES characters (character_id),
+    movie_id integer NOT NULL REFERENCES movies (movie_id),
+    num_lines integer NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS character_line_counts_movie_rank_idx
+    ON character_line_counts (movie_id, num_lines DESC, character_id);
+
+CREATE INDEX IF NOT EXISTS character_line_counts_rank_idx
+    ON character_line_counts (num_lines DESC, character_id);
+
+INSERT INTO character_line_counts (character_id, movie_id, num_lines)
+SELECT characters.character_id, characters.movie_id, count(*)
+FROM lines
+JOIN characters ON characters.character_id = lines.character_id
+GROUP BY characters.character_id, characters.movie_id
+ON CONFLICT (character_id) DO UPDATE SET num_lines = excluded.num_lines;
@@ -0,0 +1,42 @@
+-- Who each character talks to: number of conversations and number of lines
+-- in them, stored in both directions so /characters/{id} is a single index
+-- range scan on (character_id, lines_together DESC, partner_id).
+-- add_conversation keeps it current.
+--
+-- Apply with: python -m src.migrate
+
+CREATE TABLE IF NOT EXISTS character_pairs (
+    character_id integer NOT NULL REFERENCES characters (character_id),
+    partner_id integer NOT NULL REFERENCES characters (character_id),
+    num_conversations integer NOT NULL,
+    lines_together integer NOT NULL,
+    PRIMARY KEY (character_id, partner_id)
+);
+
+CREATE INDEX IF NOT EXISTS character_pairs_rank_idx
+    ON character_pairs (character_id, lines_together DESC, partner_id);
+
+WITH conversation_lines AS (
+    SELECT conversations.character1_id,
+           conversations.character2_id,
+           count(lines.character_id) AS num_lines
+    FROM conversations
+    JOIN lines ON lines.conversation_id = conversations.conversation_id
+    GROUP BY conversations.conversation_id
+),
+pairs AS (
+    SELECT character1_id AS character_id, character2_id AS partner_id, num_lines
+    FROM conversation_lines
+    UNION ALL
+    SELECT character2_id, character1_id, num_lines
+    FROM conversation_lines
+    WHERE character1_id <> character2_id
+)
+INSERT INTO character_pairs
+    (character_id, partner_id, num_conversations, lines_together)
+SELECT character_id, partner_id, count(*), sum(num_lines)
+FROM pairs
+GROUP BY character_id, partner_id
+ON CONFLICT (character_id, partner_id) DO UPDATE
+    SET num_conversations = excluded.num_conversations,
+        lines_together = excluded.lines_together;
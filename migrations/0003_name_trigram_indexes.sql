@@ -0,0 +1,21 @@
+-- Trigram indexes for the `name` filters on /characters/ and /movies/.
+-- ilike('%name%') cannot use a B-tree index; with these GIN indexes Postgres
+-- answers it with a bitmap index scan for any name of three or more
+-- characters, without changing the queries. See bench/name_search.py.
+--
+-- Requires extension: pg_trgm
+--
+-- Postgres builds without contrib, like bare local installs, don't have it.
+-- python -m src.migrate skips this migration there and leaves it unrecorded,
+-- so it's applied once pg_trgm is installed; the filters still work, just
+-- without the index.
+--
+-- Apply with: python -m src.migrate
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS characters_name_trgm_idx
+    ON characters USING gin (name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS movies_title_trgm_idx
+    ON movies USING gin (title gin_trgm_ops);
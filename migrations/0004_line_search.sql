@@ -0,0 +1,9 @@
+-- Full-text search over dialog for /lines/search. The tsvector is a stored
+-- generated column, so add_conversation needs no changes to keep it current.
+--
+-- Apply with: python -m src.migrate
+
+ALTER TABLE lines ADD COLUMN IF NOT EXISTS line_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', coalesce(line_text, ''))) STORED;
+
+CREATE INDEX IF NOT EXISTS lines_line_tsv_idx ON lines USING gin (line_tsv);
@@ -0,0 +1,29 @@
+-- Database-allocated ids for add_conversation, replacing SELECT max(...) + 1,
+-- which scanned both tables and handed concurrent posts the same ids.
+--
+-- Apply with: python -m src.migrate
+
+CREATE SEQUENCE IF NOT EXISTS conversations_conversation_id_seq
+    OWNED BY conversations.conversation_id;
+CREATE SEQUENCE IF NOT EXISTS lines_line_id_seq
+    OWNED BY lines.line_id;
+
+SELECT setval(
+    'conversations_conversation_id_seq',
+    greatest(
+        (SELECT max(conversation_id) FROM conversations),
+        (SELECT last_value FROM conversations_conversation_id_seq)
+    )
+);
+SELECT setval(
+    'lines_line_id_seq',
+    greatest(
+        (SELECT max(line_id) FROM lines),
+        (SELECT last_value FROM lines_line_id_seq)
+    )
+);
+
+ALTER TABLE conversations
+    ALTER COLUMN conversation_id SET DEFAULT nextval('conversations_conversation_id_seq');
+ALTER TABLE lines
+    ALTER COLUMN line_id SET DEFAULT nextval('lines_line_id_seq');
@@ -0,0 +1,15 @@
+-- A single row counting writes to the dialog data, bumped right after every
+-- add_conversation commits. ETags are built from it, and each API process
+-- checks it to notice writes made by the others.
+--
+-- Apply with: python -m src.migrate
+
+CREATE TABLE IF NOT EXISTS data_version (
+    id boolean PRIMARY KEY DEFAULT true CHECK (id),
+    version bigint NOT NULL,
+    modified timestamptz NOT NULL
+);
+
+INSERT INTO data_version (version, modified)
+VALUES (1, now())
+ON CONFLICT (id) DO NOTHING;
@@ -0,0 +1,14 @@
+-- Indexes for paging through a character's lines and a conversation's lines.
+-- /characters/{character_id}/lines reads a character's lines in line_id order
+-- and /lines/conversations/{conversation_id} a conversation's in line_sort
+-- order, each a page at a time after a cursor; with these both are an index
+-- range scan that stops after the page instead of a scan and sort of the
+-- whole lines table.
+--
+-- Apply with: python -m src.migrate
+
+CREATE INDEX IF NOT EXISTS lines_character_line_idx
+    ON lines (character_id, line_id);
+
+CREATE INDEX IF NOT EXISTS lines_conversation_sort_idx
+    ON lines (conversation_id, line_sort);
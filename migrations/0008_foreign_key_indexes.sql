@@ -0,0 +1,25 @@
+-- Indexes on the foreign keys the routes look rows up by. Postgres doesn't
+-- index the referencing side of a foreign key on its own, so without these
+-- a lookup by movie or character scans the whole table, as does every
+-- foreign key check when a referenced row is deleted.
+--
+-- lines (character_id) and lines (conversation_id) are covered by the
+-- leading columns of the indexes in 0007_line_indexes.sql.
+--
+-- Posting conversations looks up the movie's characters by movie_id. The
+-- other indexes serve the foreign key checks when a movie, character or
+-- conversation is deleted, which no route does yet. test/test_query_plans.py
+-- checks that no route's reads or writes scan a whole table, not that these
+-- indexes in particular are used.
+--
+-- Apply with: python -m src.migrate
+
+CREATE INDEX IF NOT EXISTS lines_movie_id_idx ON lines (movie_id);
+
+CREATE INDEX IF NOT EXISTS conversations_character1_id_idx
+    ON conversations (character1_id);
+
+CREATE INDEX IF NOT EXISTS conversations_character2_id_idx
+    ON conversations (character2_id);
+
+CREATE INDEX IF NOT EXISTS characters_movie_id_idx ON characters (movie_id);
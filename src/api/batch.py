@@ -0,0 +1,46 @@
+from fastapi import HTTPException
+from sqlalchemy.dialects.postgresql import ARRAY
+from src import database as db
+import sqlalchemy
+
+# Lookups of many ids in one request, for clients that would otherwise fetch
+# them one at a time. The ids are matched with a single = ANY(:ids) query, and
+# the results come back in the order the ids were asked for, with null for
+# ids that don't exist.
+
+MAX_IDS = 250
+
+
+def parse_ids(ids):
+    """
+    Returns the ids in `ids`, a comma separated list, or raises a 422 if it
+    isn't one or is too long.
+    """
+    try:
+        parsed = [int(id) for id in ids.split(",")]
+    except ValueError:
+        raise HTTPException(
+            status_code=422, detail="ids must be a comma separated list of integers."
+        )
+    if len(parsed) > MAX_IDS:
+        raise HTTPException(
+            status_code=422, detail=f"at most {MAX_IDS} ids can be looked up at once."
+        )
+    return parsed
+
+
+def any_of(column, ids):
+    """
+    `column` = ANY(:ids), leaving out ids that can't be in an integer column.
+    """
+    ids = sorted({id for id in ids if db.id_in_range(id)})
+    return column == sqlalchemy.any_(
+        sqlalchemy.bindparam(None, ids, type_=ARRAY(sqlalchemy.Integer))
+    )
+
+
+def in_order(ids, found):
+    """
+    The values in `found`, a dict by id, for each of `ids` in turn.
+    """
+    return [found.get(id) for id in ids]
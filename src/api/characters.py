@@ -1,16 +1,21 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Response
 from enum import Enum
-from collections import defaultdict
-from operator import itemgetter
 from fastapi.params import Query
 from src import database as db
+from src import memstore
+from src import cache
+from src.api import batch, fastjson, pagination, streaming
+import itertools
 import sqlalchemy
 
 router = APIRouter()
 
 
 @router.get("/characters/{id}", tags=["characters"])
-def get_character(id: int):
+@fastjson.rendered
+@cache.cached(ttl=60, tags=lambda id: [("character", id)])
+@cache.coalesced
+async def get_character(id: int):
     """
     This endpoint returns a single character by its identifier. For each character
     it returns:
@@ -30,75 +35,102 @@ def get_character(id: int):
     * `number_of_lines_together`: The number of lines the character has with the
       originally queried character.
     """
-    stmt = (
+    if memstore.store is not None:
+        json = memstore.store.get_character(id)
+        if json is None:
+            raise HTTPException(status_code=404, detail="character not found.")
+        return json
+
+    if not db.id_in_range(id):
+        raise HTTPException(status_code=404, detail="character not found.")
+
+    stmt = _character_stmt().where(db.characters.c.character_id == id)
+    rows = await db.run(lambda conn: conn.execute(stmt).all())
+
+    if not rows:
+        raise HTTPException(status_code=404, detail="character not found.")
+
+    return _character_json(rows)
+
+
+def _character_stmt():
+    partner = db.characters.alias("partner")
+    partners = db.character_pairs.join(
+        partner, partner.c.character_id == db.character_pairs.c.partner_id
+    )
+    return (
         sqlalchemy.select(
             db.characters.c.character_id,
             db.characters.c.name,
             db.movies.c.title,
             db.characters.c.gender,
+            partner.c.character_id.label("partner_id"),
+            partner.c.name.label("partner_name"),
+            partner.c.gender.label("partner_gender"),
+            db.character_pairs.c.lines_together,
         )
-        .where(db.characters.c.character_id == id)
+        .select_from(db.characters)
         .join(db.movies, db.characters.c.movie_id == db.movies.c.movie_id)
-        .group_by(db.characters.c.character_id, db.movies.c.title)
-    )
-
-    # There's probably a better way to do this with "WITH" or something
-    stmt2 = (
-        sqlalchemy.select(
-            db.conversations.c.conversation_id,
+        .outerjoin(
+            partners,
+            db.character_pairs.c.character_id == db.characters.c.character_id,
+        )
+        .order_by(
             db.characters.c.character_id,
-            db.conversations.c.character1_id,
-            db.conversations.c.character2_id,
-            sqlalchemy.func.count(db.lines.c.character_id).label("num_lines")
+            sqlalchemy.desc(db.character_pairs.c.lines_together),
+            db.character_pairs.c.partner_id,
         )
-        .where((db.conversations.c.character2_id == id) | (db.conversations.c.character1_id == id))
-        .join(db.characters, (db.conversations.c.character1_id == db.characters.c.character_id))
-        .join(db.lines, db.lines.c.conversation_id == db.conversations.c.conversation_id)
-        .group_by(db.characters.c.character_id, db.conversations.c.conversation_id)
     )
 
-    with db.engine.connect() as conn:
-        result = conn.execute(stmt) # Should only return one row
-        character_row = result.first()
-        if character_row is None:
-            raise HTTPException(status_code=404, detail="character not found.")
 
-        result2 = conn.execute(stmt2)
-        count_dict = defaultdict(int)
-        for row in result2:
-            char = row.character2_id if row.character1_id == id else row.character1_id
-            count_dict[char] += row.num_lines
-
-        result3 = conn.execute(
-            sqlalchemy.select(
-                db.characters.c.character_id,
-                db.characters.c.name,
-                db.characters.c.gender,
-            )
-            .where(db.characters.c.character_id.in_(list(count_dict.keys())))
-            .order_by(db.characters.c.character_id)
+def _character_json(rows):
+    # One row per conversation partner, already ranked by character_pairs
+    character_row = rows[0]
+    top_conversations = []
+    for row in rows:
+        if row.partner_id is None:
+            break
+        top_conversations.append(
+            {
+                "character_id": row.partner_id,
+                "character": row.partner_name,
+                "gender": row.partner_gender,
+                "number_of_lines_together": row.lines_together,
+            }
         )
-        top_conversations = []
-        for row in result3:
-            top_conversations.append(
-                {
-                    "character_id": row.character_id,
-                    "character": row.name,
-                    "gender": row.gender,
-                    "number_of_lines_together": count_dict[row.character_id],
-                }
-            )
-        # Result3 is already ordered by id. Sort by num_lines should still preserve that order.
-        top_conversations.sort(key=itemgetter("number_of_lines_together"), reverse=True)
-        json = {
-            "character_id": id,
-            "character": character_row.name,
-            "movie": character_row.title,
-            "gender": character_row.gender,
-            "top_conversations": top_conversations,
-        }
+    return {
+        "character_id": character_row.character_id,
+        "character": character_row.name,
+        "movie": character_row.title,
+        "gender": character_row.gender,
+        "top_conversations": top_conversations,
+    }
 
-    return json
+
+@router.get("/characters:batch", tags=["characters"])
+@fastjson.rendered
+@cache.cached(
+    ttl=60, tags=lambda ids: [("character", id) for id in batch.parse_ids(ids)]
+)
+@cache.coalesced
+async def get_characters(ids: str):
+    """
+    This endpoint returns several characters at once. `ids` is a comma separated
+    list of up to 250 character ids, and the response has an entry for each of
+    them in the same order: the character as `/characters/{id}` returns it, or
+    null if there is no such character.
+    """
+    ids = batch.parse_ids(ids)
+    if memstore.store is not None:
+        return [memstore.store.get_character(id) for id in ids]
+
+    stmt = _character_stmt().where(batch.any_of(db.characters.c.character_id, ids))
+    rows = await db.run(lambda conn: conn.execute(stmt).all())
+
+    found = {}
+    for character_id, group in itertools.groupby(rows, lambda row: row.character_id):
+        found[character_id] = _character_json(list(group))
+    return batch.in_order(ids, found)
 
 
 class character_sort_options(str, Enum):
@@ -107,12 +139,25 @@ class character_sort_options(str, Enum):
     number_of_lines = "number_of_lines"
 
 
+# Response field holding the sort key, for cursors
+sort_keys = {
+    character_sort_options.character: "character",
+    character_sort_options.movie: "movie",
+    character_sort_options.number_of_lines: "number_of_lines",
+}
+
+
 @router.get("/characters/", tags=["characters"])
-def list_characters(
+@fastjson.rendered
+@cache.cached(ttl=30, tags=lambda **params: ["character_line_counts"])
+@cache.coalesced
+async def list_characters(
+    response: Response,
     name: str = "",
     limit: int = Query(50, ge=1, le=250),
     offset: int = Query(0, ge=0),
     sort: character_sort_options = character_sort_options.character,
+    cursor: str = None,
 ):
     """
     This endpoint returns a list of characters. For each character it returns:
@@ -134,14 +179,33 @@ def list_characters(
     parameters are used for pagination. The `limit` query parameter specifies the
     maximum number of results to return. The `offset` query parameter specifies the
     number of results to skip before returning results.
+
+    Full pages also come with an `X-Next-Cursor` header. Passing it back as the
+    `cursor` query parameter (with the same `sort`) returns the page after it
+    without skipping rows, so deep pages are as cheap as the first one. `offset`
+    is ignored when a `cursor` is given.
     """
+    after = None
+    if cursor is not None:
+        key_type = int if sort is character_sort_options.number_of_lines else str
+        after = pagination.decode_cursor(cursor, sort.value, key_type)
+        offset = 0
+
+    if memstore.store is not None:
+        json = memstore.store.list_characters(name, limit, offset, sort.value, after)
+        pagination.set_next_cursor(
+            response, json, limit, sort.value, sort_keys[sort], "character_id"
+        )
+        return json
+
+    # Names in code point order, whatever the database's collation, like the
+    # memory read engine and the cursors it makes
     if sort is character_sort_options.character:
-        order_by = db.characters.c.name
+        order_by = db.characters.c.name.collate("C")
     elif sort is character_sort_options.movie:
-        order_by = db.movies.c.title
+        order_by = db.movies.c.title.collate("C")
     elif sort is character_sort_options.number_of_lines:
-        order_by = sqlalchemy.desc(
-            sqlalchemy.func.count(db.lines.c.character_id).label("count"))
+        order_by = sqlalchemy.desc(db.character_line_counts.c.num_lines)
     else:
         assert False
 
@@ -150,11 +214,13 @@ def list_characters(
             db.characters.c.character_id,
             db.characters.c.name,
             db.movies.c.title,
-            sqlalchemy.func.count(db.lines.c.character_id).label("num_lines"),
+            db.character_line_counts.c.num_lines,
+        )
+        .join(
+            db.character_line_counts,
+            db.characters.c.character_id == db.character_line_counts.c.character_id,
         )
-        .join(db.lines, db.characters.c.character_id == db.lines.c.character_id)
         .join(db.movies, db.characters.c.movie_id == db.movies.c.movie_id)
-        .group_by(db.characters.c.character_id, db.movies.c.title)
         .limit(limit)
         .offset(offset)
         .order_by(order_by, db.characters.c.character_id)
@@ -164,37 +230,49 @@ def list_characters(
     if name != "":
         stmt = stmt.where(db.characters.c.name.ilike(f"%{name}%"))
 
-    with db.engine.connect() as conn:
-        result = conn.execute(stmt)
-        json = []
-        for row in result:
-            json.append(
-                {
-                    "character_id": row.character_id,
-                    "character": row.name,
-                    "movie": row.title,
-                    "number_of_lines": row.num_lines,
-                }
+    # continue after the cursor's row in (order_by, character_id) order
+    if after is not None:
+        key, id = after
+        if sort is character_sort_options.number_of_lines:
+            num_lines = db.character_line_counts.c.num_lines
+            stmt = stmt.where(
+                (num_lines < key)
+                | ((num_lines == key) & (db.characters.c.character_id > id))
             )
+        else:
+            stmt = stmt.where(
+                sqlalchemy.tuple_(order_by, db.characters.c.character_id) > (key, id)
+            )
+
+    result = await db.run(lambda conn: conn.execute(stmt).all())
+    json = []
+    for row in result:
+        json.append(
+            {
+                "character_id": row.character_id,
+                "character": row.name,
+                "movie": row.title,
+                "number_of_lines": row.num_lines,
+            }
+        )
 
+    pagination.set_next_cursor(
+        response, json, limit, sort.value, sort_keys[sort], "character_id"
+    )
     return json
 
 
-@router.get("/characters/{character_id}/lines", tags=["lines", "characters"])
-def get_character_lines(character_id: int):
-    """
-    This endpoint creates a list of all lines spoken by a character. The lines
-    are in ascending order based on their line_id (aka chronologically).
-    Each line is represented by a dictionary with keys:
-    * `line_id`: the internal id of the line
-    * `character`: the name of the character speaking the line
-    * `movie`: the title of the movie the line is from
-    * `conversation_id`: the internal id of the conversation the line is from
-    * `line_text`: the text of the line
-    """
-    response = []
+line_fields = ["line_id", "character", "movie", "conversation_id", "line_text"]
 
-    stmt = (
+# Lines per page of /characters/{character_id}/lines
+LINES_PAGE_SIZE = 1000
+
+
+def _character_lines_stmt(character_id):
+    # Each line has one character and one movie, so the joins are unique per
+    # line and the lines come straight off (character_id, line_id), see
+    # migrations/0007_line_indexes.sql
+    return (
         sqlalchemy.select(
             db.lines.c.line_id,
             db.characters.c.name,
@@ -205,23 +283,91 @@ def get_character_lines(character_id: int):
         .where(db.lines.c.character_id == character_id)
         .join(db.characters, db.characters.c.character_id == db.lines.c.character_id)
         .join(db.movies, db.movies.c.movie_id == db.lines.c.movie_id)
-        .group_by(db.lines.c.line_id, db.characters.c.character_id, db.movies.c.movie_id)
         .order_by(db.lines.c.line_id)
     )
 
-    with db.engine.connect() as conn:
-        result = conn.execute(stmt)
-        for row in result:
-            if row is None:
-                raise HTTPException(status_code=404, detail="character not found")
-            response.append(
-                {
-                    "line_id": row.line_id,
-                    "character": row.name,
-                    "movie": row.title,
-                    "conversation_id": row.conversation_id,
-                    "line_text": row.line_text,
-                }
-            )
-        
-    return response
+
+def _line_json(row):
+    return {
+        "line_id": row.line_id,
+        "character": row.name,
+        "movie": row.title,
+        "conversation_id": row.conversation_id,
+        "line_text": row.line_text,
+    }
+
+
+@router.get("/characters/{character_id}/lines", tags=["lines", "characters"])
+@fastjson.rendered
+async def get_character_lines(
+    response: Response,
+    character_id: int,
+    limit: int = Query(LINES_PAGE_SIZE, ge=1, le=LINES_PAGE_SIZE),
+    cursor: str = None,
+    format: streaming.formats = None,
+    accept: str = Header(None),
+):
+    """
+    This endpoint creates a list of all lines spoken by a character. The lines
+    are in ascending order based on their line_id (aka chronologically).
+    Each line is represented by a dictionary with keys:
+    * `line_id`: the internal id of the line
+    * `character`: the name of the character speaking the line
+    * `movie`: the title of the movie the line is from
+    * `conversation_id`: the internal id of the conversation the line is from
+    * `line_text`: the text of the line
+
+    At most `limit` lines (1000 by default and at most) are returned at a time.
+    Full pages come with an `X-Next-Cursor` header; pass it back as the `cursor`
+    query parameter for the next page.
+
+    The lines can also be streamed as they are read, which keeps long lists
+    cheap, by passing `format=ndjson` (or `Accept: application/x-ndjson`) for
+    one JSON object per line, or `format=csv` (or `Accept: text/csv`) for CSV
+    with a header row. Streams have every line, they aren't paged.
+    """
+    format = streaming.requested_format(format, accept)
+    if format is streaming.formats.json:
+        return await character_lines(
+            response=response, character_id=character_id, limit=limit, cursor=cursor
+        )
+
+    if memstore.store is not None:
+        batches = streaming.batched(memstore.store.iter_character_lines(character_id))
+    else:
+        batches = _stream_character_lines(character_id)
+    return streaming.response(batches, format, line_fields)
+
+
+async def _stream_character_lines(character_id):
+    if not db.id_in_range(character_id):
+        return
+    stmt = _character_lines_stmt(character_id)
+    async with streaming.closing(db.stream(stmt)) as batches:
+        async for rows in batches:
+            yield [_line_json(row) for row in rows]
+
+
+@cache.cached(
+    ttl=60, tags=lambda character_id, **params: [("character", character_id)]
+)
+@cache.coalesced
+async def character_lines(response: Response, character_id: int, limit, cursor):
+    after = None
+    if cursor is not None:
+        after, _ = pagination.decode_cursor(cursor, "line_id", int)
+
+    if memstore.store is not None:
+        json = memstore.store.get_character_lines(character_id, limit, after)
+    elif db.id_in_range(character_id):
+        stmt = _character_lines_stmt(character_id).limit(limit)
+        # continue after the cursor's line
+        if after is not None:
+            stmt = stmt.where(db.lines.c.line_id > after)
+        result = await db.run(lambda conn: conn.execute(stmt).all())
+        json = [_line_json(row) for row in result]
+    else:
+        json = []
+
+    pagination.set_next_cursor(response, json, limit, "line_id", "line_id", "line_id")
+    return json
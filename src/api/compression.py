@@ -0,0 +1,221 @@
+from collections import OrderedDict
+from starlette.datastructures import Headers, MutableHeaders
+import hashlib
+import os
+import threading
+import zlib
+from src import metrics
+
+# Negotiated compression of text responses: JSON, NDJSON, CSV and the
+# metrics. Bodies smaller than COMPRESS_MIN_SIZE bytes (1024 by default) are
+# sent as they are, since compressing them saves less than it costs. Larger
+# ones are compressed with brotli when the client accepts it, and with gzip
+# otherwise. BROTLI_QUALITY (5) and GZIP_LEVEL (6) set how hard each one
+# tries. brotli is in requirements.txt; an install without the package only
+# ever sends gzip.
+#
+# Streamed responses are compressed a message at a time and flushed after
+# each one, so rows still reach the client as they're read.
+#
+# Cache hits render the same body every time, so compressed bodies are kept
+# by a digest of what they were compressed from. Up to COMPRESS_CACHE_ENTRIES
+# of them are kept (256 by default, 0 turns this off), and a popular response
+# is only compressed once.
+
+MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", "") or 1024)
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "") or 6)
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "") or 5)
+CACHE_ENTRIES = int(os.environ.get("COMPRESS_CACHE_ENTRIES", "") or 256)
+
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/x-ndjson",
+    "text/csv",
+    "text/plain",
+}
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Preferred first
+ENCODINGS = ["br", "gzip"] if brotli is not None else ["gzip"]
+
+compressed_responses = metrics.Counter(
+    "compressed_responses_total", "Responses sent compressed.", ["encoding"]
+)
+compressed_cache_hits = metrics.Counter(
+    "compressed_cache_hits_total",
+    "Compressed bodies served without compressing them again.",
+)
+
+
+def choose_encoding(accept_encoding):
+    """
+    The encoding to use for a request with the Accept-Encoding header
+    `accept_encoding`, or None to send the body as it is.
+    """
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    best = None
+    for encoding in ENCODINGS:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > 0 and (best is None or quality > best[1]):
+            best = (encoding, quality)
+    return best[0] if best is not None else None
+
+
+def _compress(encoding, body):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    elif encoding == "gzip":
+        # wbits 31 writes a gzip header, with no timestamp so the output is
+        # the same every time
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        return compressor.compress(body) + compressor.flush()
+    else:
+        assert False
+
+
+class _CompressedCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        # (encoding, digest) -> compressed body, least recently used first
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def compress(self, encoding, body):
+        if self.max_entries == 0:
+            return _compress(encoding, body)
+
+        key = (encoding, len(body), hashlib.blake2b(body, digest_size=16).digest())
+        with self.lock:
+            compressed = self.entries.get(key)
+            if compressed is not None:
+                self.entries.move_to_end(key)
+                compressed_cache_hits.inc()
+                return compressed
+
+        compressed = _compress(encoding, body)
+        with self.lock:
+            self.entries[key] = compressed
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return compressed
+
+
+compressed_cache = _CompressedCache(CACHE_ENTRIES)
+
+
+class _Stream:
+    # Compresses a streamed body one message at a time
+    def __init__(self, encoding):
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        elif encoding == "gzip":
+            self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        else:
+            assert False
+        self.encoding = encoding
+
+    def compress(self, data, last):
+        if self.encoding == "br":
+            out = self.compressor.process(data)
+            if last:
+                return out + self.compressor.finish()
+            return out + self.compressor.flush()
+        out = self.compressor.compress(data)
+        return out + self.compressor.flush(
+            zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+        )
+
+
+def _compressible(message):
+    if message["status"] < 200 or message["status"] in (204, 304):
+        return False
+    headers = Headers(raw=message["headers"])
+    if "content-encoding" in headers:
+        return False
+    media_type = headers.get("content-type", "").partition(";")[0].strip()
+    return media_type in COMPRESSIBLE_TYPES
+
+
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # HEAD responses have no body to compress, but say how long it is
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        start = None
+        stream = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, stream, passthrough
+            if message["type"] == "http.response.start":
+                # Held back until the first of the body shows whether it's
+                # worth compressing
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if stream is not None:
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": stream.compress(body, last=not more_body),
+                        "more_body": more_body,
+                    }
+                )
+                return
+
+            headers = MutableHeaders(scope=start)
+            if not _compressible(start):
+                passthrough = True
+            else:
+                headers.add_vary_header("Accept-Encoding")
+                passthrough = encoding is None or (
+                    not more_body and len(body) < MIN_SIZE
+                )
+            if passthrough:
+                await send(start)
+                await send(message)
+                return
+
+            headers["Content-Encoding"] = encoding
+            compressed_responses.inc(encoding=encoding)
+            if more_body:
+                # Streamed, and its length isn't known up front
+                del headers["Content-Length"]
+                stream = _Stream(encoding)
+                body = stream.compress(body, last=False)
+            else:
+                body = compressed_cache.compress(encoding, body)
+                headers["Content-Length"] = str(len(body))
+            await send(start)
+            await send(
+                {"type": "http.response.body", "body": body, "more_body": more_body}
+            )
+
+        await self.app(scope, receive, send_compressed)
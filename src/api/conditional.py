@@ -0,0 +1,95 @@
+from email.utils import formatdate, parsedate_to_datetime
+import re
+from starlette.datastructures import Headers, MutableHeaders, QueryParams
+from src import data_version
+from src.api import streaming
+
+# Conditional GETs for the data endpoints. Responses get an ETag and a
+# Last-Modified from the data version, and a request whose If-None-Match (or
+# If-Modified-Since) still matches is answered with an empty 304 instead of
+# the route's 200. Only a 200 becomes a 304, so an unknown id is still a 404
+# whatever the validators; the route runs either way, mostly as a cache hit.
+
+PREFIXES = ("/movies", "/characters", "/lines", "/export")
+
+# Routes whose format can be asked for with the Accept header as well as the
+# format parameter, see streaming.py. The same URL has a body in each format,
+# so their responses vary by Accept and the format is part of the ETag.
+NEGOTIATED = re.compile(r"/characters/[^/]+/lines")
+
+
+def _negotiated_format(scope, request_headers):
+    format = QueryParams(scope["query_string"]).get("format")
+    try:
+        format = streaming.formats(format) if format is not None else None
+    except ValueError:
+        # Rejected by the route
+        format = None
+    return streaming.requested_format(format, request_headers.get("accept"))
+
+
+def _not_modified(request_headers, etag, modified):
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or etag.removeprefix("W/") in tags
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates only have whole seconds
+        return since.tzinfo is not None and modified.replace(microsecond=0) <= since
+    return False
+
+
+class ConditionalGetMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in ("GET", "HEAD")
+            or not scope["path"].startswith(PREFIXES)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        version, modified = await data_version.current()
+        validators = {
+            "ETag": f'W/"{version}"',
+            "Last-Modified": formatdate(modified.timestamp(), usegmt=True),
+            # Always check back rather than guess from Last-Modified
+            "Cache-Control": "no-cache",
+        }
+        if NEGOTIATED.fullmatch(scope["path"]):
+            format = _negotiated_format(scope, request_headers)
+            validators["ETag"] = f'W/"{version}-{format.value}"'
+            validators["Vary"] = "Accept"
+
+        not_modified = _not_modified(request_headers, validators["ETag"], modified)
+
+        async def send_with_validators(message):
+            nonlocal not_modified
+            if message["type"] == "http.response.start":
+                if message["status"] != 200:
+                    not_modified = False
+                    await send(message)
+                    return
+                if not_modified:
+                    message = {"type": message["type"], "status": 304, "headers": []}
+                headers = MutableHeaders(scope=message)
+                for name, value in validators.items():
+                    headers[name] = value
+            elif message["type"] == "http.response.body" and not_modified:
+                # The 304 has no body, and ends with the route's
+                if message.get("more_body", False):
+                    return
+                message = {"type": message["type"], "body": b""}
+            await send(message)
+
+        await self.app(scope, receive, send_with_validators)
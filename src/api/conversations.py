@@ -1,9 +1,14 @@
 from fastapi import APIRouter, HTTPException
 from src import database as db
+from src import memstore
+from src import cache
+from src import data_version
+from src.datatypes import Conversation, Line
 from pydantic import BaseModel
 from typing import List
-from datetime import datetime
+from collections import Counter
 import sqlalchemy
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 
 # FastAPI is inferring what the request body should look like
@@ -21,9 +26,139 @@ class ConversationJson(BaseModel):
 
 router = APIRouter()
 
+# Rows per multi-row INSERT when importing a batch
+INSERT_CHUNK_SIZE = 1000
+
+# Most conversations, and lines across them, one batch can import, so that
+# one request can't hold a write transaction open for as long as it likes
+MAX_BATCH_CONVERSATIONS = 250
+MAX_BATCH_LINES = 10000
+
+
+def _check_conversations(conn, movie_id, conversations):
+    """
+    Checks that the movie exists, that every conversation is between two
+    different characters of that movie and that only those two speak in it.
+    All character ids are resolved with a single query.
+    """
+    if not db.id_in_range(movie_id):
+        raise HTTPException(status_code=404, detail="movie not found.")
+    # Out of range ids can't belong to the movie, so they fail the check below
+    character_ids = {
+        c_id
+        for conversation in conversations
+        for c_id in (conversation.character_1_id, conversation.character_2_id)
+        if db.id_in_range(c_id)
+    }
+
+    # The movie, joined to whichever of the characters belong to it
+    stmt = (
+        sqlalchemy.select(
+            db.movies.c.movie_id,
+            db.characters.c.character_id,
+        )
+        .select_from(db.movies)
+        .outerjoin(
+            db.characters,
+            (db.characters.c.movie_id == db.movies.c.movie_id)
+            & db.characters.c.character_id.in_(character_ids),
+        )
+        .where(db.movies.c.movie_id == movie_id)
+    )
+    rows = conn.execute(stmt).all()
+    if not rows:
+        raise HTTPException(status_code=404, detail="movie not found.")
+
+    # Check if the characters exist for that movie
+    movie_characters = {row.character_id for row in rows}
+    for conversation in conversations:
+        pair = {conversation.character_1_id, conversation.character_2_id}
+        if len(pair) != 2 or not pair <= movie_characters:
+            raise HTTPException(status_code=404, detail="improper characters given.")
+        for line in conversation.lines:
+            if line.character_id not in pair:
+                raise HTTPException(status_code=400, detail="wrong character in lines.")
+
+
+def _update_aggregates(conn, movie_id, conversations):
+    """
+    Adds new conversations to the aggregates in migrations/ in one upsert per
+    table. Conversations without lines don't count, like in the backfills.
+    """
+    line_counts = Counter()
+    pair_counts = Counter()
+    pair_lines = Counter()
+    for conversation in conversations:
+        if not conversation.lines:
+            continue
+        line_counts.update(line.character_id for line in conversation.lines)
+        c1_id = conversation.character_1_id
+        c2_id = conversation.character_2_id
+        for pair in ((c1_id, c2_id), (c2_id, c1_id)):
+            pair_counts[pair] += 1
+            pair_lines[pair] += len(conversation.lines)
+
+    if not line_counts:
+        return
+
+    upsert = pg_insert(db.character_line_counts).values(
+        [
+            {"character_id": c_id, "movie_id": movie_id, "num_lines": n}
+            for c_id, n in line_counts.items()
+        ]
+    )
+    conn.execute(
+        upsert.on_conflict_do_update(
+            index_elements=[db.character_line_counts.c.character_id],
+            set_={
+                "num_lines": db.character_line_counts.c.num_lines
+                + upsert.excluded.num_lines
+            },
+        )
+    )
+
+    pairs = db.character_pairs
+    upsert = pg_insert(pairs).values(
+        [
+            {
+                "character_id": c_id,
+                "partner_id": partner_id,
+                "num_conversations": n,
+                "lines_together": pair_lines[(c_id, partner_id)],
+            }
+            for (c_id, partner_id), n in pair_counts.items()
+        ]
+    )
+    conn.execute(
+        upsert.on_conflict_do_update(
+            index_elements=[pairs.c.character_id, pairs.c.partner_id],
+            set_={
+                "num_conversations": pairs.c.num_conversations
+                + upsert.excluded.num_conversations,
+                "lines_together": pairs.c.lines_together
+                + upsert.excluded.lines_together,
+            },
+        )
+    )
+
+
+def _mirror_conversation(movie_id, conv_id, conversation, line_ids):
+    # Only needed when the memory read engine is serving reads
+    if memstore.store is None:
+        return
+    memstore.store.add_conversation(
+        Conversation(conv_id, conversation.character_1_id,
+                     conversation.character_2_id, movie_id, 0),
+        [
+            Line(line_ids[line_sort], line.character_id, movie_id, conv_id,
+                 line_sort, line.line_text)
+            for line_sort, line in enumerate(conversation.lines, start=1)
+        ],
+    )
+
 
 @router.post("/movies/{movie_id}/conversations/", tags=["movies"])
-def add_conversation(movie_id: int, conversation: ConversationJson):
+async def add_conversation(movie_id: int, conversation: ConversationJson):
     """
     This endpoint adds a conversation to a movie. The conversation is represented
     by the two characters involved in the conversation and a series of lines between
@@ -38,77 +173,170 @@ def add_conversation(movie_id: int, conversation: ConversationJson):
 
     The endpoint returns the id of the resulting conversation that was created.
     """
-    stmt = (
-        sqlalchemy.select(
-            db.characters.c.character_id,
-            db.characters.c.movie_id
-        )
-        .where(((db.characters.c.character_id == conversation.character_1_id)
-                | (db.characters.c.character_id == conversation.character_2_id))
-               & (db.characters.c.movie_id == movie_id))
-    )
-
-    with db.engine.begin() as conn:
-        # Check if movie exists
-        result = conn.execute(
-            sqlalchemy.select(
-                db.movies.c.movie_id,
-            )
-            .where(db.movies.c.movie_id == movie_id)
-        )
-        result = result.first()
-        if result is None:
-            raise HTTPException(status_code=404, detail="movie not found.")
-        
-        # Check if the characters exist for that movie
-        result = conn.execute(stmt)
-        characters = []
-        for row in result:
-            characters.append(row)
-        if len(characters) != 2:
-            raise HTTPException(status_code=404, detail="improper characters given.")
-
-        # Get latest ids available
-        result = conn.execute(
-            sqlalchemy.select(
-                sqlalchemy.sql.functions.max(db.lines.c.line_id),
-            )
-        )
-        for row in result:
-            cur_id = row.max_1 + 1
-        
-        result = conn.execute(
-            sqlalchemy.select(
-                sqlalchemy.sql.functions.max(db.conversations.c.conversation_id),
-            )
-        )
-        for row in result:
-            conv_id = row.max_1 + 1
+    def insert(conn):
+        _check_conversations(conn, movie_id, [conversation])
 
-        # Insert conversation_id into conversations first due to fkey
-        result = conn.execute(
+        # Ids come from the tables' sequences (migrations/0005), so concurrent
+        # posts never collide. The conversation and all of its lines go in with
+        # a single INSERT ... SELECT from a data-modifying CTE.
+        new_conversation = (
             sqlalchemy.insert(db.conversations)
-            .values(conversation_id=conv_id,
-                    character1_id=conversation.character_1_id,
+            .values(character1_id=conversation.character_1_id,
                     character2_id=conversation.character_2_id,
                     movie_id=movie_id)
+            .returning(db.conversations.c.conversation_id)
         )
-
-        line_sort = 0
-        for l in conversation.lines:
-            line_sort += 1
-            if (l.character_id != characters[0].character_id 
-                and l.character_id != characters[1].character_id):
-                raise HTTPException(status_code=400, detail="wrong character in lines.")
+        if not conversation.lines:
+            conv_id = conn.execute(new_conversation).scalar_one()
+            line_ids = {}
+        else:
+            conv = new_conversation.cte("new_conversation")
+            new_lines = sqlalchemy.values(
+                sqlalchemy.column("character_id", sqlalchemy.Integer),
+                sqlalchemy.column("line_sort", sqlalchemy.Integer),
+                sqlalchemy.column("line_text", sqlalchemy.Text),
+                name="new_lines",
+            ).data(
+                [
+                    (line.character_id, line_sort, line.line_text)
+                    for line_sort, line in enumerate(conversation.lines, start=1)
+                ]
+            )
             result = conn.execute(
                 sqlalchemy.insert(db.lines)
-                .values(line_id=cur_id, 
-                        character_id=l.character_id,
-                        movie_id=movie_id, 
-                        conversation_id=conv_id, 
-                        line_sort=line_sort,
-                        line_text=l.line_text)
+                .from_select(
+                    ["character_id", "movie_id", "conversation_id", "line_sort",
+                     "line_text"],
+                    sqlalchemy.select(
+                        new_lines.c.character_id,
+                        sqlalchemy.literal(movie_id, sqlalchemy.Integer),
+                        conv.c.conversation_id,
+                        new_lines.c.line_sort,
+                        new_lines.c.line_text,
+                    )
+                    .select_from(conv)
+                    .join(new_lines, sqlalchemy.true())
+                    .order_by(new_lines.c.line_sort)
+                )
+                .returning(
+                    db.lines.c.line_id,
+                    db.lines.c.line_sort,
+                    db.lines.c.conversation_id,
+                )
             )
-            cur_id += 1
+            line_ids = {}
+            for row in result:
+                conv_id = row.conversation_id
+                line_ids[row.line_sort] = row.line_id
+
+        _update_aggregates(conn, movie_id, [conversation])
+        return conv_id, line_ids
+
+    conv_id, line_ids = await db.run_in_transaction(insert)
+    version = await db.run_in_transaction(data_version.bump)
+    _mirror_conversation(movie_id, conv_id, conversation, line_ids)
+    cache.invalidate_conversations(movie_id, [conversation])
+    # Last, so no response carries the new version with the old data
+    data_version.bumped(version)
 
     return {"conversation_id": conv_id}
+
+
+def _next_ids(conn, sequence, n):
+    # n fresh ids in one round trip
+    if n == 0:
+        return []
+    result = conn.execute(
+        sqlalchemy.select(sequence.next_value()).select_from(
+            sqlalchemy.func.generate_series(1, n)
+        )
+    )
+    return result.scalars().all()
+
+
+@router.post("/movies/{movie_id}/conversations:batch", tags=["movies"])
+async def add_conversations(movie_id: int, conversations: List[ConversationJson]):
+    """
+    This endpoint adds many conversations to a movie at once, for importing a
+    whole script in one request. Each conversation has the same format and is
+    checked the same way as for `/movies/{movie_id}/conversations/`. Either all
+    of them are added or, if any of them fails the checks, none are. A batch
+    can hold up to 250 conversations and 10000 lines between them.
+
+    The endpoint returns the ids of the new conversations, in the order they
+    were given.
+    """
+    if len(conversations) > MAX_BATCH_CONVERSATIONS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"at most {MAX_BATCH_CONVERSATIONS} conversations can be"
+            " imported at once.",
+        )
+    if sum(len(conversation.lines) for conversation in conversations) > (
+        MAX_BATCH_LINES
+    ):
+        raise HTTPException(
+            status_code=422,
+            detail=f"at most {MAX_BATCH_LINES} lines can be imported at once.",
+        )
+
+    def insert(conn):
+        _check_conversations(conn, movie_id, conversations)
+        if not conversations:
+            return [], []
+
+        # Allocating ids up front lets the inserts be plain multi-row INSERTs
+        # while still knowing which id belongs to which conversation and line
+        conv_ids = _next_ids(conn, db.conversation_ids, len(conversations))
+        num_lines = sum(len(conversation.lines) for conversation in conversations)
+        line_ids = iter(_next_ids(conn, db.line_ids, num_lines))
+
+        conversation_rows = []
+        line_rows = []
+        new_line_ids = []
+        for conv_id, conversation in zip(conv_ids, conversations):
+            conversation_rows.append(
+                {
+                    "conversation_id": conv_id,
+                    "character1_id": conversation.character_1_id,
+                    "character2_id": conversation.character_2_id,
+                    "movie_id": movie_id,
+                }
+            )
+            ids = {}
+            for line_sort, line in enumerate(conversation.lines, start=1):
+                ids[line_sort] = next(line_ids)
+                line_rows.append(
+                    {
+                        "line_id": ids[line_sort],
+                        "character_id": line.character_id,
+                        "movie_id": movie_id,
+                        "conversation_id": conv_id,
+                        "line_sort": line_sort,
+                        "line_text": line.line_text,
+                    }
+                )
+            new_line_ids.append(ids)
+
+        for table, rows in (
+            (db.conversations, conversation_rows),
+            (db.lines, line_rows),
+        ):
+            for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+                conn.execute(
+                    sqlalchemy.insert(table).values(rows[i : i + INSERT_CHUNK_SIZE])
+                )
+
+        _update_aggregates(conn, movie_id, conversations)
+        return conv_ids, new_line_ids
+
+    conv_ids, new_line_ids = await db.run_in_transaction(insert)
+    if not conv_ids:
+        return {"conversation_ids": []}
+    version = await db.run_in_transaction(data_version.bump)
+    for conv_id, conversation, ids in zip(conv_ids, conversations, new_line_ids):
+        _mirror_conversation(movie_id, conv_id, conversation, ids)
+    cache.invalidate_conversations(movie_id, conversations)
+    data_version.bumped(version)
+
+    return {"conversation_ids": conv_ids}
@@ -0,0 +1,152 @@
+from enum import Enum
+from fastapi import APIRouter, HTTPException
+from src import database as db
+from src.api import streaming
+import sqlalchemy
+
+router = APIRouter()
+
+
+class export_tables(str, Enum):
+    movies = "movies"
+    characters = "characters"
+    conversations = "conversations"
+    lines = "lines"
+
+
+class export_formats(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+    arrow = "arrow"
+    parquet = "parquet"
+
+
+media_types = {
+    export_formats.csv: streaming.CSV_MEDIA_TYPE,
+    export_formats.ndjson: streaming.NDJSON_MEDIA_TYPE,
+    export_formats.arrow: "application/vnd.apache.arrow.stream",
+    export_formats.parquet: "application/vnd.apache.parquet",
+}
+
+# Rows per batch read from the cursor, and per Arrow batch or Parquet row group
+BATCH_SIZE = 10000
+
+
+def _pyarrow():
+    # Optional, it's large and only needed for these two formats
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise HTTPException(
+            status_code=501, detail="arrow and parquet exports need pyarrow."
+        )
+    return pyarrow
+
+
+class _Sink:
+    # Write-only file collecting what pyarrow writes until it's taken
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _arrow_type(pa, column):
+    if isinstance(column.type, sqlalchemy.Integer):
+        return pa.int32()
+    if isinstance(column.type, sqlalchemy.Float):
+        return pa.float32()
+    return pa.string()
+
+
+async def _arrow_body(pa, stmt, columns, format):
+    schema = pa.schema([(column.name, _arrow_type(pa, column)) for column in columns])
+    sink = _Sink()
+    if format is export_formats.arrow:
+        writer = pa.ipc.new_stream(sink, schema)
+    else:
+        writer = pa.parquet.ParquetWriter(sink, schema)
+
+    async with streaming.closing(db.stream(stmt, BATCH_SIZE)) as batches:
+        async for rows in batches:
+            writer.write_table(
+                pa.Table.from_arrays(
+                    [
+                        pa.array([row[i] for row in rows], type=field.type)
+                        for i, field in enumerate(schema)
+                    ],
+                    schema=schema,
+                )
+            )
+            yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+async def _json_batches(stmt):
+    async with streaming.closing(db.stream(stmt, BATCH_SIZE)) as batches:
+        async for rows in batches:
+            yield [row._asdict() for row in rows]
+
+
+@router.get("/export/{table}", tags=["export"])
+async def export_table(
+    table: export_tables, format: export_formats = export_formats.csv
+):
+    """
+    This endpoint streams a whole table, for rebuilding the corpus in one
+    request instead of paging through the other endpoints. Rows come in no
+    particular order, with every column of the table (`lines` leaves out its
+    search index column). `format` is one of:
+    * `csv` - CSV with a header row, the default
+    * `ndjson` - one JSON object per line
+    * `arrow` - an Arrow IPC stream
+    * `parquet` - a Parquet file
+
+    `arrow` and `parquet` are only available when pyarrow is installed.
+    """
+    source = db.metadata_obj.tables[table.value]
+    columns = [column for column in source.c if column.computed is None]
+
+    if format is export_formats.csv:
+        # Straight from COPY, the fastest way out of Postgres
+        response = streaming.ClosingStreamingResponse(
+            db.copy_out(source, columns), media_type=media_types[format]
+        )
+    elif format is export_formats.ndjson:
+        response = streaming.response(
+            _json_batches(sqlalchemy.select(*columns)),
+            streaming.formats.ndjson,
+            [column.name for column in columns],
+        )
+    elif format in (export_formats.arrow, export_formats.parquet):
+        body = _arrow_body(_pyarrow(), sqlalchemy.select(*columns), columns, format)
+        response = streaming.ClosingStreamingResponse(
+            body, media_type=media_types[format]
+        )
+    else:
+        assert False
+
+    response.headers["Content-Disposition"] = (
+        f'attachment; filename="{table.value}.{format.value}"'
+    )
+    return response
@@ -0,0 +1,83 @@
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import Response
+import functools
+import json
+import re
+import time
+from src import timing
+
+# JSON responses rendered straight from what a route returns. FastAPI runs
+# jsonable_encoder over a route's return value before rendering it, which for
+# a page of plain dicts takes several times as long as rendering it. The read
+# routes only return dicts, lists, strings and numbers, so they skip it and
+# render with orjson when it's installed, otherwise with the same json.dumps
+# call Starlette's JSONResponse makes. The bytes are the same either way; see
+# bench/json_render.py.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson writes floats below 1e-4 or from 1e16 up differently than json does,
+# e.g. 1e16 for 1e+16 and 0.00001 for 1e-05. Responses with anything that
+# looks like one are rendered by json instead. Starting the pattern with a
+# literal keeps the scan fast.
+_EXPONENT = re.compile(rb"e[-0-9]")
+
+
+def _stdlib_dumps(content):
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def dumps(content):
+    """
+    `content` as the bytes FastAPI's default response would have had.
+    """
+    if orjson is not None:
+        try:
+            body = orjson.dumps(content)
+        except TypeError:
+            # Something only jsonable_encoder knows how to convert
+            return _stdlib_dumps(jsonable_encoder(content))
+        if b"0.0000" not in body and not _EXPONENT.search(body):
+            return body
+    try:
+        return _stdlib_dumps(content)
+    except TypeError:
+        return _stdlib_dumps(jsonable_encoder(content))
+
+
+class RenderedJSONResponse(Response):
+    media_type = "application/json"
+
+    def __init__(self, content, status_code=200, headers=None):
+        super().__init__(dumps(content), status_code, headers)
+
+
+def rendered(fn):
+    """
+    Renders an async route's return value with dumps(). Goes right under the
+    route decorator. Headers set on the route's `response` parameter are
+    copied over, as FastAPI only does that for values it renders itself.
+    """
+
+    @functools.wraps(fn)
+    async def wrapper(**params):
+        value = await fn(**params)
+        if isinstance(value, Response):
+            return value
+        sub_response = params.get("response")
+        headers = sub_response.headers if sub_response is not None else None
+        start = time.perf_counter()
+        response = RenderedJSONResponse(value, headers=headers)
+        timing.add_serialize(time.perf_counter() - start)
+        return response
+
+    return wrapper
@@ -1,20 +1,46 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Response
+from fastapi.params import Query
 from src import database as db
+from src import memstore
+from src import cache
+from src.api import batch, fastjson, pagination
 import sqlalchemy
 
 router = APIRouter()
 
+# Lines per page of /lines/conversations/{conversation_id}
+CONVERSATION_PAGE_SIZE = 1000
 
-@router.get("/lines/{line_id}", tags=["lines"])
-def get_line(line_id: int):
+
+# Registered before /lines/{line_id} so "search" isn't parsed as a line id
+@router.get("/lines/search", tags=["lines"])
+@fastjson.rendered
+@cache.cached(ttl=30, tags=lambda **params: ["lines"])
+async def search_lines(
+    response: Response,
+    q: str = Query(..., min_length=1),
+    limit: int = Query(50, ge=1, le=250),
+    cursor: str = None,
+):
     """
-    This endpoint returns a single line by its identifier. For each line it returns:
+    This endpoint searches the text of every line. `q` takes words, "quoted
+    phrases", `or` and `-excluded` words, like a web search. Matching lines are
+    ranked by relevance, best first, and each line is represented by a
+    dictionary with keys:
     * `line_id`: the internal id of the line
     * `line_text`: the text of the line
     * `character`: the name of the character speaking the line
     * `movie`: the title of the movie the line is from
     * `conversation_id`: the internal id of the conversation the line is from
+    * `rank`: how well the line matches `q`
+
+    The `limit` query parameter specifies the maximum number of results to
+    return. Full pages come with an `X-Next-Cursor` header; pass it back as the
+    `cursor` query parameter (with the same `q`) for the next page.
     """
+    query = sqlalchemy.func.websearch_to_tsquery("english", q)
+    rank = sqlalchemy.func.ts_rank(db.lines.c.line_tsv, query)
+
     stmt = (
         sqlalchemy.select(
             db.lines.c.line_id,
@@ -22,72 +48,208 @@ def get_line(line_id: int):
             db.characters.c.name,
             db.movies.c.title,
             db.lines.c.conversation_id,
+            rank.label("rank"),
         )
-        .where(db.lines.c.line_id == line_id)
+        .where(db.lines.c.line_tsv.op("@@")(query))
         .join(db.characters, db.characters.c.character_id == db.lines.c.character_id)
         .join(db.movies, db.movies.c.movie_id == db.lines.c.movie_id)
-        .group_by(db.lines.c.line_id, db.characters.c.character_id, db.movies.c.movie_id)
-        .order_by(db.lines.c.line_id)
+        .order_by(sqlalchemy.desc(rank), db.lines.c.line_id)
+        .limit(limit)
     )
-    response = None
-    with db.engine.connect() as conn:
-        result = conn.execute(stmt)
-        for row in result:
-            response = {
+
+    # continue after the cursor's row in (rank, line_id) order
+    if cursor is not None:
+        key, id = pagination.decode_cursor(cursor, "rank", (int, float))
+        # ts_rank is a float4, compare at that precision
+        key = sqlalchemy.cast(key, sqlalchemy.REAL)
+        stmt = stmt.where(
+            (rank < key) | ((rank == key) & (db.lines.c.line_id > id))
+        )
+
+    result = await db.run(lambda conn: conn.execute(stmt).all())
+    json = []
+    for row in result:
+        json.append(
+            {
                 "line_id": row.line_id,
                 "line_text": row.line_text,
                 "character": row.name,
                 "movie": row.title,
                 "conversation_id": row.conversation_id,
+                "rank": row.rank,
             }
+        )
 
-    if response is None:
-        raise HTTPException(status_code=404, detail="line not found")
+    pagination.set_next_cursor(response, json, limit, "rank", "rank", "line_id")
+    return json
 
-    return response
 
-
-@router.get("/lines/conversations/{conversation_id}", tags=["lines", "conversation"])
-def get_conversation(conversation_id: int):
+@router.get("/lines/{line_id}", tags=["lines"])
+@fastjson.rendered
+@cache.cached(ttl=300)
+async def get_line(line_id: int):
     """
-    This endpoint creates a list of lines given a conversation id. The lines
-    are sorted based on the internal `line_sort` value in ascending order.
-    Each line is represented by a dictionary with keys:
+    This endpoint returns a single line by its identifier. For each line it returns:
     * `line_id`: the internal id of the line
+    * `line_text`: the text of the line
     * `character`: the name of the character speaking the line
     * `movie`: the title of the movie the line is from
-    * `line_text`: the text of the line
+    * `conversation_id`: the internal id of the conversation the line is from
     """
-    response = []
+    if memstore.store is not None:
+        response = memstore.store.get_line(line_id)
+        if response is None:
+            raise HTTPException(status_code=404, detail="line not found")
+        return response
+
+    if not db.id_in_range(line_id):
+        raise HTTPException(status_code=404, detail="line not found")
 
     stmt = (
         sqlalchemy.select(
             db.lines.c.line_id,
+            db.lines.c.line_text,
             db.characters.c.name,
             db.movies.c.title,
+            db.lines.c.conversation_id,
+        )
+        .where(db.lines.c.line_id == line_id)
+        .join(db.characters, db.characters.c.character_id == db.lines.c.character_id)
+        .join(db.movies, db.movies.c.movie_id == db.lines.c.movie_id)
+    )
+    response = None
+    result = await db.run(lambda conn: conn.execute(stmt).all())
+    for row in result:
+        response = {
+            "line_id": row.line_id,
+            "line_text": row.line_text,
+            "character": row.name,
+            "movie": row.title,
+            "conversation_id": row.conversation_id,
+        }
+
+    if response is None:
+        raise HTTPException(status_code=404, detail="line not found")
+
+    return response
+
+
+@router.get("/lines:batch", tags=["lines"])
+@fastjson.rendered
+@cache.cached(ttl=300, tags=lambda **params: ["lines"])
+async def get_lines(ids: str):
+    """
+    This endpoint returns several lines at once. `ids` is a comma separated list
+    of up to 250 line ids, and the response has an entry for each of them in the
+    same order: the line as `/lines/{line_id}` returns it, or null if there is no
+    such line.
+    """
+    ids = batch.parse_ids(ids)
+    if memstore.store is not None:
+        return [memstore.store.get_line(id) for id in ids]
+
+    stmt = (
+        sqlalchemy.select(
+            db.lines.c.line_id,
             db.lines.c.line_text,
+            db.characters.c.name,
+            db.movies.c.title,
+            db.lines.c.conversation_id,
         )
-        .where(db.lines.c.conversation_id == conversation_id)
+        .where(batch.any_of(db.lines.c.line_id, ids))
         .join(db.characters, db.characters.c.character_id == db.lines.c.character_id)
         .join(db.movies, db.movies.c.movie_id == db.lines.c.movie_id)
-        .group_by(db.lines.c.line_id, db.characters.c.character_id, db.movies.c.movie_id)
-        .order_by(db.lines.c.line_sort)
     )
+    result = await db.run(lambda conn: conn.execute(stmt).all())
+
+    found = {}
+    for row in result:
+        found[row.line_id] = {
+            "line_id": row.line_id,
+            "line_text": row.line_text,
+            "character": row.name,
+            "movie": row.title,
+            "conversation_id": row.conversation_id,
+        }
+    return batch.in_order(ids, found)
+
+
+@router.get("/lines/conversations/{conversation_id}", tags=["lines", "conversation"])
+@fastjson.rendered
+@cache.cached(ttl=300)
+async def get_conversation(
+    response: Response,
+    conversation_id: int,
+    limit: int = Query(CONVERSATION_PAGE_SIZE, ge=1, le=CONVERSATION_PAGE_SIZE),
+    cursor: str = None,
+):
+    """
+    This endpoint creates a list of lines given a conversation id. The lines
+    are sorted based on the internal `line_sort` value in ascending order.
+    Each line is represented by a dictionary with keys:
+    * `line_id`: the internal id of the line
+    * `character`: the name of the character speaking the line
+    * `movie`: the title of the movie the line is from
+    * `line_text`: the text of the line
+
+    At most `limit` lines (1000 by default and at most) are returned at a time.
+    Full pages come with an `X-Next-Cursor` header; pass it back as the `cursor`
+    query parameter for the next page.
+    """
+    after = None
+    if cursor is not None:
+        after = pagination.decode_cursor(cursor, "line_sort", int)
 
-    with db.engine.connect() as conn:
-        result = conn.execute(stmt)
+    if memstore.store is not None:
+        response_json = memstore.store.get_conversation(conversation_id, limit, after)
+    elif db.id_in_range(conversation_id):
+        # Unique per line, and read off (conversation_id, line_sort), see
+        # migrations/0007_line_indexes.sql
+        stmt = (
+            sqlalchemy.select(
+                db.lines.c.line_id,
+                db.characters.c.name,
+                db.movies.c.title,
+                db.lines.c.line_text,
+                db.lines.c.line_sort,
+            )
+            .where(db.lines.c.conversation_id == conversation_id)
+            .join(
+                db.characters, db.characters.c.character_id == db.lines.c.character_id
+            )
+            .join(db.movies, db.movies.c.movie_id == db.lines.c.movie_id)
+            .order_by(db.lines.c.line_sort, db.lines.c.line_id)
+            .limit(limit)
+        )
+        # continue after the cursor's line in (line_sort, line_id) order
+        if after is not None:
+            stmt = stmt.where(
+                sqlalchemy.tuple_(db.lines.c.line_sort, db.lines.c.line_id) > after
+            )
+
+        result = await db.run(lambda conn: conn.execute(stmt).all())
+        response_json = []
         for row in result:
-            response.append(
+            response_json.append(
                 {
                     "line_id": row.line_id,
                     "character": row.name,
                     "movie": row.title,
                     "line_text": row.line_text,
+                    "line_sort": row.line_sort,
                 }
             )
+    else:
+        response_json = []
 
-    if not response:
+    # Past the last page of a conversation is empty, not missing
+    if not response_json and cursor is None:
         raise HTTPException(status_code=404, detail="conversation not found")
-    
-    return response
-    
\ No newline at end of file
+
+    pagination.set_next_cursor(
+        response, response_json, limit, "line_sort", "line_sort", "line_id"
+    )
+    # line_sort is only there for the cursor
+    for line in response_json:
+        del line["line_sort"]
+    return response_json
@@ -1,6 +1,9 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Response
 from enum import Enum
 from src import database as db
+from src import memstore
+from src import cache
+from src.api import batch, fastjson, pagination
 from fastapi.params import Query
 import sqlalchemy
 
@@ -8,7 +11,10 @@ router = APIRouter()
 
 
 @router.get("/movies/{movie_id}", tags=["movies"])
-def get_movie(movie_id: int):
+@fastjson.rendered
+@cache.cached(ttl=60, tags=lambda movie_id: [("movie", movie_id)])
+@cache.coalesced
+async def get_movie(movie_id: int):
     """
     This endpoint returns a single movie by its identifier. For each movie it returns:
     * `movie_id`: the internal id of the movie.
@@ -23,53 +29,101 @@ def get_movie(movie_id: int):
     * `num_lines`: The number of lines the character has in the movie.
 
     """
-    stmt = (
+    if memstore.store is not None:
+        result = memstore.store.get_movie(movie_id)
+        if result is None:
+            raise HTTPException(status_code=404, detail="movie not found.")
+        return result
+
+    if not db.id_in_range(movie_id):
+        raise HTTPException(status_code=404, detail="movie not found.")
+
+    stmt = _movies_stmt().where(db.movies.c.movie_id == movie_id)
+    rows = await db.run(lambda conn: conn.execute(stmt).all())
+    result = _movies_json(rows).get(movie_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="movie not found.")
+    return result
+
+
+def _movies_stmt():
+    # Each movie's top five characters, joined to it laterally so the movies
+    # and their characters come back from one query
+    top_characters = (
+        sqlalchemy.select(
+            db.character_line_counts.c.num_lines.label("count"),
+            db.character_line_counts.c.character_id,
+            db.characters.c.name,
+        )
+        .where(db.character_line_counts.c.movie_id == db.movies.c.movie_id)
+        .join(
+            db.characters,
+            db.characters.c.character_id == db.character_line_counts.c.character_id,
+        )
+        .order_by(sqlalchemy.desc(db.character_line_counts.c.num_lines))
+        .order_by(db.character_line_counts.c.character_id)
+        .limit(5)
+        .lateral()
+    )
+    return (
         sqlalchemy.select(
             db.movies.c.movie_id,
             db.movies.c.title,
+            top_characters.c.count,
+            top_characters.c.character_id,
+            top_characters.c.name,
         )
-        .where(db.movies.c.movie_id == movie_id)
-    )
-
-    stmt2 = (
-       sqlalchemy.select(
-            sqlalchemy.func.count(db.lines.c.character_id).label("count"),
-            db.lines.c.character_id,
-            db.characters.c.name,
+        .select_from(db.movies)
+        .outerjoin(top_characters, sqlalchemy.true())
+        .order_by(
+            db.movies.c.movie_id,
+            sqlalchemy.desc(top_characters.c.count),
+            top_characters.c.character_id,
         )
-        .where(db.lines.c.movie_id == movie_id)
-        .join(db.characters, db.characters.c.character_id == db.lines.c.character_id)
-        .group_by(db.lines.c.character_id, db.characters.c.name)
-        .order_by(sqlalchemy.desc("count"))
-        .order_by(db.lines.c.character_id)
-        .limit(5)
     )
 
-    result = None
-    with db.engine.connect() as conn:
-        movie = conn.execute(stmt) # How else to get the title? lol
-        top_characters = conn.execute(stmt2)
-        characters = []
-        for row in top_characters:
-            characters.append(
+
+def _movies_json(rows):
+    # movie_id -> the movie as /movies/{movie_id} returns it, from the rows of
+    # _movies_stmt()
+    found = {}
+    for row in rows:
+        movie = found.get(row.movie_id)
+        if movie is None:
+            movie = found[row.movie_id] = {
+                "movie_id": row.movie_id,
+                "title": row.title,
+                "top_characters": [],
+            }
+        if row.character_id is not None:
+            movie["top_characters"].append(
                 {
                     "character_id": row.character_id,
                     "character": row.name,
                     "num_lines": row.count,
                 }
             )
-        # Get names from ids
-        for row in movie:
-            result = {
-                "movie_id": movie_id,
-                "title": row.title,
-                "top_characters": characters,
-            }
-    
-    if result is None:
-        raise HTTPException(status_code=404, detail="movie not found.")
-    
-    return result
+    return found
+
+
+@router.get("/movies:batch", tags=["movies"])
+@fastjson.rendered
+@cache.cached(ttl=60, tags=lambda ids: [("movie", id) for id in batch.parse_ids(ids)])
+@cache.coalesced
+async def get_movies(ids: str):
+    """
+    This endpoint returns several movies at once. `ids` is a comma separated
+    list of up to 250 movie ids, and the response has an entry for each of them
+    in the same order: the movie as `/movies/{movie_id}` returns it, or null if
+    there is no such movie.
+    """
+    ids = batch.parse_ids(ids)
+    if memstore.store is not None:
+        return [memstore.store.get_movie(id) for id in ids]
+
+    stmt = _movies_stmt().where(batch.any_of(db.movies.c.movie_id, ids))
+    rows = await db.run(lambda conn: conn.execute(stmt).all())
+    return batch.in_order(ids, _movies_json(rows))
 
 
 class movie_sort_options(str, Enum):
@@ -78,13 +132,26 @@ class movie_sort_options(str, Enum):
     rating = "rating"
 
 
+# Response field holding the sort key, for cursors
+sort_keys = {
+    movie_sort_options.movie_title: "movie_title",
+    movie_sort_options.year: "year",
+    movie_sort_options.rating: "imdb_rating",
+}
+
+
 # Add get parameters
 @router.get("/movies/", tags=["movies"])
-def list_movies(
+@fastjson.rendered
+@cache.cached(ttl=60)
+@cache.coalesced
+async def list_movies(
+    response: Response,
     name: str = "",
     limit: int = Query(50, ge=1, le=250),
     offset: int = Query(0, ge=0),
     sort: movie_sort_options = movie_sort_options.movie_title,
+    cursor: str = None,
 ):
     """
     This endpoint returns a list of movies. For each movie it returns:
@@ -107,11 +174,31 @@ def list_movies(
     parameters are used for pagination. The `limit` query parameter specifies the
     maximum number of results to return. The `offset` query parameter specifies the
     number of results to skip before returning results.
+
+    Full pages also come with an `X-Next-Cursor` header. Passing it back as the
+    `cursor` query parameter (with the same `sort`) returns the page after it
+    without skipping rows, so deep pages are as cheap as the first one. `offset`
+    is ignored when a `cursor` is given.
     """
+    after = None
+    if cursor is not None:
+        key_type = (int, float) if sort is movie_sort_options.rating else str
+        after = pagination.decode_cursor(cursor, sort.value, key_type)
+        offset = 0
+
+    if memstore.store is not None:
+        json = memstore.store.list_movies(name, limit, offset, sort.value, after)
+        pagination.set_next_cursor(
+            response, json, limit, sort.value, sort_keys[sort], "movie_id"
+        )
+        return json
+
+    # Text in code point order, whatever the database's collation, like the
+    # memory read engine and the cursors it makes
     if sort is movie_sort_options.movie_title:
-        order_by = db.movies.c.title
+        order_by = db.movies.c.title.collate("C")
     elif sort is movie_sort_options.year:
-        order_by = db.movies.c.year
+        order_by = db.movies.c.year.collate("C")
     elif sort is movie_sort_options.rating:
         order_by = sqlalchemy.desc(db.movies.c.imdb_rating)
     else:
@@ -134,18 +221,35 @@ def list_movies(
     if name != "":
         stmt = stmt.where(db.movies.c.title.ilike(f"%{name}%"))
 
-    with db.engine.connect() as conn:
-        result = conn.execute(stmt)
-        json = []
-        for row in result:
-            json.append(
-                {
-                    "movie_id": row.movie_id,
-                    "movie_title": row.title,
-                    "year": row.year,
-                    "imdb_rating": row.imdb_rating,
-                    "imdb_votes": row.imdb_votes,
-                }
+    # continue after the cursor's row in (order_by, movie_id) order
+    if after is not None:
+        key, id = after
+        if sort is movie_sort_options.rating:
+            # cast so a float4 rating compares equal to its own round trip
+            key = sqlalchemy.cast(key, db.movies.c.imdb_rating.type)
+            stmt = stmt.where(
+                (db.movies.c.imdb_rating < key)
+                | ((db.movies.c.imdb_rating == key) & (db.movies.c.movie_id > id))
+            )
+        else:
+            stmt = stmt.where(
+                sqlalchemy.tuple_(order_by, db.movies.c.movie_id) > (key, id)
             )
 
+    result = await db.run(lambda conn: conn.execute(stmt).all())
+    json = []
+    for row in result:
+        json.append(
+            {
+                "movie_id": row.movie_id,
+                "movie_title": row.title,
+                "year": row.year,
+                "imdb_rating": row.imdb_rating,
+                "imdb_votes": row.imdb_votes,
+            }
+        )
+
+    pagination.set_next_cursor(
+        response, json, limit, sort.value, sort_keys[sort], "movie_id"
+    )
     return json
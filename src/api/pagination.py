@@ -0,0 +1,50 @@
+from fastapi import HTTPException
+from src import database as db
+import base64
+import json
+
+# Keyset pagination for the list endpoints. A cursor is the sort it belongs to
+# plus the sort key and id of the last row returned, so the next page starts
+# with a range condition on the same (sort key, id) order the query already
+# uses instead of skipping rows with OFFSET.
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(sort, key, id):
+    raw = json.dumps([sort, key, id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, sort, key_type):
+    """
+    Returns the (key, id) stored in the cursor, or raises a 400 if the cursor is
+    malformed or was issued for a different sort.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, key, id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="invalid cursor.")
+    if (
+        cursor_sort != sort
+        or not isinstance(key, key_type)
+        or not isinstance(id, int)
+        or not db.id_in_range(id)
+        or (isinstance(key, int) and not db.id_in_range(key))
+    ):
+        raise HTTPException(status_code=400, detail="invalid cursor.")
+    return key, id
+
+
+def set_next_cursor(response, page, limit, sort, key_field, id_field):
+    """
+    Adds the cursor for the page after `page` to the response headers. A short
+    page is the last one, so it gets no cursor.
+    """
+    if len(page) < limit:
+        return
+    last = page[-1]
+    response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+        sort, last[key_field], last[id_field]
+    )
@@ -1,6 +1,5 @@
 from fastapi import APIRouter
 import os
-import pkg_resources
 import sys
 
 router = APIRouter()
@@ -24,6 +23,9 @@ def version():
 
 @router.get("/pkgsize/")
 def get_pkgsize():
+    # Slow to import, so only when this is called
+    import pkg_resources
+
     dists = [d for d in pkg_resources.working_set]
 
     message = []
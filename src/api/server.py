@@ -1,5 +1,9 @@
 from fastapi import FastAPI
-from src.api import characters, movies, lines, conversations, pkg_util
+from src.api import characters, movies, lines, conversations, export, metrics, pkg_util
+from src.api.compression import CompressionMiddleware
+from src.api.conditional import ConditionalGetMiddleware
+from src.api.server_timing import ServerTimingMiddleware
+from src import memstore
 
 description = """
 Movie API returns dialog statistics on top hollywood movies from decades past.
@@ -9,6 +13,7 @@ Movie API returns dialog statistics on top hollywood movies from decades past.
 You can:
 * **list characters with sorting and filtering options.**
 * **retrieve a specific character by id**
+* **retrieve several characters by id at once**
 * **retrieve a lines by a character by their id**
 
 ## Movies
@@ -16,12 +21,20 @@ You can:
 You can:
 * **list movies with sorting and filtering options.**
 * **retrieve a specific movie by id**
+* **retrieve several movies by id at once**
 * **add a specific conversation by movie id**
 
 ## Lines
 
 You can:
 * **retrieve a specific line by id**
+* **retrieve several lines by id at once**
+* **search the text of all lines**
+
+## Export
+
+You can:
+* **download a whole table as CSV, NDJSON, Arrow or Parquet**
 """
 tags_metadata = [
     {
@@ -36,6 +49,10 @@ tags_metadata = [
         "name": "lines",
         "description": "Access infromation on lines spoken by characters.",
     },
+    {
+        "name": "export",
+        "description": "Download whole tables at once.",
+    },
 ]
 
 app = FastAPI(
@@ -48,11 +65,22 @@ app = FastAPI(
     },
     openapi_tags=tags_metadata,
 )
+app.add_middleware(ConditionalGetMiddleware)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(ServerTimingMiddleware)
 app.include_router(characters.router)
 app.include_router(movies.router)
 app.include_router(lines.router)
 app.include_router(pkg_util.router)
 app.include_router(conversations.router)
+app.include_router(export.router)
+app.include_router(metrics.router)
+
+
+@app.on_event("startup")
+def load_memstore():
+    if memstore.enabled():
+        memstore.load()
 
 
 @app.get("/")
@@ -0,0 +1,91 @@
+from starlette.datastructures import MutableHeaders
+import time
+from src import metrics
+from src import timing
+
+# Reports where each request's time went, from src/timing.py. Responses get a
+# Server-Timing header, which browser developer tools show next to the
+# request:
+#
+#     Server-Timing: db;dur=2.1, queries;desc="3", rows;desc="57",
+#         pool;dur=0.0, serialize;dur=0.1, total;dur=3.4
+#
+# Durations are in milliseconds, up to when the response starts, so the
+# header leaves out whatever a streamed body does after that. The same
+# numbers go into histograms by route on /metrics, where a route whose query
+# count grows with its results (an N+1) or whose time goes up shows up.
+
+SECONDS_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+request_seconds = metrics.Histogram(
+    "http_request_duration_seconds",
+    "Time to handle a request, streamed bodies included.",
+    SECONDS_BUCKETS,
+)
+db_seconds = metrics.Histogram(
+    "http_request_db_seconds",
+    "Time a request spent running queries.",
+    SECONDS_BUCKETS,
+)
+queries = metrics.Histogram(
+    "http_request_queries",
+    "Queries run by a request.",
+    [0, 1, 2, 3, 5, 10, 25, 50, 100],
+)
+rows = metrics.Histogram(
+    "http_request_rows",
+    "Rows returned to a request by its queries.",
+    [0, 1, 10, 100, 1000, 10000, 100000],
+)
+serialize_seconds = metrics.Histogram(
+    "http_response_serialize_seconds",
+    "Time spent rendering a request's JSON response.",
+    SECONDS_BUCKETS,
+)
+
+
+def _header(timings, total):
+    return ", ".join(
+        [
+            f"db;dur={timings.db_seconds * 1000:.1f}",
+            f'queries;desc="{timings.queries}"',
+            f'rows;desc="{timings.rows}"',
+            f"pool;dur={timings.pool_seconds * 1000:.1f}",
+            f"serialize;dur={timings.serialize_seconds * 1000:.1f}",
+            f"total;dur={total * 1000:.1f}",
+        ]
+    )
+
+
+class ServerTimingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings, token = timing.start()
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing", _header(timings, time.perf_counter() - start)
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            timing.finish(token)
+            # The route's path template, set once the request was routed
+            route = scope.get("route")
+            route = route.path if route is not None else "unmatched"
+            request_seconds.observe(time.perf_counter() - start, route=route)
+            db_seconds.observe(timings.db_seconds, route=route)
+            queries.observe(timings.queries, route=route)
+            rows.observe(timings.rows, route=route)
+            serialize_seconds.observe(timings.serialize_seconds, route=route)
@@ -0,0 +1,103 @@
+from contextlib import asynccontextmanager
+from enum import Enum
+from itertools import islice
+from fastapi.responses import StreamingResponse
+import anyio
+import csv
+import io
+import json
+
+# Streamed alternatives to JSON list responses. Rows are written out a batch
+# at a time as they are read, so memory use doesn't grow with the number of
+# rows:
+# * ndjson - one JSON object per line
+# * csv - a header line with the field names, then one line per row
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+CSV_MEDIA_TYPE = "text/csv; charset=utf-8"
+
+
+class formats(str, Enum):
+    json = "json"
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    A StreamingResponse that closes its body when it's done, including when
+    the client goes away part way through. Starlette leaves that to garbage
+    collection, which keeps any database connection the body holds checked
+    out until then.
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await self.body_iterator.aclose()
+
+
+@asynccontextmanager
+async def closing(batches):
+    """
+    Closes the async generator `batches` on the way out, for generators
+    reading from another one.
+    """
+    try:
+        yield batches
+    finally:
+        with anyio.CancelScope(shield=True):
+            await batches.aclose()
+
+
+def requested_format(format, accept):
+    """
+    The format asked for by the `format` query parameter, or failing that the
+    Accept header. Defaults to json.
+    """
+    if format is not None:
+        return format
+    if accept is not None:
+        if NDJSON_MEDIA_TYPE in accept:
+            return formats.ndjson
+        if "text/csv" in accept:
+            return formats.csv
+    return formats.json
+
+
+def _encode(rows, format, fields):
+    if format is formats.ndjson:
+        return "".join(json.dumps(row) + "\n" for row in rows)
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerows([row[field] for field in fields] for row in rows)
+    return out.getvalue()
+
+
+async def batched(rows, batch_size=1000):
+    # Batches from a plain iterator of rows, e.g. the memory read engine's
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def response(batches, format, fields):
+    """
+    A response streaming `batches`, an async iterator of lists of dicts with
+    keys `fields`, in `format` (ndjson or csv).
+    """
+
+    async def body():
+        if format is formats.csv:
+            yield _encode([dict(zip(fields, fields))], format, fields)
+        async with closing(batches):
+            async for rows in batches:
+                yield _encode(rows, format, fields)
+
+    media_type = NDJSON_MEDIA_TYPE if format is formats.ndjson else CSV_MEDIA_TYPE
+    return ClosingStreamingResponse(body(), media_type=media_type)
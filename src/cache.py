@@ -0,0 +1,250 @@
+from collections import OrderedDict, defaultdict
+from enum import Enum
+import asyncio
+import functools
+import os
+import sys
+import threading
+import time
+from src import metrics
+
+# In-process cache of read endpoint responses. Entries are keyed by route and
+# its parsed parameters, expire after the route's TTL, and are evicted least
+# recently used first once there are CACHE_MAX_ENTRIES of them (0 turns the
+# cache off) or they add up to more than CACHE_MAX_BYTES. Sizes are estimates
+# of the memory a response's objects take, see _size(); a page of 1000 lines
+# is about 750 KB. Each entry carries tags naming the data it was built from,
+# and writes invalidate the tags they touch:
+# * ("movie", movie_id) - a movie's top characters
+# * ("character", character_id) - a character's conversations and lines
+# * "character_line_counts" - lists that show or sort by line counts
+# * "lines" - line search
+#
+# Other workers only see a write once their TTLs run out, so TTLs are kept
+# short.
+
+MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "") or 4096)
+MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", "") or 64 * 1024 * 1024)
+
+hits = metrics.Counter(
+    "cache_hits_total", "Responses served from the cache.", ["route"]
+)
+misses = metrics.Counter(
+    "cache_misses_total", "Responses not found in the cache.", ["route"]
+)
+evictions = metrics.Counter(
+    "cache_evictions_total",
+    "Entries evicted to stay under CACHE_MAX_ENTRIES and CACHE_MAX_BYTES.",
+)
+coalesced_requests = metrics.Counter(
+    "coalesced_requests_total",
+    "Requests that waited for an identical request already in flight.",
+    ["route"],
+)
+
+
+def _size(value):
+    # Bytes taken by a response's objects, counting ones it shares, like small
+    # ints, each time they appear
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += _size(key) + _size(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += _size(item)
+    return size
+
+
+class ResponseCache:
+    def __init__(self, max_entries, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (expires, value, headers, tags, size), least recently used
+        # first
+        self.entries = OrderedDict()
+        self.size = 0
+        self.tagged = defaultdict(set)
+        # Bumped by every invalidation. A response computed while it changed
+        # may predate the write, so it isn't stored.
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[1], entry[2]
+
+    def put(self, key, value, headers, tags, ttl, version):
+        size = _size(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if version != self.version:
+                return
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.monotonic() + ttl, value, headers, tags, size)
+            self.size += size
+            for tag in tags:
+                self.tagged[tag].add(key)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                evictions.inc()
+
+    def invalidate(self, tags):
+        with self.lock:
+            self.version += 1
+            for tag in tags:
+                for key in self.tagged.pop(tag, ()):
+                    self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.version += 1
+            self.entries.clear()
+            self.tagged.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= entry[4]
+        for tag in entry[3]:
+            keys = self.tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tagged[tag]
+
+
+cache = ResponseCache(MAX_ENTRIES)
+
+metrics.Gauge(
+    "cache_size_bytes", "Estimated size of the cached responses.", lambda: cache.size
+)
+
+
+def _normalize(value):
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
+def _key(route, params):
+    return (route,) + tuple(
+        sorted(
+            (name, _normalize(value))
+            for name, value in params.items()
+            if name != "response"
+        )
+    )
+
+
+def cached(ttl, tags=lambda **params: ()):
+    """
+    Caches an async route's responses for `ttl` seconds. `tags` gets the
+    route's parameters and returns the tags for the entry. Headers the route
+    sets on its `response` parameter are cached along with the body.
+    """
+
+    def decorator(fn):
+        route = fn.__name__
+
+        @functools.wraps(fn)
+        async def wrapper(**params):
+            if cache.max_entries == 0:
+                return await fn(**params)
+
+            response = params.get("response")
+            key = _key(route, params)
+            entry = cache.get(key)
+            if entry is not None:
+                hits.inc(route=route)
+                value, headers = entry
+                if response is not None:
+                    response.headers.update(headers)
+                return value
+
+            misses.inc(route=route)
+            version = cache.version
+            value = await fn(**params)
+            headers = dict(response.headers) if response is not None else {}
+            entry_tags = tuple(tags(**params))
+            cache.put(key, value, headers, entry_tags, ttl, version)
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+# key -> future for the result of the identical request being computed
+_in_flight = {}
+
+
+def coalesced(fn):
+    """
+    Makes concurrent identical requests to an async route share one call: the
+    first runs the route and the others wait for its result, headers included,
+    or its error. Goes under @cached, so only cache misses get here.
+    """
+    route = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(**params):
+        response = params.get("response")
+        key = _key(route, params)
+
+        future = _in_flight.get(key)
+        if future is not None:
+            coalesced_requests.inc(route=route)
+            try:
+                value, headers = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The request being waited on was cancelled, not this one
+                return await wrapper(**params)
+            if response is not None:
+                response.headers.update(headers)
+            return value
+
+        future = asyncio.get_running_loop().create_future()
+        _in_flight[key] = future
+        try:
+            value = await fn(**params)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Marks it retrieved, there may be no one waiting
+            future.exception()
+            raise
+        else:
+            headers = dict(response.headers) if response is not None else {}
+            future.set_result((value, headers))
+            return value
+        finally:
+            del _in_flight[key]
+
+    return wrapper
+
+
+def invalidate_conversations(movie_id, conversations):
+    """
+    Drops everything new conversations in a movie could have changed.
+    """
+    tags = {("movie", movie_id), "character_line_counts", "lines"}
+    for conversation in conversations:
+        tags.add(("character", conversation.character_1_id))
+        tags.add(("character", conversation.character_2_id))
+    cache.invalidate(tags)
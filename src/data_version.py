@@ -0,0 +1,65 @@
+import os
+import time
+import sqlalchemy
+from src import cache
+from src import database as db
+
+# The version of the dialog data, from migrations/0006_data_version.sql. Every
+# write bumps it once it has committed, in a transaction of its own, so
+# concurrent writes only wait on the version row for that one update rather
+# than for each other's whole transactions. Responses carry it as their ETag.
+# Processes re-read it at most every DATA_VERSION_TTL seconds (5 by default),
+# so most requests don't query it. Seeing another process's write clears the
+# response cache, which would otherwise keep serving the old data under the
+# new version.
+
+REFRESH_SECONDS = float(os.environ.get("DATA_VERSION_TTL", "") or 5)
+
+# (version, modified) as of the last check
+_current = None
+_checked = 0.0
+
+
+def _read(conn):
+    return conn.execute(
+        sqlalchemy.select(db.data_version.c.version, db.data_version.c.modified)
+    ).one()
+
+
+def _update(version, modified, own_writes):
+    global _current, _checked
+    if _current is not None and version > _current[0] + own_writes:
+        cache.cache.clear()
+    if _current is None or version > _current[0]:
+        _current = (version, modified)
+    _checked = time.monotonic()
+
+
+async def current():
+    """
+    Returns the (version, modified) of the data.
+    """
+    if _current is None or time.monotonic() - _checked >= REFRESH_SECONDS:
+        row = await db.run(_read)
+        _update(row.version, row.modified, 0)
+    return _current
+
+
+def bump(conn):
+    """
+    Bumps the version, in a transaction of its own after a write commits.
+    Readers that see the new version see the write's data too. Pass what it
+    returns to bumped().
+    """
+    return conn.execute(
+        sqlalchemy.update(db.data_version)
+        .values(
+            version=db.data_version.c.version + 1,
+            modified=sqlalchemy.func.now(),
+        )
+        .returning(db.data_version.c.version, db.data_version.c.modified)
+    ).one()
+
+
+def bumped(row):
+    _update(row.version, row.modified, 1)
@@ -1,14 +1,23 @@
-import csv
 import os
-import io
-from supabase import Client, create_client
+import asyncio
+import concurrent.futures
+import threading
+import time
+import anyio
 import sqlalchemy
-from sqlalchemy import create_engine
+from sqlalchemy import Column, Integer, REAL, Text, ForeignKey, create_engine
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from starlette.concurrency import run_in_threadpool
 import dotenv
+from src import metrics
+from src import timing
 
 # DO NOT CHANGE THIS TO BE HARDCODED. ONLY PULL FROM ENVIRONMENT VARIABLES.
 def database_connection_url():
     dotenv.load_dotenv()
+    # A whole URL instead, e.g. one for a Unix socket
+    if os.environ.get("DATABASE_URL"):
+        return os.environ["DATABASE_URL"]
     DB_USER: str = os.environ.get("POSTGRES_USER")
     DB_PASSWD = os.environ.get("POSTGRES_PASSWORD")
     DB_SERVER: str = os.environ.get("POSTGRES_SERVER")
@@ -16,11 +25,483 @@ def database_connection_url():
     DB_NAME: str = os.environ.get("POSTGRES_DB")
     return f"postgresql://{DB_USER}:{DB_PASSWD}@{DB_SERVER}:{DB_PORT}/{DB_NAME}"
 
-# Create a new DB engine based on our connection string
-engine = create_engine(database_connection_url())
 
+def _env_int(name, default):
+    value = os.environ.get(name, "")
+    return int(value) if value else default
+
+
+def _env_flag(name):
+    return os.environ.get(name, "").lower() in ("1", "true", "yes")
+
+
+# Pool settings, all optional:
+# * DB_POOL_SIZE - connections kept open. 0 opens one per request and closes it
+#   afterwards, which suits serverless deployments; it's the default when
+#   running on Vercel and 5 otherwise.
+# * DB_MAX_OVERFLOW - extra connections opened when the pool is busy (10).
+# * DB_POOL_TIMEOUT - seconds to wait for a connection before failing (30).
+# * DB_POOL_RECYCLE - seconds after which a connection is replaced, -1 never.
+# * DB_POOL_PRE_PING - test connections with a round trip before using them.
+# * DB_PGBOUNCER - connecting through PgBouncer in transaction mode, so no
+#   prepared statements are cached on the server connection.
+# * DB_STATEMENT_TIMEOUT - milliseconds a request's statements may run, 0 for
+#   no limit. Set per transaction, so it also works through PgBouncer.
+POOL_SIZE = _env_int("DB_POOL_SIZE", 0 if os.environ.get("VERCEL") else 5)
+MAX_OVERFLOW = _env_int("DB_MAX_OVERFLOW", 10)
+PGBOUNCER = _env_flag("DB_PGBOUNCER")
+STATEMENT_TIMEOUT = _env_int("DB_STATEMENT_TIMEOUT", 0)
+
+
+def engine_options():
+    options = {"pool_pre_ping": _env_flag("DB_POOL_PRE_PING")}
+    if POOL_SIZE == 0:
+        options["poolclass"] = sqlalchemy.pool.NullPool
+    else:
+        options["pool_size"] = POOL_SIZE
+        options["max_overflow"] = MAX_OVERFLOW
+        options["pool_timeout"] = _env_int("DB_POOL_TIMEOUT", 30)
+        options["pool_recycle"] = _env_int("DB_POOL_RECYCLE", -1)
+    return options
+
+
+_engine = None
+
+
+def get_engine():
+    # Created on first use rather than at import, so importing the app doesn't
+    # touch the database
+    global _engine
+    if _engine is None:
+        # Create a new DB engine based on our connection string
+        _engine = create_engine(database_connection_url(), **engine_options())
+    return _engine
+
+
+def __getattr__(name):
+    # Keeps `db.engine` working while creating it lazily
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+pool_checkout_seconds = metrics.Histogram(
+    "db_pool_checkout_seconds",
+    "Time spent waiting for a pooled database connection.",
+    [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30],
+)
+pool_exhausted = metrics.Counter(
+    "db_pool_exhausted_total",
+    "Connection requests made while every pooled connection was in use.",
+)
+pool_timeouts = metrics.Counter(
+    "db_pool_timeouts_total",
+    "Connection requests that gave up after DB_POOL_TIMEOUT seconds.",
+)
+
+# DB_MODE=async serves queries through asyncpg on the event loop instead of
+# blocking connections in the threadpool. `engine` stays around for startup
+# work like loading the memory read engine.
+async_mode = os.environ.get("DB_MODE", "sync") == "async"
+_async_engine = None
+_async_engine_loop = None
+
+
+def get_async_engine():
+    # asyncpg connections belong to the event loop that opened them. A server
+    # runs a single loop, but TestClient starts one per request, so the engine
+    # is replaced whenever the loop changes.
+    # Imported here since it pulls in the ORM, which sync mode never needs
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    global _async_engine, _async_engine_loop
+    loop = asyncio.get_running_loop()
+    if _async_engine_loop is not loop:
+        if _async_engine is not None:
+            _async_engine.sync_engine.dispose(close=False)
+        options = engine_options()
+        if PGBOUNCER:
+            options["connect_args"] = {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+            }
+        _async_engine = create_async_engine(
+            database_connection_url().replace(
+                "postgresql://", "postgresql+asyncpg://", 1
+            ),
+            **options,
+        )
+        sqlalchemy.event.listen(
+            _async_engine.sync_engine, "connect", _decode_float4_as_text
+        )
+        _async_engine_loop = loop
+    return _async_engine
+
+
+def _decode_float4_as_text(dbapi_connection, connection_record):
+    # asyncpg widens real columns like imdb_rating to double (8.800000190734863)
+    # where psycopg2 parses the text form (8.8). Decode them from text too so
+    # both modes return the same numbers.
+    dbapi_connection.run_async(
+        lambda conn: conn.set_type_codec(
+            "float4", schema="pg_catalog", encoder=str, decoder=float, format="text"
+        )
+    )
+
+
+def _pool_exhausted(pool):
+    return (
+        POOL_SIZE > 0
+        and MAX_OVERFLOW >= 0
+        and pool.checkedout() >= POOL_SIZE + MAX_OVERFLOW
+    )
+
+
+def _pool_checked_out():
+    pools = []
+    if _engine is not None:
+        pools.append(({"mode": "sync"}, _engine.pool))
+    if _async_engine is not None:
+        pools.append(({"mode": "async"}, _async_engine.sync_engine.pool))
+    return [
+        (labels, pool.checkedout() if POOL_SIZE > 0 else 0)
+        for labels, pool in pools
+    ]
+
+
+metrics.Gauge(
+    "db_pool_checked_out",
+    "Pooled database connections currently in use.",
+    _pool_checked_out,
+)
+metrics.Gauge("db_pool_size", "Configured DB_POOL_SIZE.", lambda: POOL_SIZE)
+
+
+def _checkout_started(pool):
+    if _pool_exhausted(pool):
+        pool_exhausted.inc()
+    return time.perf_counter()
+
+
+def _checkout_finished(start):
+    waited = time.perf_counter() - start
+    pool_checkout_seconds.observe(waited)
+    timing.add_pool_wait(waited)
+
+
+def _set_statement_timeout(conn):
+    if STATEMENT_TIMEOUT:
+        conn.exec_driver_sql(f"SET LOCAL statement_timeout = {STATEMENT_TIMEOUT}")
+
+
+def _call(conn, fn, args):
+    _set_statement_timeout(conn)
+    return fn(conn, *args)
+
+
+async def _run(fn, args, begin):
+    try:
+        if async_mode:
+            async_engine = get_async_engine()
+            start = _checkout_started(async_engine.sync_engine.pool)
+            connect = async_engine.begin if begin else async_engine.connect
+            async with connect() as conn:
+                _checkout_finished(start)
+                return await conn.run_sync(_call, fn, args)
+
+        def call():
+            engine = get_engine()
+            start = _checkout_started(engine.pool)
+            connect = engine.begin if begin else engine.connect
+            with connect() as conn:
+                _checkout_finished(start)
+                return _call(conn, fn, args)
+
+        return await run_in_threadpool(call)
+    except sqlalchemy.exc.TimeoutError:
+        pool_timeouts.inc()
+        raise
+
+
+async def run(fn, *args):
+    """
+    Calls fn(conn, *args) with a connection and returns its result. fn is plain
+    synchronous SQLAlchemy code either way: in async mode it runs through the
+    async engine's run_sync, otherwise on a pooled connection in the threadpool.
+    """
+    return await _run(fn, args, begin=False)
+
+
+async def run_in_transaction(fn, *args):
+    """
+    Like run(), but fn's work is committed when it returns and rolled back if
+    it raises.
+    """
+    return await _run(fn, args, begin=True)
+
+
+async def stream(stmt, batch_size=1000):
+    """
+    Yields the rows of stmt in lists of up to batch_size, read from a server
+    side cursor so only one batch is in memory at a time. The connection is
+    held until the generator finishes or is closed.
+    """
+    stmt = stmt.execution_options(yield_per=batch_size)
+    try:
+        if async_mode:
+            async_engine = get_async_engine()
+            start = _checkout_started(async_engine.sync_engine.pool)
+            conn = await async_engine.connect()
+            try:
+                _checkout_finished(start)
+                await conn.run_sync(_set_statement_timeout)
+                result = await conn.stream(stmt)
+                async for rows in result.partitions():
+                    yield rows
+            finally:
+                # Shielded, or a cancelled request would never give it back
+                with anyio.CancelScope(shield=True):
+                    await conn.close()
+            return
+
+        engine = get_engine()
+        start = _checkout_started(engine.pool)
+        conn = await run_in_threadpool(engine.connect)
+        try:
+            _checkout_finished(start)
+            await run_in_threadpool(_set_statement_timeout, conn)
+            result = await run_in_threadpool(conn.execute, stmt)
+            while True:
+                rows = await run_in_threadpool(result.fetchmany, batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            with anyio.CancelScope(shield=True):
+                await run_in_threadpool(conn.close)
+    except sqlalchemy.exc.TimeoutError:
+        pool_timeouts.inc()
+        raise
+
+
+class _CopyCancelled(Exception):
+    pass
+
+
+async def copy_out(table, columns, queue_size=16):
+    """
+    Yields a table as CSV with a header row, in the chunks Postgres sends from
+    COPY ... TO STDOUT. At most queue_size chunks are buffered, so a slow
+    client slows the COPY down rather than filling memory.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(queue_size)
+    done = object()
+    closed = threading.Event()
+
+    if async_mode:
+
+        async def produce():
+            async with get_async_engine().connect() as conn:
+                try:
+                    await conn.run_sync(_set_statement_timeout)
+                    raw = await conn.get_raw_connection()
+                    await raw.driver_connection.copy_from_table(
+                        table.name,
+                        columns=[column.name for column in columns],
+                        output=queue.put,
+                        format="csv",
+                        header=True,
+                    )
+                except BaseException:
+                    # Don't hand a connection stopped mid COPY back to the pool
+                    await conn.invalidate()
+                    raise
+            await queue.put(done)
+
+        task = asyncio.ensure_future(produce())
+    else:
+        sql = "COPY {} ({}) TO STDOUT WITH (FORMAT csv, HEADER)".format(
+            table.name, ", ".join(column.name for column in columns)
+        )
+
+        class Writer:
+            # File object for copy_expert, which writes a row at a time.
+            # Rows are handed to the event loop in chunks of about 64 KiB.
+            def __init__(self):
+                self.buffer = []
+                self.size = 0
+
+            def write(self, data):
+                self.buffer.append(data)
+                self.size += len(data)
+                if self.size >= 65536:
+                    self.flush()
+
+            def flush(self):
+                if self.buffer:
+                    self.send(b"".join(self.buffer))
+                    self.buffer = []
+                    self.size = 0
+
+            def send(self, data):
+                future = asyncio.run_coroutine_threadsafe(queue.put(data), loop)
+                while True:
+                    if closed.is_set():
+                        future.cancel()
+                        raise _CopyCancelled()
+                    try:
+                        return future.result(0.1)
+                    except concurrent.futures.TimeoutError:
+                        pass
+
+        def produce():
+            with get_engine().connect() as conn:
+                try:
+                    _set_statement_timeout(conn)
+                    cursor = conn.connection.dbapi_connection.cursor()
+                    writer = Writer()
+                    cursor.copy_expert(sql, writer)
+                    writer.flush()
+                except BaseException:
+                    conn.invalidate()
+                    raise
+            writer.send(done)
+
+        task = asyncio.ensure_future(run_in_threadpool(produce))
+
+    try:
+        while True:
+            get = asyncio.ensure_future(queue.get())
+            try:
+                await asyncio.wait({get, task}, return_when=asyncio.FIRST_COMPLETED)
+                if not get.done() and task.exception() is not None:
+                    # The COPY failed, raise its error
+                    await task
+                chunk = await get
+            finally:
+                get.cancel()
+            if chunk is done:
+                break
+            yield bytes(chunk)
+        await task
+    finally:
+        closed.set()
+        if not task.done():
+            task.cancel()
+
+
+# Ids are integer columns. asyncpg refuses to bind a larger Python int, so
+# routes treat out of range ids as missing before they reach a query.
+def id_in_range(id):
+    return -(2**31) <= id < 2**31
+
+# The schema, declared here instead of reflected so that importing the app
+# needs no round trips to the database. test/test_schema.py checks it against
+# the live database. Keep in sync with migrations/.
 metadata_obj = sqlalchemy.MetaData()
-movies = sqlalchemy.Table("movies", metadata_obj, autoload_with=engine)
-characters = sqlalchemy.Table("characters", metadata_obj, autoload_with=engine)
-conversations = sqlalchemy.Table("conversations", metadata_obj, autoload_with=engine)
-lines = sqlalchemy.Table("lines", metadata_obj, autoload_with=engine)
+
+movies = sqlalchemy.Table(
+    "movies",
+    metadata_obj,
+    Column("movie_id", Integer, primary_key=True, autoincrement=False),
+    Column("title", Text, nullable=False),
+    Column("year", Text),
+    Column("imdb_rating", REAL),
+    Column("imdb_votes", Integer),
+    Column("raw_script_url", Text),
+)
+
+characters = sqlalchemy.Table(
+    "characters",
+    metadata_obj,
+    Column("character_id", Integer, primary_key=True, autoincrement=False),
+    Column("name", Text),
+    Column("movie_id", Integer, ForeignKey("movies.movie_id")),
+    Column("gender", Text),
+    Column("age", Integer),
+)
+
+# Ids are allocated from these, see migrations/0005_id_sequences.sql
+conversation_ids = sqlalchemy.Sequence(
+    "conversations_conversation_id_seq", metadata=metadata_obj
+)
+line_ids = sqlalchemy.Sequence("lines_line_id_seq", metadata=metadata_obj)
+
+conversations = sqlalchemy.Table(
+    "conversations",
+    metadata_obj,
+    Column(
+        "conversation_id",
+        Integer,
+        primary_key=True,
+        server_default=conversation_ids.next_value(),
+    ),
+    Column("character1_id", Integer, ForeignKey("characters.character_id")),
+    Column("character2_id", Integer, ForeignKey("characters.character_id")),
+    Column("movie_id", Integer, ForeignKey("movies.movie_id")),
+)
+
+lines = sqlalchemy.Table(
+    "lines",
+    metadata_obj,
+    Column("line_id", Integer, primary_key=True, server_default=line_ids.next_value()),
+    Column("character_id", Integer, ForeignKey("characters.character_id")),
+    Column("movie_id", Integer, ForeignKey("movies.movie_id")),
+    Column("conversation_id", Integer, ForeignKey("conversations.conversation_id")),
+    Column("line_sort", Integer),
+    Column("line_text", Text),
+    # migrations/0004_line_search.sql
+    Column(
+        "line_tsv",
+        TSVECTOR,
+        sqlalchemy.Computed("to_tsvector('english', coalesce(line_text, ''))"),
+    ),
+)
+
+# Aggregates maintained by add_conversation, see migrations/
+character_line_counts = sqlalchemy.Table(
+    "character_line_counts",
+    metadata_obj,
+    Column(
+        "character_id",
+        Integer,
+        ForeignKey("characters.character_id"),
+        primary_key=True,
+        autoincrement=False,
+    ),
+    Column("movie_id", Integer, ForeignKey("movies.movie_id"), nullable=False),
+    Column("num_lines", Integer, nullable=False),
+)
+
+character_pairs = sqlalchemy.Table(
+    "character_pairs",
+    metadata_obj,
+    Column(
+        "character_id",
+        Integer,
+        ForeignKey("characters.character_id"),
+        primary_key=True,
+        autoincrement=False,
+    ),
+    Column(
+        "partner_id",
+        Integer,
+        ForeignKey("characters.character_id"),
+        primary_key=True,
+        autoincrement=False,
+    ),
+    Column("num_conversations", Integer, nullable=False),
+    Column("lines_together", Integer, nullable=False),
+)
+
+# migrations/0006_data_version.sql
+data_version = sqlalchemy.Table(
+    "data_version",
+    metadata_obj,
+    Column(
+        "id", sqlalchemy.Boolean, primary_key=True, server_default=sqlalchemy.true()
+    ),
+    Column("version", sqlalchemy.BigInteger, nullable=False),
+    Column("modified", sqlalchemy.TIMESTAMP(timezone=True), nullable=False),
+)
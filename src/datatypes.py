@@ -1,8 +1,12 @@
 from dataclasses import dataclass
 
+# __slots__ keeps these small enough to hold the whole corpus in memory
+# (see src/memstore.py).
+
 
 @dataclass
 class Character:
+    __slots__ = ("id", "name", "movie_id", "gender", "age", "num_lines")
     id: int
     name: str
     movie_id: int
@@ -13,6 +17,7 @@ class Character:
 
 @dataclass
 class Movie:
+    __slots__ = ("id", "title", "year", "imdb_rating", "imdb_votes", "raw_script_url")
     id: int
     title: str
     year: int
@@ -23,6 +28,7 @@ class Movie:
 
 @dataclass
 class Conversation:
+    __slots__ = ("id", "c1_id", "c2_id", "movie_id", "num_lines")
     id: int
     c1_id: int
     c2_id: int
@@ -32,6 +38,7 @@ class Conversation:
 
 @dataclass
 class Line:
+    __slots__ = ("id", "c_id", "movie_id", "conv_id", "line_sort", "line_text")
     id: int
     c_id: int
     movie_id: int
@@ -0,0 +1,192 @@
+import argparse
+import csv
+import os
+import time
+import sqlalchemy
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import AddConstraint, CreateTable
+from src import data_version
+from src import database as db
+from src import migrate
+
+# Loads the dialog data from CSV files into Postgres:
+#
+#     python -m src.loader [--dir DIR] [--drop]
+#     python -m src.loader --upsert [--dir DIR]
+#
+# Files are named after their table, <table>.csv, with a header row naming
+# their columns. The repo ships movies, characters and conversations;
+# lines.csv is loaded too when it's there.
+#
+# A fresh load creates the tables without keys, streams each file in with
+# COPY FROM STDIN, and only then adds the keys and applies migrations/ (the
+# indexes, aggregate tables, sequences and data version), which is much
+# faster than maintaining them a row at a time. It won't load over existing
+# tables unless --drop is given to drop them first.
+#
+# --upsert loads into existing tables instead: each file is copied into a
+# temporary table and merged in with INSERT ... ON CONFLICT DO UPDATE, then
+# the migrations are applied again to bring what's derived from the data up
+# to date, and the data version is bumped so that running servers notice.
+#
+# Either way everything happens in one transaction, so a failed load leaves
+# the database as it was.
+
+# In foreign key order
+TABLES = [db.movies, db.characters, db.conversations, db.lines]
+
+# Bytes read from a file per COPY message
+COPY_BUFFER = 1 << 16
+
+
+def _header(path, table):
+    with open(path, newline="", encoding="utf-8") as f:
+        columns = next(csv.reader(f))
+    unknown = [name for name in columns if name not in table.c]
+    if unknown:
+        raise SystemExit(f"{path}: no such columns in {table.name}: {unknown}")
+    return columns
+
+
+def _copy(conn, path, target, columns, freeze=False):
+    options = "FORMAT csv, HEADER, FREEZE" if freeze else "FORMAT csv, HEADER"
+    sql = f"COPY {target} ({', '.join(columns)}) FROM STDIN WITH ({options})"
+    cursor = conn.connection.dbapi_connection.cursor()
+    with open(path, newline="", encoding="utf-8") as f:
+        cursor.copy_expert(sql, f, size=COPY_BUFFER)
+    return cursor.rowcount
+
+
+def _bare_table(table):
+    # The table's plain columns, without keys, defaults or generated columns.
+    # migrations/ adds back what isn't added here after the load.
+    return sqlalchemy.Table(
+        table.name,
+        sqlalchemy.MetaData(),
+        *[
+            sqlalchemy.Column(column.name, column.type, nullable=column.nullable)
+            for column in table.c
+            if column.computed is None
+        ],
+    )
+
+
+def _upsert(conn, path, table, columns):
+    staging = f"load_{table.name}"
+    conn.exec_driver_sql(
+        f"CREATE TEMPORARY TABLE {staging} (LIKE {table.name}) ON COMMIT DROP"
+    )
+    _copy(conn, path, staging, columns)
+
+    source = sqlalchemy.table(staging, *[sqlalchemy.column(name) for name in columns])
+    keys = [column.name for column in table.primary_key]
+    values = [name for name in columns if name not in keys]
+    stmt = postgresql.insert(table).from_select(
+        columns, sqlalchemy.select(*[source.c[name] for name in columns])
+    )
+    if values:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=keys,
+            set_={name: stmt.excluded[name] for name in values},
+            # Rows that haven't changed are left alone
+            where=sqlalchemy.tuple_(
+                *[table.c[name] for name in values]
+            ).is_distinct_from(
+                sqlalchemy.tuple_(*[stmt.excluded[name] for name in values])
+            ),
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=keys)
+    # xmax is only set on rows that were updated
+    inserted = (
+        conn.execute(stmt.returning(sqlalchemy.literal_column("xmax = 0")))
+        .scalars()
+        .all()
+    )
+    return sum(inserted), len(inserted) - sum(inserted)
+
+
+def load(directory, upsert=False, drop=False):
+    engine = db.get_engine()
+    paths = {
+        table.name: os.path.join(directory, f"{table.name}.csv") for table in TABLES
+    }
+
+    with engine.begin() as conn:
+        if upsert:
+            for table in TABLES:
+                path = paths[table.name]
+                if not os.path.exists(path):
+                    continue
+                start = time.perf_counter()
+                inserted, updated = _upsert(conn, path, table, _header(path, table))
+                print(
+                    f"{table.name}: {inserted} inserted, {updated} updated"
+                    f" in {time.perf_counter() - start:.2f}s"
+                )
+            migrate.reapply(conn)
+        else:
+            if drop:
+                for table in reversed(db.metadata_obj.sorted_tables):
+                    conn.exec_driver_sql(
+                        f"DROP TABLE IF EXISTS {table.name} CASCADE"
+                    )
+            inspector = sqlalchemy.inspect(conn)
+            existing = [
+                table.name for table in TABLES if inspector.has_table(table.name)
+            ]
+            if existing:
+                raise SystemExit(
+                    f"{', '.join(existing)} already exist, pass --drop to replace"
+                    " them or --upsert to load into them"
+                )
+
+            for table in TABLES:
+                conn.execute(CreateTable(_bare_table(table)))
+                path = paths[table.name]
+                if not os.path.exists(path):
+                    continue
+                start = time.perf_counter()
+                # FREEZE writes the rows already frozen, which it can because
+                # the table was created in this transaction
+                count = _copy(
+                    conn, path, table.name, _header(path, table), freeze=True
+                )
+                elapsed = time.perf_counter() - start
+                print(f"{table.name}: {count} rows in {elapsed:.2f}s")
+
+            start = time.perf_counter()
+            for table in TABLES:
+                conn.execute(AddConstraint(table.primary_key))
+                for constraint in table.foreign_key_constraints:
+                    conn.execute(AddConstraint(constraint))
+            print(f"keys in {time.perf_counter() - start:.2f}s")
+            migrate.reapply(conn)
+
+        tables = ", ".join(table.name for table in db.metadata_obj.sorted_tables)
+        conn.exec_driver_sql(f"ANALYZE {tables}")
+
+    if upsert:
+        with engine.begin() as conn:
+            data_version.bump(conn)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load the dialog data from CSV files into Postgres."
+    )
+    parser.add_argument(
+        "--dir", default=".", help="directory with the <table>.csv files"
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--upsert", action="store_true", help="merge into the existing tables"
+    )
+    mode.add_argument(
+        "--drop", action="store_true", help="drop the existing tables first"
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    load(args.dir, upsert=args.upsert, drop=args.drop)
+    print(f"loaded in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,502 @@
+import os
+import re
+import threading
+from bisect import bisect_right
+from collections import Counter, defaultdict
+from itertools import islice
+from src import database as db
+from src.datatypes import Character, Conversation, Line, Movie
+import sqlalchemy
+
+# Optional read engine that keeps the whole corpus in process memory. Enable it
+# with READ_ENGINE=memory; the read endpoints then answer from here and only
+# writes go to Postgres. Every method returns exactly the JSON the Postgres
+# path returns, or None where that path would 404.
+#
+# Each process holds its own copy, so writes made by another process are only
+# seen after a restart. Keep it for read-mostly deployments.
+
+
+def enabled():
+    return os.environ.get("READ_ENGINE", "postgres") == "memory"
+
+
+def _ilike(name):
+    # Mirrors column.ilike(f"%{name}%"): % and _ are wildcards, \ escapes.
+    pattern = []
+    chars = iter(name)
+    for ch in chars:
+        if ch == "%":
+            pattern.append(".*")
+        elif ch == "_":
+            pattern.append(".")
+        elif ch == "\\":
+            pattern.append(re.escape(next(chars, "\\")))
+        else:
+            pattern.append(re.escape(ch))
+    return re.compile("".join(pattern), re.IGNORECASE | re.DOTALL).search
+
+
+def _asc(value):
+    # Postgres sorts NULLs last in ascending order
+    return (value is None, value if value is not None else "")
+
+
+def _desc(value):
+    # ... and first in descending order
+    return (value is not None, -value if value is not None else 0)
+
+
+# Sort keys for each list order, shared by sorting and cursor lookups
+_movie_keys = {
+    "movie_title": lambda title, id: (_asc(title), id),
+    "year": lambda year, id: (_asc(year), id),
+    "rating": lambda rating, id: (_desc(rating), id),
+}
+_character_keys = {
+    "character": lambda name, id: (_asc(name), id),
+    "movie": lambda title, id: (_asc(title), id),
+    "number_of_lines": lambda num_lines, id: (-num_lines, id),
+}
+
+
+def _after(order, order_key, after):
+    # Index of the first row that sorts after the cursor's (key, id)
+    target = order_key(*after)
+    lo, hi = 0, len(order)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if order[mid][0] <= target:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _trigrams(text):
+    text = text.lower()
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """
+    Maps every lowercase trigram of a text to the ids whose text contains it,
+    so a `name` substring filter only has to look at rows sharing all of the
+    name's trigrams instead of running the pattern over every row.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(set)
+
+    def add(self, id, text):
+        if text is None:
+            return
+        for gram in _trigrams(text):
+            self.postings[gram].add(id)
+
+    def candidates(self, name):
+        """
+        Returns a superset of the ids matching ilike(f"%{name}%"), or None if
+        the name is too short or uses wildcards and the caller has to scan.
+        """
+        if len(name) < 3 or any(ch in "%_\\" for ch in name):
+            return None
+        empty = set()
+        postings = sorted(
+            (self.postings.get(gram, empty) for gram in _trigrams(name)), key=len
+        )
+        if len(postings) == 1:
+            return postings[0]
+        return postings[0].intersection(*postings[1:])
+
+
+class Store:
+    def __init__(self):
+        self.movies = {}
+        self.characters = {}
+        self.conversations = {}
+        self.lines = {}
+
+        # Secondary indexes, all lists of ids
+        self.character_lines = defaultdict(list)  # by line_id
+        self.conversation_lines = defaultdict(list)  # by line_sort
+        self.movie_line_counts = defaultdict(Counter)
+        # character_id -> partner_id -> lines together, over conversations
+        # that have lines
+        self.partner_lines = defaultdict(Counter)
+
+        # Rankings derived from the counts above, rebuilt lazily after writes
+        self._movie_orders = {}
+        self._character_orders = {}
+        self._movie_top_characters = {}
+        self._ranked_partners = {}
+
+        self.movie_titles = TrigramIndex()
+        self.character_names = TrigramIndex()
+        self._lock = threading.Lock()
+
+    def load(self, conn):
+        for row in conn.execute(sqlalchemy.select(db.movies)):
+            self.movies[row.movie_id] = Movie(
+                row.movie_id,
+                row.title,
+                row.year,
+                row.imdb_rating,
+                row.imdb_votes,
+                row.raw_script_url,
+            )
+            self.movie_titles.add(row.movie_id, row.title)
+
+        for row in conn.execute(sqlalchemy.select(db.characters)):
+            self.characters[row.character_id] = Character(
+                row.character_id, row.name, row.movie_id, row.gender, row.age, 0
+            )
+            self.character_names.add(row.character_id, row.name)
+
+        for row in conn.execute(sqlalchemy.select(db.conversations)):
+            self._add_conversation(
+                Conversation(
+                    row.conversation_id,
+                    row.character1_id,
+                    row.character2_id,
+                    row.movie_id,
+                    0,
+                )
+            )
+
+        result = conn.execution_options(stream_results=True, yield_per=10000).execute(
+            sqlalchemy.select(
+                db.lines.c.line_id,
+                db.lines.c.character_id,
+                db.lines.c.movie_id,
+                db.lines.c.conversation_id,
+                db.lines.c.line_sort,
+                db.lines.c.line_text,
+            ).order_by(db.lines.c.line_id)
+        )
+        for row in result:
+            self._add_line(
+                Line(
+                    row.line_id,
+                    row.character_id,
+                    row.movie_id,
+                    row.conversation_id,
+                    row.line_sort,
+                    row.line_text,
+                )
+            )
+
+        for ids in self.conversation_lines.values():
+            ids.sort(key=lambda line_id: (self.lines[line_id].line_sort, line_id))
+
+        for conv in self.conversations.values():
+            self._add_pair(conv)
+
+        self._sort_movies()
+
+    def _sort_movies(self):
+        for sort in _movie_keys:
+            self._movie_orders[sort] = sorted(
+                (self._movie_key(sort, m), m) for m in self.movies.values()
+            )
+
+    def _add_conversation(self, conv):
+        self.conversations[conv.id] = conv
+
+    def _add_pair(self, conv):
+        if conv.num_lines == 0:
+            return
+        self.partner_lines[conv.c1_id][conv.c2_id] += conv.num_lines
+        if conv.c2_id != conv.c1_id:
+            self.partner_lines[conv.c2_id][conv.c1_id] += conv.num_lines
+
+    def _add_line(self, line):
+        self.lines[line.id] = line
+        self.character_lines[line.c_id].append(line.id)
+        self.conversation_lines[line.conv_id].append(line.id)
+        self.movie_line_counts[line.movie_id][line.c_id] += 1
+        conv = self.conversations.get(line.conv_id)
+        if conv is not None:
+            conv.num_lines += 1
+        character = self.characters.get(line.c_id)
+        if character is not None:
+            character.num_lines += 1
+
+    def add_conversation(self, conv, lines):
+        """
+        Mirrors a conversation that was just committed to Postgres. `lines`
+        must be in line_sort order.
+        """
+        with self._lock:
+            self._add_conversation(conv)
+            for line in lines:
+                self._add_line(line)
+                self._movie_top_characters.pop(line.movie_id, None)
+            self._add_pair(conv)
+            self._ranked_partners.pop(conv.c1_id, None)
+            self._ranked_partners.pop(conv.c2_id, None)
+            self._character_orders = {}
+
+    def _character_order(self, sort):
+        order = self._character_orders.get(sort)
+        if order is not None:
+            return order
+
+        order = sorted(
+            (self._character_key(sort, c), c)
+            for c in self.characters.values()
+            if self._listed(c)
+        )
+        self._character_orders[sort] = order
+        return order
+
+    def _listed(self, c):
+        # Same rows as the inner joins in list_characters
+        return c.num_lines > 0 and c.movie_id in self.movies
+
+    def _movie_key(self, sort, m):
+        if sort == "movie_title":
+            value = m.title
+        elif sort == "year":
+            value = m.year
+        elif sort == "rating":
+            value = m.imdb_rating
+        else:
+            assert False
+        return _movie_keys[sort](value, m.id)
+
+    def _character_key(self, sort, c):
+        if sort == "character":
+            value = c.name
+        elif sort == "movie":
+            value = self.movies[c.movie_id].title
+        elif sort == "number_of_lines":
+            value = c.num_lines
+        else:
+            assert False
+        return _character_keys[sort](value, c.id)
+
+    def _search(self, order, order_key, after, wanted, name, text, ids, candidates):
+        """
+        Yields the rows of `order` that match the name filter, starting after the
+        cursor. `ids` are the trigram index candidates for the name, if any.
+        """
+        match = _ilike(name) if name != "" else None
+        # Sorting the candidates costs about ten times more per row than
+        # skipping a row on the walk, and the walk stops after roughly
+        # wanted * len(order) / len(ids) rows.
+        if (
+            match is not None
+            and ids is not None
+            and 10 * len(ids) * len(ids) < wanted * len(order)
+        ):
+            order = sorted(candidates(ids))
+        start = _after(order, order_key, after) if after else 0
+        rows = (obj for _, obj in islice(order, start, None))
+        if match is not None:
+            if ids is not None:
+                # Walking anyway; the set lookup rejects most rows cheaply
+                rows = (obj for obj in rows if obj.id in ids)
+            rows = (obj for obj in rows if match(text(obj)))
+        return rows
+
+    def _top_characters(self, movie_id):
+        top = self._movie_top_characters.get(movie_id)
+        if top is not None:
+            return top
+
+        counts = [
+            (character_id, n)
+            for character_id, n in self.movie_line_counts[movie_id].items()
+            if character_id in self.characters
+        ]
+        counts.sort(key=lambda item: (-item[1], item[0]))
+        top = [
+            {
+                "character_id": character_id,
+                "character": self.characters[character_id].name,
+                "num_lines": n,
+            }
+            for character_id, n in counts[:5]
+        ]
+        self._movie_top_characters[movie_id] = top
+        return top
+
+    def get_movie(self, movie_id):
+        movie = self.movies.get(movie_id)
+        if movie is None:
+            return None
+
+        return {
+            "movie_id": movie_id,
+            "title": movie.title,
+            "top_characters": self._top_characters(movie_id),
+        }
+
+    def list_movies(self, name, limit, offset, sort, after=None):
+        """
+        `after` is the (sort key, movie_id) of a cursor to continue after.
+        """
+        movies = self._search(
+            self._movie_orders[sort],
+            _movie_keys[sort],
+            after,
+            offset + limit,
+            name,
+            lambda m: m.title,
+            self.movie_titles.candidates(name),
+            lambda ids: (
+                (self._movie_key(sort, self.movies[id]), self.movies[id]) for id in ids
+            ),
+        )
+
+        return [
+            {
+                "movie_id": m.id,
+                "movie_title": m.title,
+                "year": m.year,
+                "imdb_rating": m.imdb_rating,
+                "imdb_votes": m.imdb_votes,
+            }
+            for m in islice(movies, offset, offset + limit)
+        ]
+
+    def _top_conversations(self, character_id):
+        top = self._ranked_partners.get(character_id)
+        if top is not None:
+            return top
+
+        partners = sorted(
+            self.partner_lines[character_id].items(),
+            key=lambda item: (-item[1], item[0]),
+        )
+        top = [
+            {
+                "character_id": partner,
+                "character": self.characters[partner].name,
+                "gender": self.characters[partner].gender,
+                "number_of_lines_together": n,
+            }
+            for partner, n in partners
+            if partner in self.characters
+        ]
+        self._ranked_partners[character_id] = top
+        return top
+
+    def get_character(self, character_id):
+        character = self.characters.get(character_id)
+        if character is None or character.movie_id not in self.movies:
+            return None
+
+        return {
+            "character_id": character_id,
+            "character": character.name,
+            "movie": self.movies[character.movie_id].title,
+            "gender": character.gender,
+            "top_conversations": self._top_conversations(character_id),
+        }
+
+    def list_characters(self, name, limit, offset, sort, after=None):
+        """
+        `after` is the (sort key, character_id) of a cursor to continue after.
+        """
+        characters = self._search(
+            self._character_order(sort),
+            _character_keys[sort],
+            after,
+            offset + limit,
+            name,
+            lambda c: c.name,
+            self.character_names.candidates(name),
+            lambda ids: (
+                (self._character_key(sort, c), c)
+                for c in (self.characters[id] for id in ids)
+                if self._listed(c)
+            ),
+        )
+
+        return [
+            {
+                "character_id": c.id,
+                "character": c.name,
+                "movie": self.movies[c.movie_id].title,
+                "number_of_lines": c.num_lines,
+            }
+            for c in islice(characters, offset, offset + limit)
+        ]
+
+    def _joined_lines(self, line_ids):
+        # Lines whose character or movie is missing drop out, like the joins
+        for line_id in line_ids:
+            line = self.lines[line_id]
+            character = self.characters.get(line.c_id)
+            movie = self.movies.get(line.movie_id)
+            if character is not None and movie is not None:
+                yield line, character, movie
+
+    def iter_character_lines(self, character_id, after=None):
+        """
+        `after` is the line_id of a cursor to continue after.
+        """
+        line_ids = self.character_lines.get(character_id, ())
+        if after is not None:
+            line_ids = line_ids[bisect_right(line_ids, after) :]
+        for line, character, movie in self._joined_lines(line_ids):
+            yield {
+                "line_id": line.id,
+                "character": character.name,
+                "movie": movie.title,
+                "conversation_id": line.conv_id,
+                "line_text": line.line_text,
+            }
+
+    def get_character_lines(self, character_id, limit=None, after=None):
+        return list(islice(self.iter_character_lines(character_id, after), limit))
+
+    def get_line(self, line_id):
+        if line_id not in self.lines:
+            return None
+        for line, character, movie in self._joined_lines([line_id]):
+            return {
+                "line_id": line.id,
+                "line_text": line.line_text,
+                "character": character.name,
+                "movie": movie.title,
+                "conversation_id": line.conv_id,
+            }
+        return None
+
+    def get_conversation(self, conversation_id, limit=None, after=None):
+        """
+        `after` is the (line_sort, line_id) of a cursor to continue after.
+        Lines come with their `line_sort`, for cursors.
+        """
+        line_ids = self.conversation_lines.get(conversation_id, ())
+        if after is not None:
+            line_ids = [
+                line_id
+                for line_id in line_ids
+                if (self.lines[line_id].line_sort, line_id) > after
+            ]
+        return [
+            {
+                "line_id": line.id,
+                "character": character.name,
+                "movie": movie.title,
+                "line_text": line.line_text,
+                "line_sort": line.line_sort,
+            }
+            for line, character, movie in islice(self._joined_lines(line_ids), limit)
+        ]
+
+
+# Set by load() when the memory read engine is enabled
+store = None
+
+
+def load():
+    global store
+    new_store = Store()
+    with db.engine.connect() as conn:
+        new_store.load(conn)
+    store = new_store
@@ -0,0 +1,103 @@
+import threading
+
+# Process-wide metrics, served in the Prometheus text format by GET /metrics.
+# Each metric keeps one value per combination of label values it was updated
+# with.
+
+registry = []
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        # Unlabelled counters start out at 0, labelled ones when first used
+        self.values = {} if labelnames else {(): 0}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            yield f"{self.name}{_label_text(labels)} {value}"
+
+
+class Gauge:
+    """
+    A value read when the metrics are rendered. `read` returns either a number
+    or a list of (labels dict, number) pairs.
+    """
+
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+        registry.append(self)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        values = self.read()
+        if not isinstance(values, list):
+            values = [({}, values)]
+        for labels, value in values:
+            yield f"{self.name}{_label_text(sorted(labels.items()))} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = sorted(buckets)
+        # labels -> [count per bucket..., sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self.lock:
+            values = [(labels, list(counts)) for labels, counts in self.values.items()]
+        for labels, counts in values:
+            for bound, count in zip(self.buckets, counts):
+                le = labels + (("le", repr(float(bound))),)
+                yield f"{self.name}_bucket{_label_text(le)} {count}"
+            le = labels + (("le", "+Inf"),)
+            yield f"{self.name}_bucket{_label_text(le)} {counts[-1]}"
+            yield f"{self.name}_sum{_label_text(labels)} {counts[-2]}"
+            yield f"{self.name}_count{_label_text(labels)} {counts[-1]}"
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
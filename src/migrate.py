@@ -0,0 +1,184 @@
+import argparse
+import os
+import re
+import sys
+import sqlalchemy
+from sqlalchemy import Column, Integer, Text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from src import database as db
+
+# Versioned schema migrations. migrations/ holds numbered SQL files,
+# NNNN_description.sql, applied in order, and each one applied to a database
+# is recorded in its schema_migrations table:
+#
+#     python -m src.migrate            # apply the ones not applied yet
+#     python -m src.migrate --status   # list them and whether they're applied
+#
+# Each migration runs in its own transaction, and concurrent runs wait for
+# each other on an advisory lock. Migrations are written to be safe to apply
+# again, so a database that had them applied by hand with psql before this
+# table existed just gets them again on its first run.
+#
+# A migration that needs an extension not every Postgres build has, like
+# pg_trgm on a bare local install, says so in a comment line:
+#
+#     -- Requires extension: pg_trgm
+#
+# Where the extension isn't available the migration is skipped with a warning
+# and not recorded, so a later run applies it once the extension is installed.
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(__file__)), "migrations")
+
+_FILE_NAME = re.compile(r"(\d+)_\w+\.sql")
+_REQUIRES = re.compile(r"^-- Requires extension: (\w+)$", re.MULTILINE)
+
+# Key for pg_advisory_lock, held while migrating
+LOCK_ID = 4242001
+
+metadata_obj = sqlalchemy.MetaData()
+
+schema_migrations = sqlalchemy.Table(
+    "schema_migrations",
+    metadata_obj,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("name", Text, nullable=False),
+    Column(
+        "applied_at",
+        sqlalchemy.TIMESTAMP(timezone=True),
+        nullable=False,
+        server_default=sqlalchemy.func.now(),
+    ),
+)
+
+
+def migrations():
+    """
+    The (version, file name) of every migration, in order.
+    """
+    found = []
+    for name in os.listdir(MIGRATIONS):
+        match = _FILE_NAME.fullmatch(name)
+        if match is not None:
+            found.append((int(match.group(1)), name))
+    return sorted(found)
+
+
+def applied(conn):
+    """
+    The versions of the migrations applied to the database.
+    """
+    schema_migrations.create(conn, checkfirst=True)
+    return set(conn.execute(sqlalchemy.select(schema_migrations.c.version)).scalars())
+
+
+def _read(name):
+    with open(os.path.join(MIGRATIONS, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def missing_extensions(conn, name):
+    """
+    The extensions a migration requires that the database can't install.
+    """
+    required = _REQUIRES.findall(_read(name))
+    if not required:
+        return []
+    available = set(
+        conn.execute(
+            sqlalchemy.text(
+                "SELECT name FROM pg_available_extensions WHERE name IN :names"
+            ).bindparams(sqlalchemy.bindparam("names", expanding=True)),
+            {"names": required},
+        ).scalars()
+    )
+    return [extension for extension in required if extension not in available]
+
+
+def _skip(conn, name):
+    missing = missing_extensions(conn, name)
+    if missing:
+        print(
+            f"skipped {name}: {', '.join(missing)} is not available",
+            file=sys.stderr,
+        )
+    return bool(missing)
+
+
+def apply(conn, version, name):
+    """
+    Applies a migration in `conn`'s transaction and records it.
+    """
+    sql = _read(name)
+    # On the driver's cursor, which leaves the % in comments alone
+    conn.connection.dbapi_connection.cursor().execute(sql)
+
+    insert = pg_insert(schema_migrations).values(version=version, name=name)
+    conn.execute(
+        insert.on_conflict_do_update(
+            index_elements=[schema_migrations.c.version],
+            set_={"name": insert.excluded.name, "applied_at": sqlalchemy.func.now()},
+        )
+    )
+
+
+def reapply(conn):
+    """
+    Applies every migration again in `conn`'s transaction, applied before or
+    not, except those skipped for a missing extension. They recompute what they
+    derive from the data, so this brings it up to date after a bulk load.
+    """
+    applied(conn)
+    for version, name in migrations():
+        if not _skip(conn, name):
+            apply(conn, version, name)
+
+
+def upgrade(engine=None):
+    """
+    Applies the migrations the database hasn't had yet, in order, and returns
+    the file names of those applied, leaving out any skipped for a missing
+    extension.
+    """
+    engine = engine if engine is not None else db.get_engine()
+    newly_applied = []
+    with engine.connect() as conn:
+        conn.execute(sqlalchemy.select(sqlalchemy.func.pg_advisory_lock(LOCK_ID)))
+        conn.commit()
+        try:
+            with conn.begin():
+                done = applied(conn)
+            for version, name in migrations():
+                if version in done:
+                    continue
+                with conn.begin():
+                    skipped = _skip(conn, name)
+                    if not skipped:
+                        apply(conn, version, name)
+                if not skipped:
+                    newly_applied.append(name)
+        finally:
+            conn.rollback()
+            conn.execute(
+                sqlalchemy.select(sqlalchemy.func.pg_advisory_unlock(LOCK_ID))
+            )
+            conn.commit()
+    return newly_applied
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply the schema migrations.")
+    parser.add_argument(
+        "--status", action="store_true", help="list the migrations, don't apply any"
+    )
+    args = parser.parse_args()
+
+    if args.status:
+        with db.get_engine().begin() as conn:
+            done = applied(conn)
+        for version, name in migrations():
+            print(f"{'applied' if version in done else 'pending':>8} {name}")
+    else:
+        names = upgrade()
+        for name in names:
+            print(f"applied {name}")
+        print(f"{len(names)} migrations applied")
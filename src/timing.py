@@ -0,0 +1,75 @@
+import contextvars
+import threading
+import time
+import sqlalchemy
+from sqlalchemy.engine import Engine
+
+# Where a request's time goes: the queries it ran, how long they took and how
+# many rows they returned, the wait for a pooled connection, and rendering
+# the response. src/api/server_timing.py starts the accounting for each
+# request and reports it. Queries are counted by hooks on every engine, sync
+# and async, and count towards whichever request they run for.
+
+_current = contextvars.ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.pool_seconds = 0.0
+        self.serialize_seconds = 0.0
+        # Queries of one request can run in several threads at once
+        self.lock = threading.Lock()
+
+    def add_query(self, seconds, rows):
+        with self.lock:
+            self.queries += 1
+            self.db_seconds += seconds
+            self.rows += rows
+
+
+def start():
+    """
+    Starts accounting for a request, for the rest of the current context.
+    Returns the RequestTimings and a token for finish().
+    """
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def finish(token):
+    _current.reset(token)
+
+
+def add_pool_wait(seconds):
+    timings = _current.get()
+    if timings is not None:
+        with timings.lock:
+            timings.pool_seconds += seconds
+
+
+def add_serialize(seconds):
+    timings = _current.get()
+    if timings is not None:
+        with timings.lock:
+            timings.serialize_seconds += seconds
+
+
+@sqlalchemy.event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None and context is not None:
+        context.query_started = time.perf_counter()
+
+
+@sqlalchemy.event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = _current.get()
+    started = getattr(context, "query_started", None)
+    if timings is None or started is None:
+        return
+    elapsed = time.perf_counter() - started
+    # rowcount is the rows returned for a query, and rows changed otherwise
+    rows = cursor.rowcount if cursor.description is not None else 0
+    timings.add_query(elapsed, max(rows, 0))
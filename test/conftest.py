@@ -0,0 +1,202 @@
+import contextlib
+import os
+import shutil
+import tempfile
+import anyio.from_thread
+import pytest
+import sqlalchemy
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import create_async_engine
+from src import cache
+from src import data_version
+from src import database as db
+from src import loader
+
+# The database the tests run against, chosen by TEST_DATABASE:
+# * local (the default) - a throwaway Postgres started for the session with
+#   pgserver (pip install pgserver), which needs no server of your own and
+#   works offline. It's loaded once from the shipped CSVs and the lines in
+#   test/lines.csv, made up by test/make_lines.py to give the responses the
+#   JSON fixtures under test/ record, or from TEST_LINES, the path of another
+#   lines.csv, such as the full corpus's.
+# * env - the database the POSTGRES_* variables configure, as it's loaded.
+#
+# Each test runs twice, with the app's queries going through DB_MODE=sync and
+# DB_MODE=async, and each time in a transaction on a connection of its own
+# that's rolled back after it, so what it writes through the API is gone by the
+# next test. Every connection the app opens during the test is a savepoint in
+# that transaction, and sees what the test wrote so far. The app gets them one
+# at a time, as savepoints opened side by side on one connection would undo
+# each other's work. In async mode the test's requests all run on one event
+# loop, since its asyncpg connection can't be used from another.
+#
+# Under pytest-xdist every worker starts and loads its own server.
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TEST_DIR)
+
+
+class _Savepoint:
+    # A DBAPI connection for the app that's really a savepoint in the test's
+    # transaction on `raw`: committing releases it, and rolling back or
+    # closing rolls back to it
+    def __init__(self, raw):
+        self._raw = raw
+        self._open = False
+
+    def cursor(self, *args, **kwargs):
+        if not self._open:
+            self._raw.cursor().execute("SAVEPOINT app")
+            self._open = True
+        return self._raw.cursor(*args, **kwargs)
+
+    def commit(self):
+        if self._open:
+            self._open = False
+            self._raw.cursor().execute("RELEASE SAVEPOINT app")
+
+    def rollback(self):
+        if self._open:
+            self._open = False
+            # Separately, asyncpg prepares each statement
+            self._raw.cursor().execute("ROLLBACK TO SAVEPOINT app")
+            self._raw.cursor().execute("RELEASE SAVEPOINT app")
+
+    def close(self):
+        self.rollback()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+def _savepoint_engine(raw, dialect, url, poolclass):
+    # The dialect is the database engine's, already set up; its pool's hooks
+    # for new connections were run on the real connection
+    pool = poolclass(
+        lambda: _Savepoint(raw),
+        pool_size=1,
+        max_overflow=0,
+        timeout=10,
+        dialect=dialect,
+    )
+    return sqlalchemy.engine.Engine(pool, dialect, url)
+
+
+@contextlib.contextmanager
+def _async_transaction(database, monkeypatch):
+    with anyio.from_thread.start_blocking_portal() as portal:
+        # TestClient starts an event loop for each request otherwise
+        monkeypatch.setattr(
+            anyio.from_thread,
+            "start_blocking_portal",
+            lambda **kwargs: contextlib.nullcontext(portal),
+        )
+        real = create_async_engine(
+            database.url.set(drivername="postgresql+asyncpg"),
+            poolclass=sqlalchemy.pool.NullPool,
+        )
+        sqlalchemy.event.listen(
+            real.sync_engine, "connect", db._decode_float4_as_text
+        )
+
+        async def connect():
+            conn = await real.connect()
+            raw = await conn.get_raw_connection()
+            return conn, raw.dbapi_connection
+
+        async def close():
+            await engine.dispose()
+            await conn.rollback()
+            await conn.close()
+            await real.dispose()
+
+        conn, raw = portal.call(connect)
+        engine = AsyncEngine(
+            _savepoint_engine(
+                raw,
+                real.dialect,
+                real.url,
+                sqlalchemy.pool.AsyncAdaptedQueuePool,
+            )
+        )
+        monkeypatch.setattr(db, "get_async_engine", lambda: engine)
+        monkeypatch.setattr(db, "_async_engine", engine)
+        try:
+            yield
+        finally:
+            portal.call(close)
+
+
+def _load(directory):
+    for name in ["movies", "characters", "conversations"]:
+        shutil.copy(os.path.join(ROOT, f"{name}.csv"), directory)
+    lines = os.environ.get("TEST_LINES") or os.path.join(TEST_DIR, "lines.csv")
+    shutil.copy(lines, os.path.join(directory, "lines.csv"))
+    loader.load(directory)
+
+
+@pytest.fixture(scope="session")
+def database():
+    """
+    The engine for the tests' database, loaded and ready.
+    """
+    backend = os.environ.get("TEST_DATABASE", "local")
+    if backend == "env":
+        yield db.get_engine()
+        return
+    elif backend != "local":
+        pytest.exit(f"TEST_DATABASE must be local or env, not {backend!r}")
+
+    try:
+        import pgserver
+    except ImportError:
+        pytest.exit(
+            "the throwaway test database needs pgserver (pip install pgserver),"
+            " or set TEST_DATABASE=env to use the configured database"
+        )
+
+    directory = tempfile.mkdtemp(prefix="movie-api-test-")
+    try:
+        server = pgserver.get_server(
+            os.path.join(directory, "pgdata"), cleanup_mode="delete"
+        )
+        with pytest.MonkeyPatch.context() as patch:
+            patch.setenv("DATABASE_URL", server.get_uri("postgres"))
+            patch.setattr(db, "_engine", None)
+            _load(directory)
+            yield db.get_engine()
+            db.get_engine().dispose()
+        server.cleanup()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True, params=["sync", "async"])
+def transaction(request, database, monkeypatch):
+    """
+    Runs the test in a transaction that's rolled back afterwards, in the
+    DB_MODE of the parameter.
+    """
+    raw = database.raw_connection()
+    engine = _savepoint_engine(
+        raw.dbapi_connection,
+        database.dialect,
+        database.url,
+        sqlalchemy.pool.QueuePool,
+    )
+    monkeypatch.setattr(db, "_engine", engine)
+    monkeypatch.setattr(db, "async_mode", request.param == "async")
+    # The version goes back down with the rollback
+    monkeypatch.setattr(data_version, "_current", None)
+    cache.cache.clear()
+    try:
+        if request.param == "async":
+            with _async_transaction(database, monkeypatch):
+                yield
+        else:
+            yield
+    finally:
+        engine.dispose()
+        raw.rollback()
+        raw.close()
+        cache.cache.clear()
@@ -0,0 +1,385 @@
+import argparse
+import collections
+import csv
+import json
+import os
+import random
+
+# Makes up test/lines.csv, the lines the tests load with the shipped movies,
+# characters and conversations (see conftest.py). The corpus's lines are too
+# big to ship, so these are made to give the responses the JSON fixtures under
+# test/ record:
+# * the characters of each list fixture with its line counts, in its window of
+#   the sorted list, with no others listed between them and just enough
+#   before them to fill its offset
+# * the top characters of the movie fixtures, and the lines together of the
+#   top conversations of the character fixtures
+# * the lines of the line fixtures, with their ids and text
+# Everyone else gets a few lines of random words. The output is the same every
+# time, and test_lines_fixture.py checks test/lines.csv against it, so after a
+# fixture changes run
+#
+#     python -m test.make_lines
+#
+# and commit the new test/lines.csv.
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TEST_DIR)
+
+WORDS = (
+    "I you what the a to it is no yes not that here there now never always why "
+    "how where go come back home money time right wrong sorry please thanks "
+    "know think want need love kill tell look wait stop listen hell god man"
+).split()
+
+# The characters whose top conversations have fixtures
+PAIR_FIXTURES = [2, 7421, 6967]
+# JACKIE (6957) has a fixture of all her lines, each in one of these
+# conversations. The others' lines in them get ids after hers.
+JACKIE = 6957
+JACKIE_CONVERSATIONS = (63810, 63811, 63812, 63813)
+# Where the others' ids start when a conversation has none of hers
+JACKIE_IDS_FROM = 431123
+# /lines/7414 is a 404
+MISSING_LINE = 7414
+
+
+def _fixture(path):
+    with open(os.path.join(TEST_DIR, path), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _csv(name):
+    with open(os.path.join(ROOT, f"{name}.csv"), encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+class _Plan:
+    # How many lines each character gets: `need` has the exact counts the
+    # fixtures show, and `listed` is True for characters that must have lines
+    # and False for ones that mustn't have any
+    def __init__(self, characters, movies):
+        self.names = {}
+        self.titles = {}
+        self.movie_of = {}
+        for row in characters:
+            id = int(row["character_id"])
+            self.names[id] = row["name"]
+            self.titles[id] = movies[int(row["movie_id"])]["title"]
+            self.movie_of[id] = int(row["movie_id"])
+        self.need = {}
+        self.listed = {}
+        # Characters before each window, with the offset to fill from them
+        self.before = []
+        # movie_id -> (num_lines, character_id, character ids) of the last of
+        # its top characters, and all of them
+        self.top = {}
+
+    def require(self, id, num_lines=None):
+        if self.listed.get(id) is False:
+            raise ValueError(f"character {id} is both listed and not")
+        self.listed[id] = True
+        if num_lines is not None:
+            if self.need.get(id, num_lines) != num_lines:
+                raise ValueError(f"character {id} needs two line counts")
+            self.need[id] = num_lines
+
+    def forbid(self, id):
+        if self.listed.get(id) is True:
+            raise ValueError(f"character {id} is both listed and not")
+        self.listed[id] = False
+
+    def window(self, name, sort, offset, limit, path):
+        # A page of /characters/?name=...&sort=... with its offset and limit
+        expected = _fixture(path)
+        keys = self.names if sort == "character" else self.titles
+        candidates = sorted(
+            (id for id in self.names if name in self.names[id].lower()),
+            key=lambda id: (keys[id].encode(), id),
+        )
+        position = {id: i for i, id in enumerate(candidates)}
+        ids = [row["character_id"] for row in expected]
+        first = position[ids[0]]
+        last = position[ids[-1]]
+        for row in expected:
+            self.require(row["character_id"], row["number_of_lines"])
+        for id in candidates[first : last + 1]:
+            if id not in ids:
+                self.forbid(id)
+        if len(ids) < limit:
+            for id in candidates[last + 1 :]:
+                self.forbid(id)
+        self.before.append((candidates[:first], offset))
+
+    def fill_offsets(self):
+        # Exactly `offset` characters listed before each window: the ones
+        # already required, and then the last of the others
+        for before, offset in self.before:
+            required = [id for id in before if self.listed.get(id) is True]
+            free = [id for id in before if self.listed.get(id) is None]
+            wanted = offset - len(required)
+            if wanted < 0 or wanted > len(free):
+                raise ValueError(f"can't list {offset} characters before a window")
+            for id in free[len(free) - wanted :] if wanted else []:
+                self.require(id)
+            for id in before:
+                if self.listed.get(id) is None:
+                    self.forbid(id)
+
+    def max_lines(self, id):
+        # A character outside its movie's top five has to rank below them
+        movie_id = self.movie_of[id]
+        if movie_id in self.top and id not in self.top[movie_id][2]:
+            num_lines, last, _ = self.top[movie_id]
+            return num_lines if id > last else num_lines - 1
+        return None
+
+
+def _plan(characters, movies):
+    plan = _Plan(characters, movies)
+    plan.window("", "character", 0, 50, "characters/root.json")
+    plan.window(
+        "an",
+        "character",
+        5,
+        50,
+        "characters/characters-name=an&limit=50&offset=5&sort=number_of_lines.json",
+    )
+    plan.window(
+        " ",
+        "movie",
+        42,
+        250,
+        "characters/characters-name=space&limit=250&offset=42&sort=movie.json",
+    )
+    plan.window(
+        "an",
+        "movie",
+        10,
+        20,
+        "characters/characters-name=an&limit=20&offset=10&sort=movie.json",
+    )
+
+    amy = _fixture(
+        "characters/characters-name=amy&limit=50&offset=0&sort=number_of_lines.json"
+    )
+    for row in amy:
+        plan.require(row["character_id"], row["number_of_lines"])
+    listed = {row["character_id"] for row in amy}
+    for id, name in plan.names.items():
+        if "amy" in name.lower() and id not in listed:
+            plan.forbid(id)
+
+    for movie_id in (44, 3, 436):
+        top = _fixture(f"movies/{movie_id}.json")["top_characters"]
+        for row in top:
+            plan.require(row["character_id"], row["num_lines"])
+        plan.top[movie_id] = (
+            top[-1]["num_lines"],
+            top[-1]["character_id"],
+            {row["character_id"] for row in top},
+        )
+
+    plan.require(JACKIE, len(_fixture(f"lines/character_id={JACKIE}.json")))
+    plan.require(2)
+    for id, num_lines in plan.need.items():
+        most = plan.max_lines(id)
+        if most is not None and num_lines > most:
+            raise ValueError(f"character {id} outranks its movie's top five")
+    plan.fill_offsets()
+    return plan
+
+
+def _fixed_lines():
+    # (line_id, conversation_id, character_id, line_text) of the lines the
+    # line fixtures show
+    fixed = []
+    for row in _fixture("lines/conversation_id=0.json"):
+        speaker = 0 if row["character"] == "BIANCA" else 2
+        fixed.append((row["line_id"], 0, speaker, row["line_text"]))
+    line = _fixture("lines/92.json")
+    fixed.append((92, 69, 7, line["line_text"]))
+    for row in _fixture(f"lines/character_id={JACKIE}.json"):
+        fixed.append((row["line_id"], row["conversation_id"], JACKIE, row["line_text"]))
+    return fixed
+
+
+def _line_counts(plan, conversations, fixed):
+    # (conversation_id, character_id) -> number of lines
+    counts = collections.Counter()
+    by_character = collections.Counter()
+
+    def add(conversation_id, character_id, n):
+        counts[conversation_id, character_id] += n
+        by_character[character_id] += n
+
+    def remaining(id):
+        return plan.need[id] - by_character[id] if id in plan.need else None
+
+    for _, conversation_id, speaker, _ in fixed:
+        add(conversation_id, speaker, 1)
+
+    conversations_of = collections.defaultdict(list)
+    for conversation_id, (first, second, _) in conversations.items():
+        conversations_of[first].append(conversation_id)
+        conversations_of[second].append(conversation_id)
+
+    # The lines of the conversations of characters with pair fixtures are set
+    # by them, so nobody else's counts go there
+    locked = set()
+    partners = {}
+    for id in PAIR_FIXTURES:
+        locked.update(conversations_of[id])
+        partners[id] = {
+            row["character_id"]: row["number_of_lines_together"]
+            for row in _fixture(f"characters/{id}.json")["top_conversations"]
+        }
+
+    for id in PAIR_FIXTURES:
+        for partner, together in partners[id].items():
+            shared = [
+                k for k in conversations_of[id] if partner in conversations[k][:2]
+            ]
+            already = sum(counts[k, id] + counts[k, partner] for k in shared)
+            # Conversation 0's lines are all fixed
+            shared = [k for k in shared if k != 0]
+            rest = together - already
+            if rest < 0:
+                raise ValueError(f"characters {id} and {partner} have too many lines")
+            # The partner's share first when its count is fixed
+            partner_left = remaining(partner)
+            own_left = remaining(id)
+            if partner_left is None:
+                partner_share = rest // 2
+            else:
+                partner_share = min(rest, partner_left)
+            own_share = rest - partner_share
+            if own_left is not None and own_share > own_left:
+                partner_share += own_share - own_left
+                own_share = own_left
+            for i in range(own_share):
+                add(shared[i % len(shared)], id, 1)
+            for i in range(partner_share):
+                add(shared[i % len(shared)], partner, 1)
+
+    for id in PAIR_FIXTURES:
+        if remaining(id) not in (None, 0):
+            raise ValueError(f"character {id}'s pairs don't add up to its lines")
+
+    def unlocked(id):
+        return [k for k in conversations_of[id] if k not in locked]
+
+    for id in sorted(plan.need):
+        left = remaining(id)
+        if left < 0:
+            raise ValueError(f"character {id} has too many lines")
+        if left and not unlocked(id):
+            raise ValueError(f"character {id} has nowhere to put its lines")
+        for i in range(left):
+            add(unlocked(id)[i % len(unlocked(id))], id, 1)
+
+    rng = random.Random(0)
+    for id in sorted(plan.names):
+        if id in plan.need or plan.listed.get(id) is False or not unlocked(id):
+            continue
+        n = rng.randint(1, 6)
+        most = plan.max_lines(id)
+        if most is not None:
+            n = min(n, most)
+        for i in range(n):
+            add(unlocked(id)[i % len(unlocked(id))], id, 1)
+
+    for id, listed in plan.listed.items():
+        if listed and not by_character[id]:
+            raise ValueError(f"character {id} has no lines")
+    return counts, rng
+
+
+def lines():
+    """
+    The rows of test/lines.csv, header first.
+    """
+    movies = {int(row["movie_id"]): row for row in _csv("movies")}
+    characters = _csv("characters")
+    conversations = {
+        int(row["conversation_id"]): (
+            int(row["character1_id"]),
+            int(row["character2_id"]),
+            int(row["movie_id"]),
+        )
+        for row in _csv("conversations")
+    }
+    plan = _plan(characters, movies)
+    fixed = _fixed_lines()
+    counts, rng = _line_counts(plan, conversations, fixed)
+
+    fixed_by_conversation = collections.defaultdict(list)
+    for line_id, conversation_id, speaker, text in fixed:
+        fixed_by_conversation[conversation_id].append((line_id, speaker, text))
+    reserved = {line_id for line_id, *_ in fixed} | {MISSING_LINE}
+    line_ids = (id for id in range(len(reserved) + sum(counts.values()) + 1))
+    line_ids = (id for id in line_ids if id not in reserved)
+
+    rows = []
+    for conversation_id in sorted(conversations):
+        first, second, movie_id = conversations[conversation_id]
+        speakers = [first] if first == second else [first, second]
+        left = {id: counts[conversation_id, id] for id in speakers}
+        pending = {id: [] for id in speakers}
+        for line in fixed_by_conversation[conversation_id]:
+            left[line[1]] -= 1
+            pending[line[1]].append(line)
+
+        # The two take turns, with the fixed lines at their speaker's turns
+        turns = []
+        turn = first
+        while any(left[id] > 0 or pending[id] for id in speakers):
+            if not (left[turn] > 0 or pending[turn]):
+                turn = second if turn == first else first
+            if pending[turn]:
+                turns.append(pending[turn].pop(0))
+            else:
+                left[turn] -= 1
+                turns.append((None, turn, None))
+            turn = second if turn == first else first
+
+        for line_sort, (line_id, speaker, text) in enumerate(turns, 1):
+            if line_id is None:
+                if conversation_id not in JACKIE_CONVERSATIONS:
+                    line_id = next(line_ids)
+                text = " ".join(rng.choices(WORDS, k=rng.randint(2, 12)))
+                text = text[0].upper() + text[1:] + rng.choice(".?!")
+            rows.append([line_id, speaker, movie_id, conversation_id, line_sort, text])
+
+    used = {row[0] for row in rows if row[0] is not None}
+    for row in rows:
+        if row[0] is None:
+            ids = [other[0] for other in rows if other[3] == row[3] and other[0]]
+            line_id = max(ids) + 1 if ids else JACKIE_IDS_FROM
+            while line_id in used or line_id in reserved:
+                line_id += 1
+            row[0] = line_id
+            used.add(line_id)
+
+    header = [
+        "line_id",
+        "character_id",
+        "movie_id",
+        "conversation_id",
+        "line_sort",
+        "line_text",
+    ]
+    return [header] + rows
+
+
+def write(path):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(lines())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "path", nargs="?", default=os.path.join(TEST_DIR, "lines.csv")
+    )
+    write(parser.parse_args().path)
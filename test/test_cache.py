@@ -0,0 +1,118 @@
+from fastapi import Response
+from fastapi.testclient import TestClient
+
+from src.api.server import app
+from src.api import characters
+from src import cache
+import anyio.from_thread
+import asyncio
+import json
+
+client = TestClient(app)
+
+
+def metric(name):
+    for line in client.get("/metrics").text.splitlines():
+        if line.startswith(name + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0
+
+
+def test_cache_hit():
+    cache.cache.clear()
+    hits = metric('cache_hits_total{route="get_movie"}')
+    first = client.get("/movies/44")
+    second = client.get("/movies/44")
+    assert second.status_code == 200
+    assert second.json() == first.json()
+    assert metric('cache_hits_total{route="get_movie"}') == hits + 1
+
+
+def test_cache_keeps_cursor():
+    cache.cache.clear()
+    first = client.get("/movies/?limit=5&sort=year")
+    second = client.get("/movies/?sort=year&limit=5")
+    assert second.json() == first.json()
+    assert second.headers["X-Next-Cursor"] == first.headers["X-Next-Cursor"]
+
+
+def test_concurrent_requests_coalesce():
+    cache.cache.clear()
+    coalesced = metric('coalesced_requests_total{route="list_characters"}')
+
+    async def request():
+        response = Response()
+        rendered = await characters.list_characters(
+            response=response,
+            name="",
+            limit=50,
+            offset=0,
+            sort=characters.character_sort_options.number_of_lines,
+            cursor=None,
+        )
+        return json.loads(rendered.body), rendered.headers["X-Next-Cursor"]
+
+    async def requests():
+        return await asyncio.gather(*(request() for _ in range(10)))
+
+    # On the event loop the test's requests use, which its asyncpg connection
+    # belongs to in async mode
+    with anyio.from_thread.start_blocking_portal() as portal:
+        results = portal.call(requests)
+    assert all(result == results[0] for result in results)
+    assert metric('coalesced_requests_total{route="list_characters"}') == coalesced + 9
+    assert client.get("/characters/?sort=number_of_lines").json() == results[0][0]
+
+
+def lines_together(character_id, partner_id):
+    response = client.get(f"/characters/{character_id}")
+    for partner in response.json()["top_conversations"]:
+        if partner["character_id"] == partner_id:
+            return partner["number_of_lines_together"]
+    return 0
+
+
+def test_post_conversation_invalidates():
+    cache.cache.clear()
+    before = lines_together(208, 209)
+    lines = client.get("/characters/208/lines").json()
+
+    response = client.post(
+        "/movies/13/conversations/",
+        json={
+            "character_1_id": 208,
+            "character_2_id": 209,
+            "lines": [
+                {"character_id": 208, "line_text": "test"},
+                {"character_id": 209, "line_text": "shut up"},
+            ],
+        },
+    )
+    assert response.status_code == 200
+    assert lines_together(208, 209) == before + 2
+    assert lines_together(209, 208) == before + 2
+    assert len(client.get("/characters/208/lines").json()) == len(lines) + 1
+
+
+def test_cache_max_bytes():
+    line = {"line_id": 1, "line_text": "x" * 1000}
+    size = cache._size([line])
+    responses = cache.ResponseCache(max_entries=10, max_bytes=size * 2)
+
+    for key in ("a", "b", "c"):
+        responses.put(key, [dict(line)], {}, (key,), 60, responses.version)
+    # Least recently used first
+    assert responses.get("a") is None
+    assert responses.get("b") is not None
+    assert responses.get("c") is not None
+    assert responses.size == size * 2
+
+    # Too big to keep at all
+    responses.put("d", [dict(line)] * 3, {}, (), 60, responses.version)
+    assert responses.get("d") is None
+    assert responses.size == size * 2
+
+    responses.invalidate(["b"])
+    assert responses.size == size
+    responses.clear()
+    assert responses.size == 0
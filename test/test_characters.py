@@ -107,3 +107,54 @@ def test_sort_filter_02():
 def test_404():
     response = client.get("/characters/400")
     assert response.status_code == 404
+
+
+def test_cursor_01():
+    # Walking the cursors returns the same rows as offset pagination
+    response = client.get("/characters/?name=an&limit=250&sort=number_of_lines")
+    expected = response.json()
+
+    characters = []
+    response = client.get("/characters/?name=an&limit=50&sort=number_of_lines")
+    while len(characters) < len(expected):
+        assert response.status_code == 200
+        characters += response.json()
+        cursor = response.headers["X-Next-Cursor"]
+        response = client.get(
+            f"/characters/?name=an&limit=50&sort=number_of_lines&cursor={cursor}"
+        )
+
+    assert characters[: len(expected)] == expected
+
+
+def test_cursor_02():
+    response = client.get("/characters/?limit=20&offset=10&sort=movie")
+    cursor = client.get("/characters/?limit=10&sort=movie").headers["X-Next-Cursor"]
+    assert client.get(f"/characters/?limit=20&sort=movie&cursor={cursor}").json() == (
+        response.json()
+    )
+
+
+def test_cursor_400():
+    response = client.get("/characters/?cursor=bulin")
+    assert response.status_code == 400
+
+
+def test_batch_01():
+    # In the order asked for, with null for missing characters
+    response = client.get("/characters:batch?ids=6957,400,0,6957")
+    assert response.status_code == 200
+
+    character = client.get("/characters/6957").json()
+    assert response.json() == [
+        character,
+        None,
+        client.get("/characters/0").json(),
+        character,
+    ]
+
+
+def test_batch_422():
+    assert client.get("/characters:batch?ids=1,two").status_code == 422
+    ids = ",".join(str(id) for id in range(251))
+    assert client.get(f"/characters:batch?ids={ids}").status_code == 422
@@ -0,0 +1,80 @@
+from fastapi.testclient import TestClient
+
+from src.api.server import app
+from src.api import compression
+import gzip
+import pytest
+
+client = TestClient(app)
+
+
+def test_gzip():
+    response = client.get(
+        "/characters/?limit=250", headers={"Accept-Encoding": "gzip"}
+    )
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert int(response.headers["Content-Length"]) < len(response.content)
+
+    plain = client.get(
+        "/characters/?limit=250", headers={"Accept-Encoding": "identity"}
+    )
+    assert "Content-Encoding" not in plain.headers
+    assert response.content == plain.content
+
+
+def test_brotli():
+    brotli = pytest.importorskip("brotli")
+    assert compression.ENCODINGS == ["br", "gzip"]
+    response = client.get(
+        "/characters/?limit=250", headers={"Accept-Encoding": "gzip, br"}
+    )
+    assert response.headers["Content-Encoding"] == "br"
+    assert len(response.json()) == 250
+
+    plain = client.get(
+        "/characters/?limit=250", headers={"Accept-Encoding": "identity"}
+    )
+    assert response.content == plain.content
+
+    body = b'{"movie":"10 things i hate about you"}' * 100
+    compression.compressed_cache.entries.clear()
+    compressed = compression.compressed_cache.compress("br", body)
+    assert brotli.decompress(compressed) == body
+    assert compression.compressed_cache.compress("br", body) is compressed
+
+
+def test_small_response():
+    # Under COMPRESS_MIN_SIZE
+    response = client.get("/lines/92", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert "Content-Encoding" not in response.headers
+
+
+def test_streamed():
+    response = client.get(
+        "/characters/2/lines?format=ndjson", headers={"Accept-Encoding": "gzip"}
+    )
+    assert response.headers["Content-Encoding"] == "gzip"
+    plain = client.get(
+        "/characters/2/lines?format=ndjson", headers={"Accept-Encoding": "identity"}
+    )
+    assert response.text == plain.text
+
+
+def test_compressed_cache():
+    body = b'{"movie":"10 things i hate about you"}' * 100
+    compression.compressed_cache.entries.clear()
+    hits = compression.compressed_cache_hits.values[()]
+    compressed = compression.compressed_cache.compress("gzip", body)
+    assert gzip.decompress(compressed) == body
+    assert compression.compressed_cache.compress("gzip", body) is compressed
+    assert compression.compressed_cache_hits.values[()] == hits + 1
+
+
+def test_choose_encoding():
+    assert compression.choose_encoding("") is None
+    assert compression.choose_encoding("gzip, deflate") == "gzip"
+    assert compression.choose_encoding("gzip;q=0, identity") is None
+    assert compression.choose_encoding("*") == compression.ENCODINGS[0]
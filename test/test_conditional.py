@@ -0,0 +1,97 @@
+from fastapi.testclient import TestClient
+
+from src.api.server import app
+
+client = TestClient(app)
+
+
+def test_etag_304():
+    response = client.get("/movies/")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert response.headers["Last-Modified"]
+
+    response = client.get("/movies/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+    response = client.get("/characters/7421", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+def test_last_modified_304():
+    response = client.get("/characters/7421")
+    last_modified = response.headers["Last-Modified"]
+
+    response = client.get(
+        "/characters/7421", headers={"If-Modified-Since": last_modified}
+    )
+    assert response.status_code == 304
+
+
+def test_unknown_id_404():
+    # Whatever the validators say, there's nothing there to be unmodified
+    last_modified = client.get("/characters/7421").headers["Last-Modified"]
+    for headers in [
+        {"If-None-Match": "*"},
+        {"If-Modified-Since": last_modified},
+    ]:
+        response = client.get("/characters/400000", headers=headers)
+        assert response.status_code == 404
+        assert "ETag" not in response.headers
+
+    response = client.get("/characters/7421", headers={"If-None-Match": "*"})
+    assert response.status_code == 304
+
+
+def test_stale_etag():
+    response = client.get("/movies/", headers={"If-None-Match": 'W/"0"'})
+    assert response.status_code == 200
+    assert response.json()
+
+
+def test_errors_have_no_etag():
+    response = client.get("/characters/400000")
+    assert response.status_code == 404
+    assert "ETag" not in response.headers
+
+
+def test_post_conversation_changes_etag():
+    etag = client.get("/characters/208").headers["ETag"]
+
+    response = client.post(
+        "/movies/13/conversations/",
+        json={"character_1_id": 208, "character_2_id": 209, "lines": []},
+    )
+    assert response.status_code == 200
+
+    response = client.get("/characters/208", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_negotiated_format_etag():
+    url = "/characters/2/lines"
+    response = client.get(url)
+    assert "Accept" in response.headers["Vary"].split(", ")
+    etag = response.headers["ETag"]
+
+    ndjson = {"Accept": "application/x-ndjson"}
+    response = client.get(url, headers=ndjson)
+    assert response.status_code == 200
+    assert "Accept" in response.headers["Vary"].split(", ")
+    assert response.headers["ETag"] != etag
+    assert client.get(url + "?format=ndjson").headers["ETag"] == (
+        response.headers["ETag"]
+    )
+
+    # The JSON's ETag doesn't match the NDJSON
+    response = client.get(url, headers={**ndjson, "If-None-Match": etag})
+    assert response.status_code == 200
+
+    response = client.get(
+        url, headers={**ndjson, "If-None-Match": response.headers["ETag"]}
+    )
+    assert response.status_code == 304
+    assert response.headers["Vary"] == "Accept"
@@ -1,28 +1,31 @@
 from fastapi.testclient import TestClient
 
 from src.api.server import app
+from src.api import conversations
 from src import database as db
 from src.datatypes import Conversation, Line
+import anyio.from_thread
+import pytest
 import sqlalchemy
 
 client = TestClient(app)
 
 
 def test_post_conversation_01():
-    # Post then get on the conv_id and hope it comes as expected then delete it
+    # Post then get on the conv_id and hope it comes as expected
     with db.engine.connect() as conn:
         result = conn.execute(
             sqlalchemy.select(
                 sqlalchemy.sql.functions.max(db.lines.c.line_id),
             )
         )
-        cur_id = result.first().max_1 + 1
+        max_line_id = result.first().max_1
         result = conn.execute(
             sqlalchemy.select(
                 sqlalchemy.sql.functions.max(db.conversations.c.conversation_id),
             )
         )
-        conv_id = result.first().max_1 + 1
+        max_conv_id = result.first().max_1
 
     response = client.post(
         "/movies/13/conversations/",
@@ -47,13 +50,17 @@ def test_post_conversation_01():
         }
     )
     assert response.status_code == 200
-    assert response.json()["conversation_id"] == conv_id
+    # Ids come from sequences, so they're new but not necessarily max + 1
+    assert response.json()["conversation_id"] > max_conv_id
 
     conv_id = response.json()["conversation_id"]
     get_request = "/lines/conversations/" + str(conv_id)
     response = client.get(get_request)
     assert response.status_code == 200
 
+    cur_id = response.json()[0]["line_id"]
+    assert cur_id > max_line_id
+
     expected_response = [
         {
             "line_id": cur_id,
@@ -77,19 +84,89 @@ def test_post_conversation_01():
 
     assert response.json() == expected_response
 
-    with db.engine.begin() as conn:
-        result = conn.execute(
-            sqlalchemy.delete(
-                db.lines,
-            )
-            .where(db.lines.c.conversation_id == conv_id)
-        )
-        result = conn.execute(
-            sqlalchemy.delete(
-                db.conversations,
-            )
-            .where(db.conversations.c.conversation_id == conv_id)
-        )
+
+def number_of_lines(character_id, name):
+    response = client.get(f"/characters/?name={name}&limit=250")
+    for character in response.json():
+        if character["character_id"] == character_id:
+            return character["number_of_lines"]
+    return 0
+
+
+def top_characters(movie_id):
+    response = client.get(f"/movies/{movie_id}")
+    return [
+        (character["character_id"], character["num_lines"])
+        for character in response.json()["top_characters"]
+    ]
+
+
+def test_post_conversation_updates_line_counts():
+    murdock = number_of_lines(208, "MURDOCK")
+    oveur = number_of_lines(209, "OVEUR")
+    top = top_characters(13)
+    # Enough lines to put MURDOCK first in the movie
+    said = top[0][1] - murdock + 1
+
+    response = client.post(
+        "/movies/13/conversations/",
+        json={
+            "character_1_id": 208,
+            "character_2_id": 209,
+            "lines": [{"character_id": 208, "line_text": "test"}] * said
+            + [{"character_id": 209, "line_text": "shut up"}],
+        },
+    )
+    assert response.status_code == 200
+
+    assert number_of_lines(208, "MURDOCK") == murdock + said
+    assert number_of_lines(209, "OVEUR") == oveur + 1
+    counts = dict(top)
+    counts.update({208: murdock + said, 209: oveur + 1})
+    expected = sorted(counts.items(), key=lambda count: (-count[1], count[0]))
+    assert top_characters(13) == expected[:5]
+    assert top_characters(13)[0] == (208, murdock + said)
+
+
+def lines_together(character_id):
+    response = client.get(f"/characters/{character_id}")
+    return {
+        partner["character_id"]: partner["number_of_lines_together"]
+        for partner in response.json()["top_conversations"]
+    }
+
+
+def test_post_conversation_updates_pairs():
+    murdock = lines_together(208)
+    oveur = lines_together(209)
+
+    response = client.post(
+        "/movies/13/conversations/",
+        json={
+            "character_1_id": 208,
+            "character_2_id": 209,
+            "lines": [
+                {"character_id": 208, "line_text": "test"},
+                {"character_id": 209, "line_text": "shut up"},
+                {"character_id": 208, "line_text": "the hell you just say to me?"},
+            ],
+        },
+    )
+    assert response.status_code == 200
+
+    # Every line of the conversation counts for both of them
+    murdock[209] = murdock.get(209, 0) + 3
+    oveur[208] = oveur.get(208, 0) + 3
+    assert lines_together(208) == murdock
+    assert lines_together(209) == oveur
+
+    # Only conversations with lines count
+    response = client.post(
+        "/movies/13/conversations/",
+        json={"character_1_id": 208, "character_2_id": 210, "lines": []},
+    )
+    assert response.status_code == 200
+    assert lines_together(208) == murdock
 
 
 def test_post_conversration_404():
@@ -195,4 +272,210 @@ def test_post_conversation_400():
     )
     assert response.status_code == 400
 
-    
\ No newline at end of file
+
+def written():
+    # Row counts of what a POST adds to, and the aggregates it updates. Read
+    # through the app's connections, which see its writes in either DB_MODE.
+    def read(conn):
+        counts = {
+            table.name: conn.execute(
+                sqlalchemy.select(sqlalchemy.func.count()).select_from(table)
+            ).scalar_one()
+            for table in (db.conversations, db.lines)
+        }
+        line_counts = {
+            row.character_id: row.num_lines
+            for row in conn.execute(sqlalchemy.select(db.character_line_counts))
+        }
+        pairs = {
+            (row.character_id, row.partner_id): (
+                row.num_conversations,
+                row.lines_together,
+            )
+            for row in conn.execute(sqlalchemy.select(db.character_pairs))
+        }
+        return counts, line_counts, pairs
+
+    with anyio.from_thread.start_blocking_portal() as portal:
+        return portal.call(db.run, read)
+
+
+def test_post_conversations_batch_01():
+    counts, line_counts, pairs = written()
+    response = client.post(
+        "/movies/13/conversations:batch",
+        headers={"Content-Type": "application/json"},
+        json=[
+            {
+                "character_1_id": 208,
+                "character_2_id": 209,
+                "lines": [
+                    {"character_id": 208, "line_text": "test"},
+                    {"character_id": 209, "line_text": "shut up"},
+                ],
+            },
+            {
+                "character_1_id": 209,
+                "character_2_id": 208,
+                "lines": [
+                    {"character_id": 209, "line_text": "the hell you just say to me?"},
+                ],
+            },
+        ],
+    )
+    assert response.status_code == 200
+    conv_ids = response.json()["conversation_ids"]
+    assert len(conv_ids) == 2 and conv_ids[0] < conv_ids[1]
+
+    response = client.get(f"/lines/conversations/{conv_ids[0]}")
+    assert response.status_code == 200
+    assert [line["line_text"] for line in response.json()] == ["test", "shut up"]
+    assert [line["character"] for line in response.json()] == ["MURDOCK", "OVEUR"]
+
+    response = client.get(f"/lines/conversations/{conv_ids[1]}")
+    assert response.status_code == 200
+    assert [line["line_text"] for line in response.json()] == [
+        "the hell you just say to me?"
+    ]
+
+    counts["conversations"] += 2
+    counts["lines"] += 3
+    line_counts[208] += 1
+    line_counts[209] += 2
+    for pair in ((208, 209), (209, 208)):
+        num_conversations, lines_together = pairs.get(pair, (0, 0))
+        pairs[pair] = (num_conversations + 2, lines_together + 3)
+    assert written() == (counts, line_counts, pairs)
+
+
+def test_post_conversations_batch_400():
+    # A line by someone else in one conversation rejects the whole batch
+    before = written()
+    response = client.post(
+        "/movies/13/conversations:batch",
+        headers={"Content-Type": "application/json"},
+        json=[
+            {
+                "character_1_id": 208,
+                "character_2_id": 209,
+                "lines": [{"character_id": 208, "line_text": "test"}],
+            },
+            {
+                "character_1_id": 208,
+                "character_2_id": 209,
+                "lines": [{"character_id": 210, "line_text": "test"}],
+            },
+        ],
+    )
+    assert response.status_code == 400
+    assert written() == before
+
+
+def test_post_conversations_batch_404():
+    # One bad conversation rejects the whole batch
+    before = written()
+    response = client.post(
+        "/movies/13/conversations:batch",
+        headers={"Content-Type": "application/json"},
+        json=[
+            {
+                "character_1_id": 208,
+                "character_2_id": 209,
+                "lines": [{"character_id": 208, "line_text": "test"}],
+            },
+            {
+                "character_1_id": 208,
+                "character_2_id": 7414,
+                "lines": [{"character_id": 208, "line_text": "test"}],
+            },
+        ],
+    )
+    assert response.status_code == 404
+    assert written() == before
+
+    response = client.post(
+        "/movies/11231287312873612833/conversations:batch",
+        headers={"Content-Type": "application/json"},
+        json=[],
+    )
+    assert response.status_code == 404
+
+    response = client.post(
+        "/movies/13/conversations:batch",
+        headers={"Content-Type": "application/json"},
+        json=[],
+    )
+    assert response.status_code == 200
+    assert response.json() == {"conversation_ids": []}
+
+
+def test_post_conversations_batch_fails_partway():
+    # A failure after some of the rows went in undoes the whole batch
+    before = written()
+    engine = db.get_async_engine().sync_engine if db.async_mode else db.engine
+    line_inserts = []
+
+    def fail_second(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT INTO lines"):
+            line_inserts.append(statement)
+            if len(line_inserts) == 2:
+                raise RuntimeError("failed partway")
+
+    sqlalchemy.event.listen(engine, "before_cursor_execute", fail_second)
+    try:
+        # One line per INSERT, so the second conversation's fails
+        with pytest.MonkeyPatch.context() as patch:
+            patch.setattr(conversations, "INSERT_CHUNK_SIZE", 1)
+            with pytest.raises(RuntimeError):
+                client.post(
+                    "/movies/13/conversations:batch",
+                    headers={"Content-Type": "application/json"},
+                    json=[
+                        {
+                            "character_1_id": 208,
+                            "character_2_id": 209,
+                            "lines": [{"character_id": 208, "line_text": "test"}],
+                        },
+                        {
+                            "character_1_id": 209,
+                            "character_2_id": 208,
+                            "lines": [{"character_id": 209, "line_text": "test"}],
+                        },
+                    ],
+                )
+    finally:
+        sqlalchemy.event.remove(engine, "before_cursor_execute", fail_second)
+
+    assert len(line_inserts) == 2
+    assert written() == before
+
+
+def test_post_conversations_batch_422(monkeypatch):
+    conversation = {
+        "character_1_id": 208,
+        "character_2_id": 209,
+        "lines": [{"character_id": 208, "line_text": "test"}] * 3,
+    }
+    monkeypatch.setattr(conversations, "MAX_BATCH_CONVERSATIONS", 2)
+    response = client.post(
+        "/movies/13/conversations:batch",
+        headers={"Content-Type": "application/json"},
+        json=[conversation] * 3,
+    )
+    assert response.status_code == 422
+
+    monkeypatch.setattr(conversations, "MAX_BATCH_LINES", 5)
+    response = client.post(
+        "/movies/13/conversations:batch",
+        headers={"Content-Type": "application/json"},
+        json=[conversation] * 2,
+    )
+    assert response.status_code == 422
+
+    monkeypatch.setattr(conversations, "MAX_BATCH_LINES", 6)
+    response = client.post(
+        "/movies/13/conversations:batch",
+        headers={"Content-Type": "application/json"},
+        json=[conversation] * 2,
+    )
+    assert response.status_code == 200
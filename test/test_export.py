@@ -0,0 +1,79 @@
+from fastapi.testclient import TestClient
+
+from src.api.server import app
+from src import database as db
+
+import csv
+import io
+import json
+import pytest
+import sqlalchemy
+
+client = TestClient(app)
+
+
+def table_rows(table):
+    with db.engine.connect() as conn:
+        return conn.execute(
+            sqlalchemy.select(sqlalchemy.func.count()).select_from(table)
+        ).scalar_one()
+
+
+def test_export_csv():
+    response = client.get("/export/characters")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert (
+        response.headers["content-disposition"]
+        == 'attachment; filename="characters.csv"'
+    )
+
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == table_rows(db.characters)
+    assert list(rows[0]) == ["character_id", "name", "movie_id", "gender", "age"]
+
+
+def test_export_lines_csv():
+    response = client.get("/export/lines?format=csv")
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == table_rows(db.lines)
+    assert "line_tsv" not in rows[0]
+
+
+def test_export_ndjson():
+    response = client.get("/export/movies?format=ndjson")
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == table_rows(db.movies)
+    movie = next(row for row in rows if row["movie_id"] == 44)
+    assert movie == {
+        "movie_id": 44,
+        "title": movie["title"],
+        "year": movie["year"],
+        "imdb_rating": movie["imdb_rating"],
+        "imdb_votes": movie["imdb_votes"],
+        "raw_script_url": movie["raw_script_url"],
+    }
+
+
+@pytest.mark.parametrize("format", ["arrow", "parquet"])
+def test_export_pyarrow(format):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    response = client.get(f"/export/conversations?format={format}")
+    assert response.status_code == 200
+    if format == "arrow":
+        table = pa.ipc.open_stream(response.content).read_all()
+    else:
+        table = pyarrow.parquet.read_table(pa.BufferReader(response.content))
+    assert table.num_rows == table_rows(db.conversations)
+    assert table.column_names == [
+        "conversation_id", "character1_id", "character2_id", "movie_id"
+    ]
+
+
+def test_export_422():
+    assert client.get("/export/data_version").status_code == 422
+    assert client.get("/export/movies?format=xml").status_code == 422
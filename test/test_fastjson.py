@@ -0,0 +1,42 @@
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+from src.api import fastjson
+from src.api.server import app
+
+client = TestClient(app)
+
+
+def fastapi_render(content):
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def test_same_bytes_01():
+    # Rendered exactly as FastAPI would have
+    for url in [
+        "/characters/?limit=250&sort=number_of_lines",
+        "/characters/0",
+        "/movies/?limit=250&sort=rating",
+        "/movies/44",
+        "/lines/conversations/0",
+    ]:
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/json"
+        assert response.content == fastapi_render(response.json())
+
+
+def test_same_bytes_02():
+    content = [
+        {"rating": 6.9, "rank": 0.0607927, "small": 1e-05, "big": 1e16},
+        {"text": "café   \"quoted\" \\ \n", "none": None, "flag": True},
+        [0.0, -0.0, 1e-4, 123456789012345.6, -2.5e-07, 2**40],
+    ]
+    assert fastjson.dumps(content) == fastapi_render(content)
+
+
+def test_headers():
+    # Headers set by the route come along
+    response = client.get("/characters/?limit=10")
+    assert "X-Next-Cursor" in response.headers
@@ -2,6 +2,8 @@ from fastapi.testclient import TestClient
 
 from src.api.server import app
 
+import csv
+import io
 import json
 
 client = TestClient(app)
@@ -31,10 +33,107 @@ def test_get_character_lines_01():
         assert response.json() == json.load(f)
 
 
+def test_get_character_lines_ndjson():
+    expected = client.get("/characters/6957/lines").json()
+
+    response = client.get(
+        "/characters/6957/lines", headers={"Accept": "application/x-ndjson"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == expected
+
+
+def test_get_character_lines_csv():
+    expected = client.get("/characters/6957/lines").json()
+
+    response = client.get("/characters/6957/lines?format=csv")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == len(expected)
+    for row, line in zip(rows, expected):
+        assert row == {key: str(value) for key, value in line.items()}
+
+
 def test_404_01():
     response = client.get("/lines/7414")
     assert response.status_code == 404
 
 def test_404_02():
     response = client.get("/lines/conversations/1231231231237414")
-    assert response.status_code == 404
\ No newline at end of file
+    assert response.status_code == 404
+
+def test_search_01():
+    response = client.get("/lines/search?q=haircut")
+    assert response.status_code == 200
+
+    with open("test/lines/92.json", encoding="utf-8") as f:
+        line = json.load(f)
+    results = response.json()
+    assert line in [
+        {k: v for k, v in result.items() if k != "rank"} for result in results
+    ]
+
+
+def test_search_02():
+    # Walking the cursors returns the same ranked rows as one big page
+    response = client.get("/lines/search?q=love&limit=100")
+    expected = response.json()
+
+    results = []
+    response = client.get("/lines/search?q=love&limit=25")
+    while len(results) < len(expected):
+        assert response.status_code == 200
+        results += response.json()
+        cursor = response.headers["X-Next-Cursor"]
+        response = client.get(f"/lines/search?q=love&limit=25&cursor={cursor}")
+
+    assert results[: len(expected)] == expected
+    ranks = [result["rank"] for result in results]
+    assert ranks == sorted(ranks, reverse=True)
+
+
+def test_search_422():
+    response = client.get("/lines/search")
+    assert response.status_code == 422
+
+
+def test_batch_01():
+    response = client.get("/lines:batch?ids=92,-1,92")
+    assert response.status_code == 200
+
+    line = client.get("/lines/92").json()
+    assert response.json() == [line, None, line]
+
+
+def walk_pages(url, limit):
+    lines = []
+    response = client.get(f"{url}?limit={limit}")
+    while True:
+        assert response.status_code == 200
+        lines += response.json()
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return lines
+        response = client.get(f"{url}?limit={limit}&cursor={cursor}")
+
+
+def test_character_lines_cursor():
+    # Walking the cursors returns the same lines as one page
+    lines = client.get("/characters/2/lines").json()
+    assert len(lines) > 10
+    assert walk_pages("/characters/2/lines", 10) == lines
+
+
+def test_conversation_cursor():
+    lines = client.get("/lines/conversations/0").json()
+    assert len(lines) > 2
+    assert walk_pages("/lines/conversations/0", 2) == lines
+
+
+def test_lines_cursor_400():
+    response = client.get("/characters/2/lines?cursor=bulin")
+    assert response.status_code == 400
+    response = client.get("/lines/conversations/0?cursor=bulin")
+    assert response.status_code == 400
@@ -0,0 +1,13 @@
+from test import make_lines
+
+import csv
+import os
+
+
+def test_lines_fixture_is_current():
+    # test/lines.csv is what make_lines.py makes from the fixtures now; if
+    # not, run python -m test.make_lines
+    path = os.path.join(make_lines.TEST_DIR, "lines.csv")
+    with open(path, newline="", encoding="utf-8") as f:
+        shipped = list(csv.reader(f))
+    assert shipped == [[str(value) for value in row] for row in make_lines.lines()]
@@ -0,0 +1,150 @@
+from fastapi.testclient import TestClient
+
+from src.api.server import app
+from src import memstore
+from src import cache
+from src import database as db
+
+import anyio.from_thread
+import pytest
+import sqlalchemy
+
+client = TestClient(app)
+
+urls = [
+    "/movies/44",
+    "/movies/436",
+    "/movies/1",
+    "/movies/",
+    "/movies/?name=as&limit=20&offset=10&sort=movie_title",
+    "/movies/?name=the&limit=50&offset=0&sort=year",
+    "/movies/?limit=250&offset=200&sort=rating",
+    "/characters/7421",
+    "/characters/2",
+    "/characters/400",
+    "/characters/",
+    "/characters/?name=amy&limit=50&offset=0&sort=number_of_lines",
+    "/characters/?name=%20&limit=250&offset=42&sort=movie",
+    "/characters/?name=JOHN&limit=20&sort=number_of_lines",
+    "/movies/?name=Space&sort=year",
+    "/characters/6957/lines",
+    "/lines/92",
+    "/lines/7414",
+    "/lines/conversations/0",
+    "/lines/conversations/1231231231237414",
+]
+
+
+@pytest.fixture(scope="module")
+def store():
+    memstore.load()
+    yield memstore.store
+    memstore.store = None
+
+
+@pytest.mark.parametrize("url", urls)
+def test_memstore_matches_postgres(store, url):
+    memstore.store = None
+    cache.cache.clear()
+    expected = client.get(url)
+
+    memstore.store = store
+    cache.cache.clear()
+    response = client.get(url)
+    assert response.status_code == expected.status_code
+    assert response.json() == expected.json()
+
+
+# Names that a linguistic collation orders differently from code points
+mixed_names = ["QX b", "QX B", "QX e", "QX É", "QX é", "QX Z", "QX a", "QX Ä"]
+
+
+def _linguistic_collation(conn):
+    # The first collation the database has that's neither C nor broken, as
+    # an ICU one is without ICU support
+    for (name,) in conn.execute(
+        sqlalchemy.text(
+            "SELECT collname FROM pg_collation"
+            " WHERE collprovider IN ('c', 'i')"
+            " AND collname NOT IN ('C', 'POSIX', 'ucs_basic')"
+            " AND collname NOT LIKE 'C.%'"
+            " ORDER BY collname = 'unicode' DESC, collname"
+        )
+    ):
+        try:
+            with conn.begin_nested():
+                conn.execute(sqlalchemy.text(f"SELECT 'a' < 'B' COLLATE \"{name}\""))
+            return name
+        except sqlalchemy.exc.DBAPIError:
+            pass
+    return None
+
+
+def add_mixed_names():
+    # A movie and a character for each name, with a line count so they're
+    # listed. The columns get a linguistic collation, where the database has
+    # one, so the order doesn't come out right just because the database's
+    # own collation is C.
+    def add(conn):
+        collation = _linguistic_collation(conn)
+        if collation is not None:
+            for table, column in [("characters", "name"), ("movies", "title")]:
+                conn.execute(
+                    sqlalchemy.text(
+                        f"ALTER TABLE {table} ALTER COLUMN {column}"
+                        f' TYPE text COLLATE "{collation}"'
+                    )
+                )
+        for i, name in enumerate(mixed_names):
+            movie_id = 900000 + i
+            character_id = 900000 + i
+            conn.execute(
+                sqlalchemy.insert(db.movies).values(
+                    movie_id=movie_id, title=name, year=name
+                )
+            )
+            conn.execute(
+                sqlalchemy.insert(db.characters).values(
+                    character_id=character_id, name=name, movie_id=movie_id
+                )
+            )
+            conn.execute(
+                sqlalchemy.insert(db.character_line_counts).values(
+                    character_id=character_id, movie_id=movie_id, num_lines=1
+                )
+            )
+        conn.commit()
+
+    with anyio.from_thread.start_blocking_portal() as portal:
+        portal.call(db.run, add)
+
+
+@pytest.mark.parametrize(
+    "url, field",
+    [
+        ("/characters/?name=qx&sort=character", "character"),
+        ("/characters/?name=qx&sort=movie", "movie"),
+        ("/movies/?name=qx&sort=movie_title", "movie_title"),
+        ("/movies/?name=qx&sort=year", "movie_title"),
+    ],
+)
+def test_names_sort_by_code_point(monkeypatch, url, field):
+    # Postgres sorts names as the memory read engine does, by code point, and
+    # its cursors page through them in that order too
+    monkeypatch.setattr(memstore, "store", None)
+    add_mixed_names()
+    expected = sorted(mixed_names)
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert [row[field] for row in response.json()] == expected
+
+    names = []
+    response = client.get(f"{url}&limit=3")
+    while response.json():
+        names += [row[field] for row in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        response = client.get(f"{url}&limit=3&cursor={cursor}")
+    assert names == expected
@@ -0,0 +1,191 @@
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.api.server import app
+from src import cache
+from src import database as db
+from src import memstore
+from src.database import get_async_engine
+import anyio.from_thread
+import pytest
+import sqlalchemy
+
+client = TestClient(app)
+
+
+def samples():
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+    values = {}
+    for line in response.text.splitlines():
+        if not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            values[name] = float(value)
+    return values
+
+
+def run(fn):
+    with anyio.from_thread.start_blocking_portal() as portal:
+        return portal.call(db.run, fn)
+
+
+def test_pool_metrics():
+    before = samples()
+    client.get("/movies/44")
+    after = samples()
+    assert after["db_pool_checkout_seconds_count"] > before.get(
+        "db_pool_checkout_seconds_count", 0
+    )
+    assert after['db_pool_checkout_seconds_bucket{le="+Inf"}'] == (
+        after["db_pool_checkout_seconds_count"]
+    )
+
+
+def engine_with(monkeypatch, pool_size, max_overflow=0):
+    # A new engine for the app in its DB_MODE, with these pool settings
+    monkeypatch.setattr(db, "POOL_SIZE", pool_size)
+    monkeypatch.setattr(db, "MAX_OVERFLOW", max_overflow)
+    url = db.database_connection_url()
+    if db.async_mode:
+        engine = create_async_engine(
+            url.replace("postgresql://", "postgresql+asyncpg://", 1),
+            **db.engine_options(),
+        )
+        monkeypatch.setattr(db, "get_async_engine", lambda: engine)
+        monkeypatch.setattr(db, "_async_engine", engine)
+        return engine
+    engine = sqlalchemy.create_engine(url, **db.engine_options())
+    monkeypatch.setattr(db, "_engine", engine)
+    return engine
+
+
+async def dispose(engine):
+    if db.async_mode:
+        await engine.dispose()
+    else:
+        engine.dispose()
+
+
+def test_pool_exhausted(monkeypatch):
+    monkeypatch.setenv("DB_POOL_TIMEOUT", "1")
+    engine = engine_with(monkeypatch, pool_size=1)
+    before = samples()
+
+    async def exhaust():
+        # Holds the pool's only connection while another request waits for it
+        batches = db.stream(sqlalchemy.select(sqlalchemy.literal(1)))
+        try:
+            await batches.__anext__()
+            with pytest.raises(sqlalchemy.exc.TimeoutError):
+                await db.run(lambda conn: conn.execute(sqlalchemy.select(1)).all())
+        finally:
+            await batches.aclose()
+            await dispose(engine)
+
+    with anyio.from_thread.start_blocking_portal() as portal:
+        portal.call(exhaust)
+
+    after = samples()
+    assert after["db_pool_exhausted_total"] == before["db_pool_exhausted_total"] + 1
+    assert after["db_pool_timeouts_total"] == before["db_pool_timeouts_total"] + 1
+
+
+def server_timing(response):
+    timings = {}
+    for metric in response.headers["Server-Timing"].split(", "):
+        name, param = metric.split(";", 1)
+        key, value = param.split("=", 1)
+        timings[name] = float(value.strip('"'))
+    return timings
+
+
+def test_server_timing():
+    cache.cache.clear()
+    first = server_timing(client.get("/characters/?limit=250"))
+    if not memstore.enabled():
+        assert first["queries"] >= 1
+        assert first["rows"] >= 250
+        assert first["db"] > 0
+    assert first["total"] >= first["db"]
+
+    # Served from the cache
+    second = server_timing(client.get("/characters/?limit=250"))
+    assert second["queries"] == 0
+    assert second["db"] == 0
+
+
+def test_get_movie_one_query():
+    # The movie and its top characters come from one query, on one connection
+    client.get("/movies/1")
+    cache.cache.clear()
+    timings = server_timing(client.get("/movies/44"))
+    if not memstore.enabled():
+        assert timings["queries"] == 1
+
+
+def test_request_histograms():
+    client.get("/movies/44")
+    text = client.get("/metrics").text
+    for name in [
+        "http_request_duration_seconds",
+        "http_request_db_seconds",
+        "http_request_queries",
+        "http_request_rows",
+        "http_response_serialize_seconds",
+    ]:
+        assert f'{name}_count{{route="/movies/{{movie_id}}"}}' in text
+
+
+def test_null_pool(monkeypatch):
+    engine = engine_with(monkeypatch, pool_size=0)
+    pool = engine.sync_engine.pool if db.async_mode else engine.pool
+    assert isinstance(pool, sqlalchemy.pool.NullPool)
+
+    before = samples()
+    assert run(lambda conn: conn.execute(sqlalchemy.select(1)).scalar_one()) == 1
+    after = samples()
+    # Each checkout is a new connection, so there's no limit to wait on
+    assert after["db_pool_exhausted_total"] == before["db_pool_exhausted_total"]
+    assert after["db_pool_size"] == 0
+    assert all(
+        value == 0
+        for name, value in after.items()
+        if name.startswith("db_pool_checked_out")
+    )
+
+    with anyio.from_thread.start_blocking_portal() as portal:
+        portal.call(dispose, engine)
+
+
+def test_statement_timeout(monkeypatch):
+    monkeypatch.setattr(db, "STATEMENT_TIMEOUT", 100)
+    show = "SHOW statement_timeout"
+    assert run(lambda conn: conn.exec_driver_sql(show).scalar_one()) == "100ms"
+
+    with pytest.raises(sqlalchemy.exc.DBAPIError, match="statement timeout"):
+        run(lambda conn: conn.exec_driver_sql("SELECT pg_sleep(5)").all())
+
+
+def test_pgbouncer(monkeypatch):
+    # Without prepared statements cached by asyncpg or SQLAlchemy, which a
+    # PgBouncer in transaction mode can hand to another server connection
+    monkeypatch.setattr(db, "PGBOUNCER", True)
+    monkeypatch.setattr(db, "_async_engine", None)
+    monkeypatch.setattr(db, "_async_engine_loop", None)
+
+    async def caches():
+        engine = get_async_engine()
+        try:
+            async with engine.connect() as conn:
+                raw = await conn.get_raw_connection()
+                return (
+                    raw.driver_connection._stmt_cache.get_max_size(),
+                    raw.dbapi_connection._prepared_statement_cache,
+                )
+        finally:
+            await engine.dispose()
+
+    with anyio.from_thread.start_blocking_portal() as portal:
+        assert portal.call(caches) == (0, None)
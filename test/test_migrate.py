@@ -0,0 +1,30 @@
+from src import database as db
+from src import migrate
+
+import sqlalchemy
+
+
+def test_missing_extension_leaves_migration_pending(tmp_path, monkeypatch, capsys):
+    (tmp_path / "9001_needs_extension.sql").write_text(
+        "-- Requires extension: no_such_extension\n"
+        "CREATE EXTENSION no_such_extension;\n"
+    )
+    (tmp_path / "9002_table.sql").write_text(
+        "CREATE TABLE migrate_test (id integer);\n"
+    )
+    monkeypatch.setattr(migrate, "MIGRATIONS", str(tmp_path))
+
+    assert migrate.upgrade(db.get_engine()) == ["9002_table.sql"]
+    with db.get_engine().begin() as conn:
+        done = migrate.applied(conn)
+        assert migrate.missing_extensions(conn, "9001_needs_extension.sql") == [
+            "no_such_extension"
+        ]
+        conn.execute(sqlalchemy.text("SELECT FROM migrate_test"))
+    assert 9002 in done
+    assert 9001 not in done
+
+    # Tried again on the next run
+    capsys.readouterr()
+    assert migrate.upgrade(db.get_engine()) == []
+    assert "skipped 9001_needs_extension.sql" in capsys.readouterr().err
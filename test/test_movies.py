@@ -74,3 +74,47 @@ def test_sort_filter2():
 def test_404():
     response = client.get("/movies/1")
     assert response.status_code == 404
+
+
+def test_cursor_01():
+    # Walking the cursors returns the same rows as one big offset page
+    response = client.get("/movies/?limit=250&offset=0&sort=rating")
+    expected = response.json()
+
+    movies = []
+    response = client.get("/movies/?limit=50&sort=rating")
+    while len(movies) < len(expected):
+        assert response.status_code == 200
+        movies += response.json()
+        cursor = response.headers["X-Next-Cursor"]
+        response = client.get(f"/movies/?limit=50&sort=rating&cursor={cursor}")
+
+    assert movies[: len(expected)] == expected
+
+
+def test_cursor_02():
+    # Short pages are the last page
+    response = client.get("/movies/?name=the&limit=250&sort=year")
+    assert response.status_code == 200
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_cursor_400():
+    response = client.get("/movies/?cursor=bulin")
+    assert response.status_code == 400
+
+    # Cursors only work with the sort they came from
+    cursor = client.get("/movies/?limit=1").headers["X-Next-Cursor"]
+    response = client.get(f"/movies/?sort=year&cursor={cursor}")
+    assert response.status_code == 400
+
+
+def test_batch_01():
+    response = client.get("/movies:batch?ids=44,100000,0")
+    assert response.status_code == 200
+
+    assert response.json() == [
+        client.get("/movies/44").json(),
+        None,
+        client.get("/movies/0").json(),
+    ]
@@ -0,0 +1,192 @@
+from fastapi.testclient import TestClient
+
+from src.api.server import app
+from src import database as db
+from src import cache
+from src import memstore
+import pytest
+import sqlalchemy
+
+client = TestClient(app)
+
+# Every read route with the parameters that change its query. Exports read
+# whole tables on purpose, so they aren't here.
+urls = [
+    "/movies/44",
+    "/movies/?name=the&sort=movie_title",
+    "/movies/?sort=year",
+    "/movies/?sort=rating&limit=250",
+    "/movies:batch?ids=0,44,100000",
+    "/characters/2",
+    "/characters/?name=an&sort=character",
+    "/characters/?sort=movie",
+    "/characters/?sort=number_of_lines&limit=250",
+    "/characters:batch?ids=0,2,400",
+    "/characters/2/lines",
+    "/characters/2/lines?limit=10&cursor={cursor}",
+    "/characters/2/lines?format=ndjson",
+    "/lines/92",
+    "/lines:batch?ids=1,92,100000000",
+    "/lines/conversations/0",
+    "/lines/conversations/0?limit=2&cursor={cursor}",
+    "/lines/search?q=never",
+    "/lines/search?q=never&cursor={cursor}",
+]
+
+# The writes, each with a request body
+posts = [
+    (
+        "/movies/13/conversations/",
+        {
+            "character_1_id": 208,
+            "character_2_id": 209,
+            "lines": [
+                {"character_id": 208, "line_text": "test"},
+                {"character_id": 209, "line_text": "shut up"},
+            ],
+        },
+    ),
+    (
+        "/movies/13/conversations:batch",
+        [
+            {
+                "character_1_id": 208,
+                "character_2_id": 209,
+                "lines": [{"character_id": 208, "line_text": "test"}],
+            },
+            {
+                "character_1_id": 209,
+                "character_2_id": 208,
+                "lines": [{"character_id": 209, "line_text": "shut up"}],
+            },
+        ],
+    ),
+]
+
+pytestmark = pytest.mark.skipif(
+    memstore.enabled(), reason="the memory read engine doesn't query Postgres"
+)
+
+
+def captured_statements(url, body=None):
+    """
+    The SELECT, INSERT, UPDATE and DELETE statements a request to `url` runs,
+    a POST of `body` if it's given. A `{cursor}` in `url` is filled in with the
+    first page's cursor.
+    """
+    if "{cursor}" in url:
+        first_page = client.get(url.split("cursor=")[0].rstrip("&?"))
+        url = url.format(cursor=first_page.headers["X-Next-Cursor"])
+
+    statements = []
+
+    def capture(conn, clauseelement, multiparams, params, execution_options):
+        if getattr(clauseelement, "is_select", False) or getattr(
+            clauseelement, "is_dml", False
+        ):
+            statements.append(clauseelement)
+
+    # On the class, so it sees the async engines too
+    sqlalchemy.event.listen(sqlalchemy.engine.Engine, "before_execute", capture)
+    try:
+        cache.cache.clear()
+        if body is None:
+            response = client.get(url)
+        else:
+            response = client.post(url, json=body)
+    finally:
+        sqlalchemy.event.remove(sqlalchemy.engine.Engine, "before_execute", capture)
+    assert response.status_code == 200, response.text
+    return statements
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from plan_nodes(child)
+
+
+def explain(stmt):
+    with db.engine.begin() as conn:
+        # Postgres picks a sequential scan for a small enough table even when
+        # an index would do. Without them, it only does when no index can be
+        # used, which is what this checks for, whatever the size of the data.
+        conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        compiled = stmt.compile(
+            dialect=conn.dialect, compile_kwargs={"render_postcompile": True}
+        )
+        (result,) = conn.exec_driver_sql(
+            f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params
+        ).one()
+    return result[0]["Plan"]
+
+
+def full_scan(node):
+    # A sequential scan, or walking a whole index just for its order, e.g.
+    # the primary key's when there's no index on the filtered column
+    if node["Node Type"] == "Seq Scan":
+        return True
+    return node["Node Type"] in ("Index Scan", "Index Only Scan") and (
+        "Index Cond" not in node
+    )
+
+
+@pytest.mark.parametrize("url", urls)
+def test_no_full_scan_of_lines(url):
+    statements = captured_statements(url)
+    assert statements
+
+    for stmt in statements:
+        scans = [
+            node
+            for node in plan_nodes(explain(stmt))
+            if node.get("Relation Name") == "lines" and full_scan(node)
+        ]
+        assert not scans, f"full scan of lines for {url}:\n{stmt}"
+
+
+@pytest.mark.parametrize("url, body", posts)
+def test_no_full_scan_writing(url, body):
+    # The checks, id allocation, inserts and aggregate upserts of a write.
+    # data_version is a single row, updated whole.
+    statements = captured_statements(url, body)
+    assert any(stmt.is_insert for stmt in statements)
+
+    for stmt in statements:
+        if getattr(stmt, "table", None) is db.data_version:
+            continue
+        scans = [
+            node
+            for node in plan_nodes(explain(stmt))
+            if "Relation Name" in node and full_scan(node)
+        ]
+        assert not scans, f"full scan for {url}:\n{stmt}"
+
+
+def has_index(name):
+    with db.engine.connect() as conn:
+        return conn.execute(
+            sqlalchemy.text("SELECT FROM pg_indexes WHERE indexname = :name"),
+            {"name": name},
+        ).first() is not None
+
+
+# migrations/0003_name_trigram_indexes.sql, skipped without pg_trgm
+@pytest.mark.parametrize(
+    "url, index",
+    [
+        ("/characters/?name=amy", "characters_name_trgm_idx"),
+        ("/movies/?name=big", "movies_title_trgm_idx"),
+    ],
+)
+def test_name_filter_uses_trigram_index(url, index):
+    if not has_index(index):
+        pytest.skip(f"no {index}, the database doesn't have pg_trgm")
+
+    scans = [
+        node
+        for stmt in captured_statements(url)
+        for node in plan_nodes(explain(stmt))
+        if node["Node Type"] == "Bitmap Index Scan"
+    ]
+    assert index in [node["Index Name"] for node in scans], url
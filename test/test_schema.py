@@ -0,0 +1,61 @@
+from src import database as db
+from src import loader
+from src import migrate
+
+import pytest
+import sqlalchemy
+from sqlalchemy.schema import AddConstraint, CreateTable
+
+# The tables src/database.py declares against the ones migrations/ makes. The
+# test database was loaded from the declarations themselves, so each test
+# builds the schema again in a schema of its own instead: the data tables as
+# they were before any migration, with just their columns and keys, and then
+# every migration applied to them. It's rolled back with the test.
+
+
+@pytest.fixture
+def migrated():
+    with db.get_engine().connect() as conn:
+        conn.exec_driver_sql("CREATE SCHEMA migrated")
+        conn.exec_driver_sql("SET LOCAL search_path TO migrated")
+        for table in loader.TABLES:
+            conn.execute(CreateTable(loader._bare_table(table)))
+        for table in loader.TABLES:
+            conn.execute(AddConstraint(table.primary_key))
+            for constraint in table.foreign_key_constraints:
+                conn.execute(AddConstraint(constraint))
+        migrate.reapply(conn)
+
+        metadata = sqlalchemy.MetaData()
+        metadata.reflect(conn, schema="migrated", only=list(db.metadata_obj.tables))
+        yield {table.name: table for table in metadata.tables.values()}
+
+
+def _foreign_keys(table):
+    return sorted(
+        (key.parent.name, key.column.table.name, key.column.name)
+        for key in table.foreign_keys
+    )
+
+
+@pytest.mark.parametrize("name", list(db.metadata_obj.tables))
+def test_declared_table_matches_migrations(migrated, name):
+    dialect = db.get_engine().dialect
+    declared = db.metadata_obj.tables[name]
+    actual = migrated[name]
+    assert declared.c.keys() == actual.c.keys()
+    for column in declared.c:
+        actual_column = actual.c[column.name]
+        assert column.type.compile(dialect=dialect) == (
+            actual_column.type.compile(dialect=dialect)
+        ), column.name
+        assert column.nullable == actual_column.nullable, column.name
+        assert column.primary_key == actual_column.primary_key, column.name
+        # Generated or defaulted in the database, the way the app expects
+        assert (column.computed is None) == (
+            actual_column.computed is None
+        ), column.name
+        assert (column.server_default is None) == (
+            actual_column.server_default is None
+        ), column.name
+    assert _foreign_keys(declared) == _foreign_keys(actual)